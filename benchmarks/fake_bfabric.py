@@ -0,0 +1,147 @@
+"""
+In-process stand-in for the B-Fabric wrapper returned by bfabric_interface.get_wrapper().
+
+It serves one synthetic run (run -> rununit -> rununitlane -> sample -> container) of a
+configurable size, sleeps a configurable latency on every call and counts the calls per
+endpoint, so the entity walk can be measured without a live B-Fabric.
+"""
+
+import threading
+import time
+from collections import Counter
+
+
+# Named sizes, from a single-lane MiSeq-like run up to a full NovaSeq flowcell.
+SCENARIOS = {
+    "small": {"lanes": 1, "samples": 10, "orders": 1},
+    "medium": {"lanes": 4, "samples": 400, "orders": 12},
+    "large": {"lanes": 8, "samples": 3000, "orders": 60},
+}
+
+RUN_ID = 1
+RUNUNIT_ID = 10
+
+
+def _indexes(number: int, length: int = 8) -> tuple:
+    # Deterministic i7/i5 barcodes: i7 spells the number in base 4 and i5 sums neighbouring
+    # digits, so the barcodes of any two numbers below 4 ** length differ in at least 3 bases.
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, 4)
+        digits.append(digit)
+    index = "".join("ACGT"[digit] for digit in digits)
+    index2 = "".join("ACGT"[(digits[i] + digits[(i + 1) % length]) % 4] for i in range(length))
+    return index, index2
+
+
+class FakeBfabric:
+    """
+    Fake B-Fabric wrapper implementing the read calls used by extended_entity_data.
+    """
+
+    def __init__(self, lanes: int = 1, samples: int = 10, orders: int = 1, latency: float = 0.0, server: str = "fgcz-c-042", datafolder: str = "20250101_A01234_0001_BHXXXXXXXX"):
+        """
+        Args:
+            lanes (int): Number of lanes of the run.
+            samples (int): Total number of samples, spread evenly over the lanes.
+            orders (int): Number of orders the samples belong to, assigned round robin.
+            latency (float): Seconds every read sleeps before answering.
+            server (str): serverlocation of the run.
+            datafolder (str): datafolder of the run.
+        """
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+        order_ids = [1000 + i for i in range(orders)]
+        self.containers = {str(order_id): {"id": order_id, "classname": "order", "name": f"Order {order_id}"} for order_id in order_ids}
+
+        self.samples = {}
+        self.lanes = {}
+        per_lane = max(1, samples // lanes)
+        for lane in range(lanes):
+            lane_samples = []
+            for i in range(per_lane):
+                sample_id = 100000 + lane * per_lane + i
+                order_id = order_ids[(lane * per_lane + i) % orders]
+                self.samples[str(sample_id)] = {
+                    "id": sample_id,
+                    "name": f"Sample_{sample_id}",
+                    "container": {"id": order_id, "classname": "order"},
+                    "multiplexiddmx": _indexes(sample_id)[0],
+                    "multiplexid2dmx": _indexes(sample_id)[1],
+                }
+                lane_samples.append({"id": sample_id})
+            lane_id = 500 + lane
+            self.lanes[str(lane_id)] = {"id": lane_id, "position": lane + 1, "sample": lane_samples}
+
+        self.rununit = {"id": RUNUNIT_ID, "rununitlane": [{"id": lane["id"]} for lane in self.lanes.values()]}
+        self.run = {
+            "id": RUN_ID,
+            "name": f"Synthetic run ({lanes} lanes, {samples} samples, {orders} orders)",
+            "createdby": "benchmark",
+            "created": "2025-01-01 00:00:00",
+            "modified": "2025-01-01 00:00:00",
+            "rununit": {"id": RUNUNIT_ID},
+            "container": [{"id": order_id, "classname": "order"} for order_id in order_ids],
+            "serverlocation": server,
+            "datafolder": datafolder,
+        }
+
+    @classmethod
+    def from_scenario(cls, name: str, latency: float = 0.0):
+        return cls(latency=latency, **SCENARIOS[name])
+
+    def token_data(self) -> dict:
+        """
+        Token data pointing at the synthetic run, as produced by process_url_and_token.
+        """
+        return {
+            "entityClass_data": "Run",
+            "entity_id_data": RUN_ID,
+            "environment": "test",
+            "user_data": "benchmark",
+            "jobId": 0,
+        }
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def read(self, endpoint, obj=None, max_results=None, **kwargs):
+        with self._lock:
+            self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        ids = (obj or {}).get("id", [])
+        ids = [str(elt) for elt in ids] if isinstance(ids, (list, tuple)) else [str(ids)]
+
+        table = {
+            "run": {str(RUN_ID): self.run},
+            "rununit": {str(RUNUNIT_ID): self.rununit},
+            "rununitlane": self.lanes,
+            "sample": self.samples,
+            "container": self.containers,
+        }.get(endpoint, {})
+        return [table[elt] for elt in ids if elt in table]
+
+
+class FakeLogger:
+    """
+    Stand-in for the bfabric_web_apps Logger that keeps records in memory and never writes to B-Fabric.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.logs = []
+
+    def log_operation(self, operation, message, params=None, flush_logs=True):
+        self.logs.append(f"{operation.upper()} | {message}")
+
+    def logthis(self, api_call, *args, params=None, flush_logs=True, **kwargs):
+        result = api_call(*args, **kwargs)
+        self.log_operation(api_call.__name__, f"{kwargs.get('endpoint')}", params, flush_logs=flush_logs)
+        return result
+
+    def flush_logs(self):
+        self.logs = []
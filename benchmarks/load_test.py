@@ -0,0 +1,288 @@
+"""
+Load test of the Dash callbacks of index.py with concurrent simulated operators.
+
+Each operator loops through a session the way the browser drives it, posting to
+/_dash-update-component with the Flask test client:
+
+    update_extended_entity_data -> update_ui -> update_dropdown -> update_routing_info
+    -> handle_draugr_submission, polling get_queue_details between steps.
+
+B-Fabric is replaced by benchmarks/fake_bfabric.py and Redis by fakeredis with Lua support
+(pip install -r requirements-dev.txt), or by the Redis given with --redis (use a spare Redis without
+workers, its database is flushed). Jobs are enqueued but never run. Callbacks registered clientside (CLIENTSIDE_CALLBACKS) never reach the server and are
+skipped.
+
+For every number of operators the report lists the throughput and, per callback, the
+p50/p95/p99 latency and the error rate. Errors are HTTP errors, and submissions showing
+the failure alert.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --users 1 5 10 25 50 --duration 30 --scenario large --latency 0.05
+    python benchmarks/load_test.py --redis redis://localhost:6379/15 --output load.json
+"""
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import os
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.fake_bfabric import FakeBfabric, SCENARIOS
+from benchmarks.run_benchmarks import offline_backend, use_redis
+
+# The session steps, in order, with the callback serving each.
+STEPS = [
+    "update_extended_entity_data",
+    "update_ui",
+    "update_dropdown",
+    "update_routing_info",
+    "handle_draugr_submission",
+]
+QUEUE_POLL = "get_queue_details"
+
+
+def load_app(redis_url: str = None):
+    """
+    Imports index against the given Redis, with settings fit for a load test: no admission
+    limit (jobs never run, so queues only grow) and traces written to a temporary file.
+    """
+    os.environ.setdefault("HOST_MAX_OUTSTANDING", str(10 ** 9))
+    os.environ.setdefault("TRACE_FILE", os.path.join(tempfile.mkdtemp(), "traces.jsonl"))
+    conn = use_redis(redis_url)
+    import index
+    import bfabric_web_apps
+    if bfabric_web_apps.q("load-test").connection is not conn:
+        raise SystemExit("bfabric_web_apps.q does not use the load test's Redis; refusing to enqueue jobs.")
+    return index.app
+
+
+class CallbackClient:
+    """
+    Posts callback requests the way the Dash renderer does, building them from the app's callback map.
+    """
+
+    def __init__(self, app):
+        self.client = app.server.test_client()
+        self.callbacks = {}
+        for output, entry in app.callback_map.items():
+            name = getattr(entry.get("callback"), "__name__", None)
+            if name:
+                self.callbacks.setdefault(name, (output, entry))
+
+    def has(self, name: str) -> bool:
+        return name in self.callbacks
+
+    def call(self, name: str, values: dict, changed: str) -> tuple:
+        """
+        Runs a callback.
+
+        Args:
+            name (str): The callback function's name.
+            values (dict): {"<id>.<property>": value} for its inputs and states; missing ones are None.
+            changed (str): The input that triggered it, "<id>.<property>".
+
+        Returns:
+            tuple: (HTTP status, {"<id>.<property>": value} of the updated outputs)
+        """
+        output, entry = self.callbacks[name]
+        if output.startswith(".."):
+            outputs = [self._prop(part) for part in output[2:-2].split("...")]
+        else:
+            outputs = self._prop(output)
+
+        def with_values(dependencies):
+            return [{**dependency, "value": values.get(f"{dependency['id']}.{dependency['property']}")} for dependency in dependencies]
+
+        response = self.client.post("/_dash-update-component", json={
+            "output": output,
+            "outputs": outputs,
+            "inputs": with_values(entry["inputs"]),
+            "state": with_values(entry["state"]),
+            "changedPropIds": [changed],
+        })
+        if response.status_code != 200:
+            return response.status_code, {}
+        updated = {}
+        for component_id, props in (response.get_json() or {}).get("response", {}).items():
+            for prop, value in props.items():
+                updated[f"{component_id}.{prop}"] = value
+        return response.status_code, updated
+
+    @staticmethod
+    def _prop(part: str) -> dict:
+        component_id, prop = part.rsplit(".", 1)
+        return {"id": component_id, "property": prop.split("@")[0]}
+
+
+class Recorder:
+    """
+    Collects the latency and outcome of every callback request, across threads.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, error: bool):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            if error:
+                self.errors[name] += 1
+
+
+def _quantile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def operator(app, fake: FakeBfabric, recorder: Recorder, deadline: float, think: float, seed: int):
+    """
+    One simulated operator, running sessions until the deadline.
+    """
+    client = CallbackClient(app)
+    rng = random.Random(seed)
+    token_data = fake.token_data()
+    orders = [order["id"] for order in fake.run["container"]]
+
+    def step(name, values, changed):
+        start = time.perf_counter()
+        try:
+            status, updated = client.call(name, values, changed)
+            error = status >= 400
+        except Exception as e:
+            print(f"{name} raised: {e}")
+            status, updated, error = 500, {}, True
+        if name == "handle_draugr_submission" and updated.get("alert-fade-fail.is_open"):
+            error = True
+        recorder.add(name, time.perf_counter() - start, error)
+        if think:
+            time.sleep(rng.uniform(0, 2 * think))
+        return updated
+
+    session = 0
+    while time.time() < deadline:
+        session += 1
+        state = {"token_data.data": token_data, "url.search": "?token=load-test"}
+
+        state.update(step("update_extended_entity_data", state, "token_data.data"))
+        step("update_ui", state, "extended-entity-data.data")
+        if client.has("update_dropdown"):
+            state.update(step("update_dropdown", state, "extended-entity-data.data"))
+        if client.has(QUEUE_POLL):
+            state["queue-snapshot-version.data"] = step(QUEUE_POLL, {**state, "queue-interval.n_intervals": session}, "queue-interval.n_intervals").get(
+                "queue-snapshot-version.data", state.get("queue-snapshot-version.data")
+            )
+
+        # Each session submits a different selection, so submissions are not deduplicated.
+        state.update({
+            "draugr-dropdown.value": rng.sample(orders, rng.randint(1, len(orders))),
+            "modal-confirmation.is_open": True,
+            "wizard.on": False,
+            "multiome.on": False,
+            "force-submit.on": False,
+            "staged-submit.on": False,
+            "fanout-mode.value": "none",
+            "reuse-demux.on": False,
+            "precomputed-ss.on": False,
+            "Submit.n_clicks": session,
+        })
+        step("update_routing_info", state, "modal-confirmation.is_open")
+        step("handle_draugr_submission", state, "Submit.n_clicks")
+        if time.time() >= deadline:
+            break
+
+
+def run_load(app, fake: FakeBfabric, users: int, duration: float, think: float) -> dict:
+    """
+    Runs users operators concurrently for duration seconds.
+
+    Returns:
+        dict: {"users", "seconds", "requests", "throughput", "callbacks": {name: {"requests",
+               "p50", "p95", "p99", "error_rate"}}}, latencies in seconds.
+    """
+    recorder = Recorder()
+    deadline = time.time() + duration
+    threads = [
+        threading.Thread(target=operator, args=(app, fake, recorder, deadline, think, seed), daemon=True)
+        for seed in range(users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    callbacks = {}
+    for name, latencies in recorder.latencies.items():
+        callbacks[name] = {
+            "requests": len(latencies),
+            "p50": _quantile(latencies, 0.5),
+            "p95": _quantile(latencies, 0.95),
+            "p99": _quantile(latencies, 0.99),
+            "error_rate": recorder.errors[name] / len(latencies),
+        }
+    requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        "users": users,
+        "seconds": seconds,
+        "requests": requests,
+        "throughput": requests / seconds,
+        "callbacks": callbacks,
+    }
+
+
+def print_report(results: list):
+    print(f"{'users':>5} {'callback':<28} {'requests':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for result in results:
+        for name in STEPS + [QUEUE_POLL]:
+            r = result["callbacks"].get(name)
+            if not r:
+                continue
+            print(f"{result['users']:>5} {name:<28} {r['requests']:>9} {r['p50'] * 1000:>9.1f} {r['p95'] * 1000:>9.1f} "
+                  f"{r['p99'] * 1000:>9.1f} {r['error_rate']:>7.1%}")
+        print(f"{result['users']:>5} {'total':<28} {result['requests']:>9} {result['throughput']:>9.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Draugr UI callbacks with concurrent operators.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10, 25],
+                        help="Numbers of concurrent operators to run, one load step each.")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="Seconds each load step runs.")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="Average seconds an operator pauses after each step.")
+    parser.add_argument("--scenario", default="medium", choices=list(SCENARIOS),
+                        help="Synthetic run size.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds every fake B-Fabric call takes.")
+    parser.add_argument("--redis", type=str, default=None,
+                        help="URL of a Redis to use instead of fakeredis. Its database is flushed.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    app = load_app(args.redis)
+    fake = FakeBfabric.from_scenario(args.scenario, latency=args.latency)
+    patches = offline_backend(fake, cache=True)
+    for patch in patches:
+        patch.start()
+    try:
+        results = [run_load(app, fake, users, args.duration, args.think) for users in args.users]
+    finally:
+        for patch in patches:
+            patch.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,234 @@
+"""
+Offline benchmarks for the entity walk, the lane card rendering and the Draugr command generation.
+
+Everything runs against benchmarks/fake_bfabric.py, so no B-Fabric is needed. Importing
+index starts the queue snapshot publisher and the callbacks read and write Redis, so Redis
+is replaced by fakeredis with Lua support (pip install -r requirements-dev.txt), or by the
+Redis given with --redis (use a spare Redis, its database is flushed).
+
+benchmarks/baseline.json holds the results of a run with the default options.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --latency 0.05 --scenarios small large
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --tolerance 0.2
+    python benchmarks/run_benchmarks.py --redis redis://localhost:6379/15
+"""
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+from benchmarks.fake_bfabric import FakeBfabric, FakeLogger, SCENARIOS
+
+
+def offline_backend(fake: FakeBfabric, cache: bool = False):
+    """
+    Patches the entity walk to read from the fake wrapper, log to a FakeLogger and, unless
+    cache is set, skip the Redis cache.
+    """
+    import utils.entity_utils
+    import utils.log_utils
+    import utils.cache_utils
+
+    patches = [
+        mock.patch.object(utils.entity_utils, "bfabric_interface", SimpleNamespace(get_wrapper=lambda: fake)),
+        mock.patch.object(utils.log_utils, "get_logger", lambda token_data: FakeLogger()),
+    ]
+    if not cache:
+        patches.append(mock.patch.object(utils.cache_utils, "ENTITY_CACHE_ENABLED", False))
+    return patches
+
+
+def use_redis(url: str = None):
+    """
+    Points every module holding a shared Redis connection at fakeredis, or at the Redis
+    behind url: redis_conn, used by the utils modules, and the connection of the queues
+    returned by bfabric_web_apps.q. Must run before index is imported, so the utils modules
+    bind to it.
+    """
+    import bfabric_web_apps.utils.redis_connection as redis_connection
+    import bfabric_web_apps.utils.redis_queue as redis_queue
+    if url:
+        from redis import Redis
+        conn = Redis.from_url(url)
+        # Workers listening on this Redis would run the enqueued Draugr jobs for real.
+        if conn.scard("rq:workers"):
+            raise SystemExit(f"{url} has rq workers registered; use a spare Redis for load tests.")
+    else:
+        import fakeredis
+        conn = fakeredis.FakeStrictRedis()
+        try:
+            # Redis locks (see utils.submission_utils.submit_once) run Lua scripts.
+            conn.eval("return 1", 0)
+        except Exception:
+            raise SystemExit("fakeredis without Lua support; install it with: pip install -r requirements-dev.txt")
+    conn.flushdb()
+
+    originals = (redis_connection.redis_conn, redis_queue.conn)
+    for module in list(sys.modules.values()):
+        for name in ("redis_conn", "conn"):
+            if any(getattr(module, name, None) is original for original in originals):
+                setattr(module, name, conn)
+    return conn
+
+
+def measure(func, iterations: int) -> dict:
+    """
+    Runs func iterations times and returns the median wall time, the peak traced memory of
+    the first run and the first run's result.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    timings = [time.perf_counter() - start]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for _ in range(iterations - 1):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return {"wall_time": statistics.median(timings), "peak_memory": peak, "result": result}
+
+
+def bench_scenario(name: str, latency: float, iterations: int) -> dict:
+    from utils.entity_utils import extended_entity_data
+    from utils.draugr_utils import generate_draugr_command
+
+    fake = FakeBfabric.from_scenario(name, latency=latency)
+    patches = offline_backend(fake)
+    for patch in patches:
+        patch.start()
+
+    results = {}
+    try:
+        # extended_entity_data, counting the B-Fabric calls of a single walk.
+        fake.reset_calls()
+        calls_per_walk = {}
+
+        def walk():
+            fake.reset_calls()
+            payload = extended_entity_data(fake.token_data(), use_cache=False)
+            calls_per_walk.update(fake.calls)
+            return payload
+
+        run = measure(walk, iterations)
+        payload = run.pop("result")
+        results["extended_entity_data"] = {
+            **run,
+            "api_calls": dict(calls_per_walk),
+            "payload_bytes": len(payload.encode("utf-8")),
+        }
+
+        # update_ui, rendering the lane cards from the payload above.
+        from plotly.utils import PlotlyJSONEncoder
+        from utils.payload_utils import publish_entity
+        import index
+
+        handle = publish_entity(payload)
+        run = measure(lambda: index.update_ui(handle, fake.token_data()), iterations)
+        layout = run.pop("result")
+        results["update_ui"] = {
+            **run,
+            "api_calls": {},
+            "payload_bytes": len(json.dumps(layout, cls=PlotlyJSONEncoder).encode("utf-8")),
+        }
+
+        # generate_draugr_command, for all orders of the run.
+        entity = json.loads(payload)
+        run = measure(lambda: generate_draugr_command(
+            server=entity["server"],
+            run_folder=entity["datafolder"],
+            order_list=entity["containers"],
+            env="test"
+        ), iterations)
+        command = run.pop("result")
+        results["generate_draugr_command"] = {
+            **run,
+            "api_calls": {},
+            "payload_bytes": len(command.encode("utf-8")),
+        }
+    finally:
+        for patch in patches:
+            patch.stop()
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a message for every benchmark that got slower than baseline * (1 + tolerance)
+    or issues more B-Fabric calls than the baseline.
+    """
+    regressions = []
+    for scenario, benchmarks in results.items():
+        for bench, current in benchmarks.items():
+            reference = baseline.get(scenario, {}).get(bench)
+            if not reference:
+                continue
+            if current["wall_time"] > reference["wall_time"] * (1 + tolerance):
+                regressions.append(
+                    f"{scenario}/{bench}: wall time {current['wall_time']:.4f}s vs baseline {reference['wall_time']:.4f}s"
+                )
+            if sum(current["api_calls"].values()) > sum(reference["api_calls"].values()):
+                regressions.append(
+                    f"{scenario}/{bench}: {sum(current['api_calls'].values())} API calls vs baseline {sum(reference['api_calls'].values())}"
+                )
+    return regressions
+
+
+def print_report(results: dict):
+    print(f"{'scenario':<10} {'benchmark':<25} {'wall time (s)':>14} {'peak mem (KiB)':>15} {'payload (B)':>12}  api calls")
+    for scenario, benchmarks in results.items():
+        for bench, r in benchmarks.items():
+            calls = ", ".join(f"{endpoint}={count}" for endpoint, count in sorted(r["api_calls"].items())) or "-"
+            print(f"{scenario:<10} {bench:<25} {r['wall_time']:>14.4f} {r['peak_memory'] / 1024:>15.1f} {r['payload_bytes']:>12}  {calls}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the offline Draugr UI benchmarks.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS),
+                        help="Synthetic run sizes to benchmark.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds every fake B-Fabric call takes.")
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="Runs per benchmark, the median wall time is reported.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the results as JSON to this file.")
+    parser.add_argument("--save-baseline", type=str, default=None,
+                        help="Store the results as the new baseline in this file.")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare the results against the baseline in this file and exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative wall time increase over the baseline.")
+    parser.add_argument("--redis", type=str, default=None,
+                        help="URL of a spare Redis to use instead of fakeredis.")
+    args = parser.parse_args()
+
+    use_redis(args.redis)
+
+    results = {scenario: bench_scenario(scenario, args.latency, args.iterations) for scenario in args.scenarios}
+    print_report(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -25,7 +25,9 @@ from bfabric_web_apps import (
     populate_workunit_details,
     get_redis_queue_layout
 )
-from dash import html
+from dash import html, no_update
+from utils.metrics_utils import instrument_callback
+from utils.queue_utils import get_queue_snapshot, queue_layout_update
 
 # Application Initialization
 # ---------------------------
@@ -49,6 +51,7 @@ app = create_app()
     ],
     [Input('url', 'search')]                    # Extract token from URL parameters.
 )
+@instrument_callback
 def generic_process_url_and_token(url_params):
     """
     Handles URL parameter processing and manages authentication.
@@ -77,6 +80,7 @@ def generic_process_url_and_token(url_params):
     ],
     prevent_initial_call=True                            # Prevent callback on initial load.
 )
+@instrument_callback
 def generic_handle_bug_report(n_clicks, bug_description, token, entity_data):
     """
     Handles the submission of bug reports by delegating to the `submit_bug_report` function.
@@ -102,6 +106,7 @@ def generic_handle_bug_report(n_clicks, bug_description, token, entity_data):
         Input("refresh-workunits", "children")                
     ]                          
 )
+@instrument_callback
 def get_workunit_details(token_data, dummy):
     """
     Get workunit details for the authenticated user.
@@ -116,21 +121,36 @@ def get_workunit_details(token_data, dummy):
 
 
 @app.callback(
-    Output("page-content-queue-children", "children"),
+    [
+        Output("page-content-queue-children", "children"),
+        Output("queue-snapshot-version", "data")
+    ],
     [
         Input("token_data", "data"),
         Input("queue-interval", "n_intervals")
-    ]
+    ],
+    [State("queue-snapshot-version", "data")]
 )
-def get_queue_details(token_data, interval):
+@instrument_callback
+def get_queue_details(token_data, interval, shown):
     """
     Get queue details for the authenticated user.
 
+    The layout comes from the shared snapshot published by utils.queue_utils; nothing is
+    sent back while the snapshot version is the one this tab already shows, and only the
+    queue cards which changed are sent when it is not. Without a published snapshot, the
+    layout is built directly.
+
     Parameters:
         token (dict): Authentication token data.
+        shown (dict): Snapshot version and card digests of the layout this tab shows.
 
     Returns:
-        tuple: Queue details.
+        tuple: Queue details (or a patch of them) and the version and digests they show.
     """
-    return get_redis_queue_layout()
-
+    snapshot = get_queue_snapshot(known_version=(shown or {}).get("version"))
+    if snapshot:
+        return queue_layout_update(snapshot, shown)
+    if shown:
+        return no_update, no_update
+    return get_redis_queue_layout(), None
@@ -29,17 +29,30 @@ no_auth = [
     html.A('Login to Bfabric', href='https://fgcz-bfabric.uzh.ch/bfabric/')  # Link to the Bfabric login page.
 ]
 
-def lane_card(lane_position, container_ids):
+def lane_card(lane_position, container_ids, conflicts=None):
+
+    # Lanes whose samples are still being loaded have no container IDs yet.
+    if container_ids is None:
+        body = [dbc.Spinner(size="sm"), html.Span(" Loading samples...")]
+    else:
+        body = [
+            html.P(f"Container IDs:"),
+        ] + [
+            html.H5(name) for name in container_ids
+        ]
+
+    # Index conflicts found in the lane's sample sheet.
+    if conflicts:
+        body.append(dbc.Alert(
+            [html.B("Sample sheet conflicts:")] + [html.Div(problem) for problem in conflicts[:5]]
+            + ([html.Div(f"... and {len(conflicts) - 5} more")] if len(conflicts) > 5 else []),
+            color="warning",
+            style={"font-size": "14px", "margin-top": "10px"}
+        ))
 
     card_content = [
         dbc.CardHeader(f"Lane {lane_position}"),
-        dbc.CardBody(
-            [
-                html.P(f"Container IDs:"),
-            ] + [
-                html.H5(name) for name in container_ids
-            ]
-        ),
+        dbc.CardBody(body),
     ]
     return dbc.Card(card_content, style={"max-width": "25vw", "margin": "10px"})
 
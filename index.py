@@ -3,17 +3,36 @@
 # Example: If bfabric_web_apps is version 0.1.3, bfabric_web_app_template must also be 0.1.3.
 # Verify and update versions accordingly before running the application.
 
-from dash import Input, Output, State, html, dcc
+from dash import Input, Output, State, html, dcc, ctx, no_update, Patch
 import dash_bootstrap_components as dbc
 import bfabric_web_apps
+import time
 from generic.callbacks import app
 from generic.components import no_auth
 from pathlib import Path
 import dash_daq as daq
 from generic.components import lane_card
-from utils.entity_utils import extended_entity_data as eed
-import json
+from utils.entity_utils import extended_entity_data as eed, cached_entity_data, load_entity
+from utils.payload_utils import publish_entity
+from utils.queue_utils import start_queue_publisher
+from utils.submission_utils import submission_fingerprint, submit_once, job_status
+from utils.batch_utils import parse_run_ids, submit_batch
+from utils.routing_utils import route, format_wait, eligible_hosts, admission_lock, AdmissionRefused
 from utils.draugr_utils import generate_draugr_command
+from utils.worker_pool import RESOURCE_PROFILES
+from utils.stage_utils import stage_commands, enqueue_stages, pipeline_key, retry_failed_stages
+from utils.fanout_utils import order_groups, enqueue_fanout
+from utils.log_stream_utils import logged_command, log_job_options, read_log
+from utils.job_utils import run_draugr_job
+from utils.readiness_utils import check_run_folder
+from utils.runtime_utils import job_features, predict_runtime
+from utils.callback_utils import tracked
+from utils.reuse_utils import demux_fingerprint, tool_versions, find_output, reuse_meta
+from utils.samplesheet_utils import samplesheet_files, with_samplesheets, selected_rows, lane_conflicts
+from utils.trace_utils import new_trace_id, record_span, span, trace_spans, job_trace_id, waterfall
+from utils.config import CLIENTSIDE_CALLBACKS, STAGED_SUBMISSION, LOG_VIEW_CHUNKS, PRECOMPUTED_SAMPLESHEETS
+from utils.metrics_utils import instrument_callback, register_metrics_route, timer, ENQUEUE_SECONDS
+from utils.cache_utils import invalidate_entity_cache, peek_cached_entity, get_partial_entity, get_loaded_entity, is_refreshing
 
 # Here we define the sidebar of the UI, including the clickable components like dropdown and slider. 
 sidebar = [
@@ -37,6 +56,24 @@ sidebar = [
     daq.BooleanSwitch(id='wizard', on=False),
     html.P(id="draugr-text-4", children="Is Multiome"),
     daq.BooleanSwitch(id='multiome', on=False),
+    html.P(id="draugr-text-5", children="Staged Submission"),
+    daq.BooleanSwitch(id='staged-submit', on=STAGED_SUBMISSION),
+    html.P(id="draugr-text-7", children="Use Precomputed Sample Sheets"),
+    daq.BooleanSwitch(id='precomputed-ss', on=PRECOMPUTED_SAMPLESHEETS),
+    html.P(id="draugr-text-6", children="Fan-out"),
+    # RadioItems can't be disabled as a whole, the fieldset around it can.
+    html.Fieldset(
+        dbc.RadioItems(
+            options=[
+                {"label": "Single job", "value": "none"},
+                {"label": "One job per order", "value": "order"},
+                {"label": "One job per lane group", "value": "lane"},
+            ],
+            value="none",
+            id="fanout-mode",
+        ),
+        id="fanout-fieldset",
+    ),
     html.Br(),
     dbc.Input(value="", placeholder='Custom Bcl2fastq flags', id='bcl-input'),
     html.Br(),
@@ -45,23 +82,66 @@ sidebar = [
     dbc.Input(value="", placeholder='Custom Bases2fastq flags', id='bases2fastq-input'),
     html.Br(),
     dbc.Button('Submit', id='draugr-button'),
+    html.Br(),
+    html.Br(),
+    dbc.Button('Reload Run Data', id='refresh-entity-button', color="secondary", outline=True, size="sm"),
+    html.Br(),
+    html.Br(),
+    dbc.Button('Retry Failed Stages', id='retry-stages-button', color="secondary", outline=True, size="sm"),
+    html.Br(),
+    html.Br(),
+    dbc.Accordion(
+        [
+            dbc.AccordionItem(
+                [
+                    html.P("Re-trigger all orders of several runs, with the options selected above. Each run is submitted as a single job: staged submission, fan-out, reuse and precomputed sample sheets don't apply.", style={"font-size": "16px"}),
+                    dbc.Textarea(id='batch-run-ids', placeholder='Run IDs, separated by commas, spaces or new lines'),
+                    html.Br(),
+                    dbc.Button('Submit Batch', id='batch-submit-button', color="warning"),
+                ],
+                title="Batch Re-trigger",
+            )
+        ],
+        start_collapsed=True,
+    ),
 ]
 # here we define the modal that will pop up when the user clicks the submit button.
 modal = html.Div([
     dbc.Modal([
         dbc.ModalHeader(dbc.ModalTitle("Ready to Run Draugr?")),
-        dbc.ModalBody("Are you sure you're ready to trigger demultiplexing?"),
+        dbc.ModalBody([
+            html.P("Are you sure you're ready to trigger demultiplexing?"),
+            html.Div(id="routing-info"),
+            html.P("Force submission (even if an identical job is queued or running, or the run folder does not look ready)"),
+            daq.BooleanSwitch(id='force-submit', on=False),
+            html.P("Reuse the output of an identical earlier demux (skip to post-demux and gstore copy)"),
+            daq.BooleanSwitch(id='reuse-demux', on=False),
+        ]),
         dbc.ModalFooter(dbc.Button("Yes!", id="Submit", className="ms-auto", n_clicks=0)),],
     id="modal-confirmation",
     is_open=False,),
 ])
 
+# Here we define the modal showing the per-run results of a batch submission.
+batch_modal = dbc.Modal(
+    [
+        dbc.ModalHeader(dbc.ModalTitle("Batch Submission")),
+        dbc.ModalBody(id="batch-results"),
+    ],
+    id="batch-results-modal",
+    size="xl",
+    is_open=False,
+)
+
 # Here are the alerts which will pop up when the user creates workunits 
 alerts = html.Div(
     [
         dbc.Alert("Success: Draugr Initiated!", color="success", id="alert-fade-success", dismissable=True, is_open=False),
         dbc.Alert("Error: Draugr Initiation Failed!", color="danger", id="alert-fade-fail", dismissable=True, is_open=False),
         dbc.Alert("Warning: Please select Order to DMX!", color="warning", id="alert-fade-warning", dismissable=True, is_open=False),
+        dbc.Alert("", color="info", id="alert-duplicate", dismissable=True, is_open=False),
+        dbc.Alert("", color="danger", id="alert-admission", dismissable=True, is_open=False),
+        dbc.Alert("", color="info", id="alert-stages", dismissable=True, is_open=False),
         dbc.Alert("Warning: Missing 'server' in entity!", color="warning",  id="alert-warning-no-system", dismissable=False, is_open=False),
         dbc.Alert("Warning: Missing 'datafolder' in entity!", color="warning",  id="alert-warning-no-data-folder", dismissable=False, is_open=False),
     ], style={"margin": "20px"}
@@ -72,8 +152,13 @@ app_specific_layout = dbc.Row(
         id="page-content-main",
         children=[
             dcc.Loading(dcc.Store(id="extended-entity-data", storage_type="session")),
+            dcc.Interval(id="entity-refresh-interval", interval=1000, disabled=True),
+            dcc.Store(id="queue-snapshot-version"),
+            dcc.Interval(id="job-log-interval", interval=2000, disabled=True),
+            dcc.Store(id="job-log-cursor"),
             dcc.Loading(alerts), 
             modal,  # Modal defined earlier.
+            batch_modal,
             dbc.Col(
                 html.Div(
                     id="sidebar",
@@ -109,6 +194,33 @@ app_specific_layout = dbc.Row(
                 ),
                 width=9,  # Width of the main content column.
             ),
+            dbc.Col(
+                dbc.Accordion(
+                    [
+                        dbc.AccordionItem(
+                            [
+                                dcc.Dropdown([], id="job-log-select", placeholder="Submit a job to follow its log"),
+                                html.Pre(
+                                    id="job-log",
+                                    children=[],
+                                    style={"max-height": "40vh", "overflow-y": "scroll", "font-size": "13px", "margin-top": "10px"}
+                                ),
+                            ],
+                            title="Job Log",
+                        ),
+                        dbc.AccordionItem(
+                            [
+                                dbc.Button("Refresh", id="job-trace-refresh", color="secondary", size="sm"),
+                                dcc.Graph(id="job-trace", figure=waterfall([]), config={"displayModeBar": False}),
+                            ],
+                            title="Trace",
+                        )
+                    ],
+                    start_collapsed=True,
+                ),
+                width=12,  # Below the sidebar and the main content.
+                style={"margin-top": "20px"}
+            ),
         ],
         style={"margin-top": "0px", "min-height": "40vh"}  # Overall styling for the row layout.
     )
@@ -146,6 +258,26 @@ documentation_content = [
             "Is Multiome --"
         ), " If you're processing a multiome run, select this option.",
         html.Br(),html.Br(),
+        html.B(
+            "Staged Submission --"
+        ), " Run sample sheet generation, demux, post-demux and gstore copy as separate queued jobs. The next run's demux can then start while this one is still copying, and \"Retry Failed Stages\" re-runs only the stage that failed.",
+        html.Br(),html.Br(),
+        html.B(
+            "Fan-out --"
+        ), " Demultiplex each selected order, or each group of orders sharing lanes, in its own job, so they run in parallel. A final job reports whether all of them succeeded. Fan-out jobs are not staged.",
+        html.Br(),html.Br(),
+        html.B(
+            "Use Precomputed Sample Sheets --"
+        ), " Send the sample sheets built when the run was loaded along with the job, instead of having Draugr generate them. Index conflicts found in these sheets are shown on the lane cards and in the confirmation dialog. If the sheets can't be put in place on the host, Draugr generates them as usual. Not used for staged or fanned out jobs.",
+        html.Br(),html.Br(),
+        html.B(
+            "Job Log --"
+        ), " After submitting, open \"Job Log\" below the lanes to follow the output of the job, or of each of its stages or order jobs, while it runs.",
+        html.Br(),html.Br(),
+        html.B(
+            "Trace --"
+        ), " Shows where the time of a submission went: loading the run, enqueueing, waiting in the queue, starting the job, and running each command or Draugr stage. If TRACE_FILE is set, spans are also written to that file on each host.",
+        html.Br(),html.Br(),
         html.B(
             "Custom Bcl2fastq flags --"
         ), """Custom bcl2fastq flags to use for the standard samples wrapped in a
@@ -188,43 +320,157 @@ app.layout = bfabric_web_apps.get_static_layout(                    # The functi
 )
 
 # This callback is necessary for the modal to pop up when the user clicks the submit button.
-@app.callback(
-    Output("modal-confirmation", "is_open"),
-    [Input("draugr-button", "n_clicks"), Input("Submit", "n_clicks")],
-    [State("modal-confirmation", "is_open")],
-)
 def toggle_modal(n1, n2, is_open):
     if n1 or n2:
         return not is_open
     return is_open
 
 
-@app.callback(
-    Output('draugr-dropdown', 'options'),
-    [Input('extended-entity-data', 'data')]
-)
-def update_dropdown(entity):
-    entity_data = json.loads(entity) if entity else None
-    orders = entity_data.get('containers')
+def update_dropdown(entity, token_data):
+    entity_data = load_entity(entity, token_data)
+    if not entity_data:
+        return []
+    orders = entity_data.get('containers', [])
     options = [{"label": elt, "value": elt} for elt in orders]
     return options
 
 
+# Clientside versions of the pure UI callbacks. They only need the small header fields
+# carried by the entity handle (see utils.payload_utils), so they never hit the server.
+toggle_modal_js = """
+function(n1, n2, is_open) {
+    if (n1 || n2) {
+        return !is_open;
+    }
+    return is_open;
+}
+"""
+
+update_dropdown_js = """
+function(entity, token_data) {
+    const orders = (entity && entity.containers) || [];
+    return orders.map(elt => ({label: elt, value: elt}));
+}
+"""
+
+update_controls_js = """
+function(entity, token) {
+    // Reloading the run and batch submissions only need a session.
+    const session = Array(2).fill(!token);
+    const disabled = Array(12).fill(true);
+    if (!token || !entity || entity.empty) {
+        return disabled.concat(session, [false, false]);
+    }
+    if (!entity.server) {
+        return disabled.concat(session, [true, false]);
+    }
+    if (!entity.datafolder) {
+        return disabled.concat(session, [false, true]);
+    }
+    return Array(12).fill(false).concat(session, [false, false]);
+}
+"""
+
+toggle_modal_io = (
+    Output("modal-confirmation", "is_open"),
+    [Input("draugr-button", "n_clicks"), Input("Submit", "n_clicks")],
+    [State("modal-confirmation", "is_open")],
+)
+
+update_dropdown_io = (
+    Output('draugr-dropdown', 'options'),
+    [Input('extended-entity-data', 'data')],
+    [State('token_data', 'data')]
+)
+
+
 @app.callback(
-    Output("extended-entity-data", "data"),
-    [Input("token_data", "data")]
+    [
+        Output("extended-entity-data", "data"),
+        Output("entity-refresh-interval", "disabled"),
+    ],
+    [Input("token_data", "data"), Input("refresh-entity-button", "n_clicks")]
 )
-def update_extended_entity_data(token_data):
+@instrument_callback
+def update_extended_entity_data(token_data, n_clicks):
     """
     This callback retrieves extended entity data based on the provided token data.
-    It uses the `extended_entity_data` function to fetch and return the entity data.
+    It uses the `extended_entity_data` function to fetch the entity data, and stores only
+    a handle to it in the browser (see utils.payload_utils).
+    Clicking "Reload Run Data" drops the cached copy first, forcing a fresh read from B-Fabric.
+
+    A stale cached copy is shown right away while it is refreshed in the background, and
+    an uncached run is shown lane by lane as its lanes are loaded in the background. In both
+    cases the refresh interval is enabled so `apply_entity_refresh` can pick up the result.
     """
     if not token_data:
-        return None
-    return eed(token_data)
+        return None, True
+    if ctx.triggered_id == "refresh-entity-button":
+        invalidate_entity_cache(
+            token_data.get("environment", "None"),
+            token_data.get("entityClass_data"),
+            token_data.get("entity_id_data")
+        )
+        return publish_entity(eed(token_data)), True
+
+    entity_data, refreshing = cached_entity_data(token_data)
+    return publish_entity(entity_data), not refreshing
 
 
 @app.callback(
+    [
+        Output("extended-entity-data", "data", allow_duplicate=True),
+        Output("entity-refresh-interval", "disabled", allow_duplicate=True),
+    ],
+    [Input("entity-refresh-interval", "n_intervals")],
+    [State("extended-entity-data", "data"), State("token_data", "data")],
+    prevent_initial_call=True
+)
+@instrument_callback
+def apply_entity_refresh(n_intervals, entity_data, token_data):
+    """
+    Polls a background entity load or refresh. While lanes are still being loaded, the
+    partially loaded data is shown; once done, the final data is, from the cache or, if it
+    wasn't cached, as published by the load itself, see get_loaded_entity. The store (and with it
+    the lane cards and order dropdown) is only updated if the data differs from what the
+    browser already shows.
+    """
+    if not token_data:
+        return no_update, True
+
+    key = (token_data.get("environment", "None"), token_data.get("entityClass_data"), token_data.get("entity_id_data"))
+    if is_refreshing(*key):
+        partial = publish_entity(get_partial_entity(*key))
+        if not partial or partial == entity_data:
+            return no_update, False
+        return partial, False
+
+    refreshed = publish_entity(peek_cached_entity(*key) or get_loaded_entity(*key))
+    if not refreshed or refreshed == entity_data:
+        return no_update, True
+    return refreshed, True
+
+
+def update_controls(entity_data, token):
+    """
+    Enables the sidebar controls once the user is authenticated and the entity has both a
+    server and a data folder, and opens the matching warning otherwise.
+    Server side fallback of update_controls_js.
+    """
+    entity = load_entity(entity_data, token)
+    # Reloading the run and batch submissions only need a session.
+    session = (not token,) * 2
+
+    if not token or not entity:
+        return (True,) * 12 + session + (False, False)
+    elif not entity.get("server"):
+        return (True,) * 12 + session + (True, False)
+    elif not entity.get("datafolder"):
+        return (True,) * 12 + session + (False, True)
+    return (False,) * 12 + session + (False, False)
+
+
+update_controls_io = (
     [
         Output("draugr-dropdown", "disabled"),
         Output("draugr-flags", "disabled"),
@@ -234,7 +480,12 @@ def update_extended_entity_data(token_data):
         Output("cellranger-input", "disabled"),
         Output("bases2fastq-input", "disabled"),
         Output("draugr-button", "disabled"),
-        Output("auth-div", "children"),
+        Output("staged-submit", "disabled"),
+        Output("precomputed-ss", "disabled"),
+        Output("fanout-fieldset", "disabled"),
+        Output("retry-stages-button", "disabled"),
+        Output("refresh-entity-button", "disabled"),
+        Output("batch-submit-button", "disabled"),
         Output("alert-warning-no-system", "is_open"),
         Output("alert-warning-no-data-folder", "is_open"),
     ],
@@ -245,37 +496,53 @@ def update_extended_entity_data(token_data):
         State("token_data", "data")
     ]
 )
+
+# Pure UI callbacks run in the browser unless CLIENTSIDE_CALLBACKS is off,
+# in which case the server side versions above are registered instead.
+if CLIENTSIDE_CALLBACKS:
+    app.clientside_callback(toggle_modal_js, *toggle_modal_io)
+    app.clientside_callback(update_dropdown_js, *update_dropdown_io)
+    app.clientside_callback(update_controls_js, *update_controls_io)
+else:
+    app.callback(*toggle_modal_io)(instrument_callback(toggle_modal))
+    app.callback(*update_dropdown_io)(instrument_callback(update_dropdown))
+    app.callback(*update_controls_io)(instrument_callback(update_controls))
+
+
+@app.callback(
+    Output("auth-div", "children"),
+    [
+        Input("extended-entity-data", "data"),
+    ],
+    [
+        State("token_data", "data")
+    ]
+)
+@instrument_callback
 def update_ui(entity_data, token):
     """
     This callback updates the UI based on the authentication token and entity data.
-    If the user is authenticated, it enables the UI components for selecting orders and options.
-    If the user is not authenticated, it disables the components and shows a no-auth message.
+    If the user is authenticated, it shows the lane cards of the entity.
+    If the user is not authenticated, it shows a no-auth message.
+    The enabling and disabling of the sidebar controls is done by update_controls.
     """
-    entity = json.loads(entity_data) if entity_data else None
+    entity = load_entity(entity_data, token)
 
     if not token or not entity:
-        return (
-            True, True, True, True, True, True, True, True, no_auth, False, False
-        )
+        return no_auth
 
-    elif not entity.get("server"):
-        return (
-            True, True, True, True, True, True, True, True,
-            html.Div(),
-            True,
-            False
-        )
+    elif entity.get("error"):
+        return dbc.Alert([
+            html.B("Could not load the lanes of this run: "), entity["error"],
+            " Use \"Reload Run Data\" to try again."
+        ], color="danger")
 
-    elif not entity.get("datafolder"):
-        return (
-            True, True, True, True, True, True, True, True,
-            html.Div(),
-            False,
-            True
-        )
+    elif not entity.get("server") or not entity.get("datafolder"):
+        return html.Div()
 
     else: 
-        # If the user is authenticated, enable all components and show the auth-div.     
+        # If the user is authenticated, show the lane cards in the auth-div, with their sample sheet conflicts.
+        conflicts = entity.get("samplesheet_conflicts") or {}
         if len(list(entity['lanes'].values())) != 8:
             container = dbc.Container(
                 [
@@ -285,7 +552,8 @@ def update_ui(entity_data, token):
                                 [
                                     lane_card(
                                         lane_position=lane_position,
-                                        container_ids=container_ids
+                                        container_ids=container_ids,
+                                        conflicts=conflicts.get(str(lane_position))
                                     ) for lane_position, container_ids in entity['lanes'].items()
                                 ]
                             )
@@ -302,7 +570,8 @@ def update_ui(entity_data, token):
                                 [
                                     lane_card(
                                         lane_position=i,
-                                        container_ids=entity['lanes'][str(i)]
+                                        container_ids=entity['lanes'][str(i)],
+                                        conflicts=conflicts.get(str(i))
                                     ) for i in range(1,5)
                                 ]
                             ),
@@ -310,7 +579,8 @@ def update_ui(entity_data, token):
                                 [
                                     lane_card(
                                         lane_position=i,
-                                        container_ids=entity['lanes'][str(i)]
+                                        container_ids=entity['lanes'][str(i)],
+                                        conflicts=conflicts.get(str(i))
                                     ) for i in range(5,9)
                                 ]
                             )
@@ -319,14 +589,126 @@ def update_ui(entity_data, token):
                 ]
             )
     
-        return (
-            False, False, False, False, False, False, False, False, container, False, False
-        )
+        return container
     
+@app.callback(
+    Output("routing-info", "children"),
+    [Input("modal-confirmation", "is_open")],
+    [State("extended-entity-data", "data"),
+     State("draugr-dropdown", "value"),
+     State("draugr-flags", "value"),
+     State("wizard", "on"),
+     State("multiome", "on"),
+     State("bcl-input", "value"),
+     State("cellranger-input", "value"),
+     State("bases2fastq-input", "value"),
+     State("token_data", "data")],
+    prevent_initial_call=True
+)
+@instrument_callback
+def update_routing_info(is_open, entity_data, draugr_orders, draugr_flags, wizard, multiome, bcl_flags, cellranger_flags, bases2fastq_flags, token_data):
+    """
+    Shows, in the confirmation modal, whether the run folder is ready, the sample sheet
+    conflicts of the selected orders, whether an identical demux output can be reused, which host the job would go to, how long it would wait there
+    and run, or why it would be refused.
+    """
+    if not is_open or not token_data:
+        return no_update
+    entity = load_entity(entity_data, token_data)
+    if not entity or not entity.get("server"):
+        return ""
+
+    readiness = check_run_folder(entity["server"], entity.get("datafolder") or "")
+    if readiness["ready"] is None:
+        readiness_info = html.P("Run folder not indexed on this host, it is not checked before submitting.")
+    elif readiness["ready"]:
+        record = readiness["record"]
+        readiness_info = html.P([
+            html.B("Run folder: "), f"complete, {record['cycles']} cycles, {record['size_gb']} GB",
+        ])
+    else:
+        readiness_info = dbc.Alert([html.B("Run folder not ready: ")] + [html.Div(problem) for problem in readiness["problems"]], color="warning")
+
+    reused = find_output(demux_fingerprint(
+        entity["server"],
+        entity.get("datafolder") or "",
+        readiness["record"],
+        selected_rows(entity, draugr_orders or []),
+        draugr_orders or [],
+        disable_wizard=wizard,
+        is_multiome=multiome,
+        bcl_flags=bcl_flags,
+        cellranger_flags=cellranger_flags,
+        bases2fastq_flags=bases2fastq_flags,
+        env=token_data.get("environment"),
+        tools=tool_versions(entity["server"])
+    ))
+    conflicts = lane_conflicts(selected_rows(entity, draugr_orders or []), entity.get("datafolder"))
+    conflict_info = ""
+    if conflicts:
+        conflict_info = dbc.Alert(
+            [html.B("Sample sheet conflicts in the selected orders:")]
+            + [html.Div(f"Lane {position}: {problem}") for position, problems in sorted(conflicts.items()) for problem in problems[:5]],
+            color="warning"
+        )
+
+    reuse_info = ""
+    if reused and "--skip-demux" not in (draugr_flags or []):
+        reuse_info = dbc.Alert([
+            html.B("An identical demux already finished "),
+            f"on {reused['host']} (job ", html.Code(reused["job_id"]), f"), output in {reused['output']}. ",
+            "Enable \"Reuse\" below to skip straight to post-demux and gstore copy.",
+        ], color="info")
+
+    decision = route(entity["server"])
+    if not decision["admitted"]:
+        return [readiness_info, conflict_info, reuse_info, dbc.Alert(f"This submission would be refused: {decision['reason']}", color="danger")]
+
+    load = decision["loads"][decision["host"]]
+    prediction = predict_runtime(job_features(
+        entity,
+        draugr_orders or [],
+        decision["host"],
+        advanced_options=draugr_flags,
+        is_multiome=multiome,
+        cellranger_flags=cellranger_flags,
+        bases2fastq_flags=bases2fastq_flags,
+        platform=(readiness["record"] or {}).get("platform")
+    ))
+    if prediction["samples"]:
+        runtime = f"{format_wait(prediction['p50'])}, at most {format_wait(prediction['p90'])} for 9 in 10 of {prediction['samples']} similar jobs"
+    else:
+        runtime = f"{format_wait(prediction['p50'])} (no history of similar jobs yet)"
+
+    return [readiness_info, conflict_info, reuse_info, html.P([
+        html.B("Target host: "), f"{decision['host']} ({load['queued']} queued, {load['running']} running, {load['deferred']} waiting on other jobs, capacity {load['capacity']})",
+        html.Br(),
+        html.B("Expected wait: "), format_wait(decision["expected_wait"]),
+        html.Br(),
+        html.B("Expected run time: "), runtime,
+        html.Br(),
+        html.B("Expected to finish in: "), format_wait(decision["expected_wait"] + prediction["p50"]),
+    ])]
+
+
+def _log_selection(job):
+    """
+    Returns the job log panel's options and selected job for a submission.
+    """
+    options = log_job_options(job)
+    return options, options[0]["value"] if options else None
+
+
 @app.callback(
     Output("alert-fade-success", "is_open"),   # Show success alert.
     Output("alert-fade-fail", "is_open"),      # Show failure alert.
     Output("alert-fade-warning", "is_open"),   # Show warning alert.
+    Output("alert-duplicate", "is_open"),      # Show duplicate submission alert.
+    Output("alert-duplicate", "children"),     # Point to the already active job.
+    Output("alert-admission", "is_open"),      # Show refused submission alert.
+    Output("alert-admission", "children"),     # Why the submission was refused.
+    Output("job-log-select", "options"),       # Jobs of the submission whose log can be followed.
+    Output("job-log-select", "value"),
     [Input("Submit", "n_clicks")],             # Detect button clicks.
     [State("draugr-dropdown", "value"),        # Selected orders to DMX.
      State("draugr-flags", "value"),           # Selected Draugr flags.
@@ -335,12 +717,18 @@ def update_ui(entity_data, token):
      State("bcl-input", "value"),              # Custom Bcl2fastq flags.
      State("cellranger-input", "value"),       # Custom Cellranger flags.
      State("bases2fastq-input", "value"),
+     State("force-submit", "on"),              # Force submission of an active job, or of a run folder not looking ready.
+     State("staged-submit", "on"),             # Enqueue each stage as its own job.
+     State("fanout-mode", "value"),            # One job per order or lane group.
+     State("reuse-demux", "on"),               # Skip the demux if an identical one already finished.
+     State("precomputed-ss", "on"),            # Ship the sample sheets built from the entity with the job.
      State('url', 'search'),
      State("extended-entity-data", "data"),
      State("token_data", "data")],  # Authentication token and entity data.
     prevent_initial_call=True                  # Prevent callback on initial load.
 )
-def handle_draugr_submission(n_clicks, draugr_orders, draugr_flags, wizard, multiome, bcl_flags, cellranger_flags, bases2fastq_flags, token, entity_data, token_data):
+@instrument_callback
+def handle_draugr_submission(n_clicks, draugr_orders, draugr_flags, wizard, multiome, bcl_flags, cellranger_flags, bases2fastq_flags, force, staged, fanout, reuse, precomputed, token, entity_data, token_data):
     """
     Handles the submission of Draugr orders and options.
     It triggers the demultiplexing process and returns the success or failure alert states.
@@ -354,23 +742,72 @@ def handle_draugr_submission(n_clicks, draugr_orders, draugr_flags, wizard, mult
         bcl_flags (str): Custom Bcl2fastq flags.
         cellranger_flags (str): Custom Cellranger flags.
         bases2fastq_flags (str): Custom Bases2fastq flags.
+        force (bool): Enqueue even if an identical job is already queued or running, or the run folder does not look ready.
+        staged (bool): Enqueue sample sheet generation, demux, post-demux and gstore copy as dependent jobs.
+        fanout (str): "order" or "lane" to run one job per order or lane group in parallel, "none" for a single job.
+            Takes precedence over staged when it splits the orders.
+        reuse (bool): If an identical demux already finished, skip the demux and reuse its output.
+        precomputed (bool): Ship the sample sheets built from the entity with the job and skip their generation.
         token_data (dict): Authentication token data.
         entity_data (dict): Metadata about the authenticated entity.
     Returns:
-        tuple: Success and failure alert states.
+        tuple: Success, failure, warning, duplicate and admission alert states, the duplicate and admission alert texts,
+            and the jobs shown in the job log panel.
     """
 
     env = token_data.get("environment")
 
     if not draugr_orders:
-        return False, False, True  # success=False, fail=False, warning=True
+        return False, False, True, False, "", False, "", no_update, no_update  # success=False, fail=False, warning=True
+
+    # Follows the submission from here through the workers, see utils.trace_utils.
+    trace_id = new_trace_id()
 
     try:
-        entity = json.loads(entity_data) if entity_data else None
+        start = time.time()
+        entity = load_entity(entity_data, token_data)
+        # The lane walk itself ran when the run was loaded; its duration is kept with the entity.
+        walk = entity.get("walk") or {}
+        record_span(trace_id, "entity load", start, time.time(), walk_seconds=round(walk["end"] - walk["start"], 3) if walk else None, walked=walk.get("end"))
         server = entity['server'],
         run_folder = entity['datafolder']
 
-        command = generate_draugr_command(
+        # Fail fast on runs which are missing, unfinished or too large for the analysis folder.
+        with span(trace_id, "readiness check"):
+            readiness = check_run_folder(server[0], run_folder)
+        if readiness["ready"] is False and not force:
+            print(f"Run folder {run_folder} not ready: {readiness['problems']}")
+            return False, False, False, False, "", True, [
+                "Run folder not ready: ", " ".join(readiness["problems"]),
+                " Enable \"Force submission\" to submit it anyway."
+            ], no_update, no_update
+
+        def demux_fingerprint_of(orders):
+            return demux_fingerprint(
+                server[0],
+                run_folder,
+                readiness["record"],
+                selected_rows(entity, orders),
+                orders,
+                disable_wizard=wizard,
+                is_multiome=multiome,
+                bcl_flags=bcl_flags,
+                cellranger_flags=cellranger_flags,
+                bases2fastq_flags=bases2fastq_flags,
+                env=env,
+                tools=tool_versions(server[0])
+            )
+
+        # An identical demux already finished: go straight to post-demux and gstore copy on the host holding its output.
+        reused = find_output(demux_fingerprint_of(draugr_orders)) if reuse else None
+        if reused:
+            draugr_flags = sorted(set(draugr_flags or []) | {"--skip-demux"})
+            print(f"Reusing the demux output of job {reused['job_id']} on {reused['host']}: {reused['output']}")
+
+        # Nothing to parallelize when the demux is reused, and its output is on a single host.
+        groups = order_groups(draugr_orders, entity.get("lanes"), "none" if reused else fanout)
+
+        command_options = dict(
             server=server,
             run_folder=run_folder,
             order_list=draugr_orders,
@@ -379,12 +816,23 @@ def handle_draugr_submission(n_clicks, draugr_orders, draugr_flags, wizard, mult
             bcl_flags=bcl_flags,
             cellranger_flags=cellranger_flags,
             bases2fastq_flags=bases2fastq_flags,
-            advanced_options=draugr_flags,
             env=env
         )
+        command = generate_draugr_command(advanced_options=draugr_flags, **command_options)
+
+        # The sample sheets were built while loading the run, so the job doesn't need to walk B-Fabric again.
+        # Fanned out jobs each demultiplex a subset of the orders, and staged ones generate them in their own
+        # stage, so both keep generating their own.
+        samplesheets, install = samplesheet_files(entity, draugr_orders, env) if precomputed and len(groups) == 1 and not staged else ({}, "")
+        if samplesheets:
+            command = with_samplesheets(
+                install,
+                generate_draugr_command(advanced_options=sorted(set(draugr_flags or []) | {"--skip-ss-generation"}), **command_options),
+                command
+            )
 
         arguments = {
-            "files_as_byte_strings": {},
+            "files_as_byte_strings": samplesheets,
             "bash_commands": [command],
             "resource_paths": {}, 
             "attachment_paths": {},
@@ -393,23 +841,291 @@ def handle_draugr_submission(n_clicks, draugr_orders, draugr_flags, wizard, mult
             "charge": []
         }
 
-        # Submit the job to a queue! 
-        bfabric_web_apps.q(server[0]).enqueue(
-            bfabric_web_apps.run_main_job,
-            kwargs=arguments
+        fingerprint = submission_fingerprint(
+            server=server[0],
+            run_folder=run_folder,
+            order_list=draugr_orders,
+            advanced_options=draugr_flags,
+            disable_wizard=wizard,
+            is_multiome=multiome,
+            bcl_flags=bcl_flags,
+            cellranger_flags=cellranger_flags,
+            bases2fastq_flags=bases2fastq_flags,
+            env=env
         )
+
+        def reuse_of(orders):
+            # Jobs which demultiplex record their output for later reuse.
+            if "--skip-demux" in (draugr_flags or []):
+                return {}
+            return reuse_meta(demux_fingerprint_of(orders), env, run_folder, orders)
+
+        def features(orders, host):
+            return job_features(
+                entity,
+                orders,
+                host,
+                advanced_options=draugr_flags,
+                is_multiome=multiome,
+                cellranger_flags=cellranger_flags,
+                bases2fastq_flags=bases2fastq_flags,
+                platform=(readiness["record"] or {}).get("platform")
+            )
+
+        # A reused output is only on the host which produced it.
+        candidates = [reused["host"]] if reused else eligible_hosts(server[0])
+
+        def enqueue():
+            # The hosts stay locked until the jobs are in their queues, so concurrent submissions see them.
+            with admission_lock(candidates):
+                return enqueue_admitted()
+
+        def enqueue_admitted():
+            # Pick the least loaded host able to read the run folder, within the admission limits.
+            decision = route(server[0], hosts=candidates)
+            if not decision["admitted"]:
+                raise AdmissionRefused(decision["reason"])
+            host = decision["host"]
+            with timer(ENQUEUE_SECONDS, queue=host):
+                if len(groups) > 1:
+                    # The aggregation job stays deferred until every group is done, so it stands for the whole submission.
+                    return enqueue_fanout(
+                        server[0],
+                        host,
+                        groups,
+                        {key: value for key, value in arguments.items() if key != "bash_commands"},
+                        dict(
+                            server=server,
+                            run_folder=run_folder,
+                            disable_wizard=wizard,
+                            is_multiome=multiome,
+                            bcl_flags=bcl_flags,
+                            cellranger_flags=cellranger_flags,
+                            bases2fastq_flags=bases2fastq_flags,
+                            advanced_options=draugr_flags,
+                            env=env
+                        ),
+                        [features(group, host) for group in groups],
+                        [reuse_of(group) for group in groups],
+                        trace_id
+                    )
+                if staged:
+                    commands = stage_commands(
+                        server=server,
+                        run_folder=run_folder,
+                        order_list=draugr_orders,
+                        disable_wizard=wizard,
+                        is_multiome=multiome,
+                        bcl_flags=bcl_flags,
+                        cellranger_flags=cellranger_flags,
+                        bases2fastq_flags=bases2fastq_flags,
+                        advanced_options=draugr_flags,
+                        env=env
+                    )
+                    # The last stage stays deferred until the pipeline is through, so it stands for the whole submission.
+                    return enqueue_stages(
+                        host,
+                        commands,
+                        {key: value for key, value in arguments.items() if key != "bash_commands"},
+                        pipeline_key(env, server[0], run_folder),
+                        run_folder,
+                        features(draugr_orders, host),
+                        reuse_of(draugr_orders),
+                        trace_id
+                    )[-1]
+                job_id, logged, log_meta = logged_command(command, run_folder, trace_id)
+                return bfabric_web_apps.q(host).enqueue(
+                    run_draugr_job,
+                    kwargs={**arguments, "bash_commands": [logged]},
+                    job_id=job_id,
+                    **tracked(
+                        {**log_meta, "resources": RESOURCE_PROFILES["demux"], **reuse_of(draugr_orders)},
+                        features(draugr_orders, host)
+                    )
+                )
+
+        # Submit the job to a queue, unless an identical one is already queued or running.
+        try:
+            with span(trace_id, "enqueue", orders=len(draugr_orders), staged=bool(staged), fanout=len(groups)):
+                job, duplicate = submit_once(fingerprint, enqueue, force=force)
+        except AdmissionRefused as e:
+            print(f"Draugr submission refused: {e}")
+            return False, False, False, False, "", True, f"Submission refused: {e}", no_update, no_update
+        if duplicate:
+            status = job_status(job)
+            print(f"Identical Draugr job {job.id} is already {status}, not resubmitting.")
+            return False, False, False, True, [
+                "An identical Draugr job is already ",
+                html.B(status),
+                f" on queue '{job.origin}': job ID ",
+                html.Code(job.id),
+                ". Enable \"Force submission\" to submit it anyway."
+            ], False, "", *_log_selection(job)
         # bfabric_web_apps.q("light").enqueue(
         #     bfabric_web_apps.run_main_job,
         #     kwargs=arguments
         # )
 
-        print(f"Command submitted: {command}")
+        if len(groups) > 1:
+            print(f"Draugr fan-out of {len(groups)} jobs submitted for {run_folder}, aggregation job: {job.id}")
+        elif staged:
+            print(f"Staged Draugr pipeline submitted for {run_folder}, last stage on '{job.origin}': {job.id}")
+        else:
+            print(f"Command submitted to '{job.origin}': {command}")
 
-        return True, False, False  # Show success alert, hide failure alert.
+        return True, False, False, False, "", False, "", *_log_selection(job)  # Show success alert, hide failure alert.
 
     except Exception as e:
         print(f"Error generating Draugr command: {e}")
-        return False, True, False
+        return False, True, False, False, "", False, "", no_update, no_update
+
+@app.callback(
+    Output("job-log", "children"),
+    Output("job-log-cursor", "data"),
+    Output("job-log-interval", "disabled"),
+    [Input("job-log-select", "value"), Input("job-log-interval", "n_intervals")],
+    [State("job-log-cursor", "data")],
+    prevent_initial_call=True
+)
+@instrument_callback
+def stream_job_log(job_id, n_intervals, cursor):
+    """
+    Follows the log of the selected job. Each poll only fetches the lines added since the
+    last one and appends them to the panel as one chunk; the panel keeps the newest
+    LOG_VIEW_CHUNKS chunks. Polling stops once the job is done.
+    """
+    if not job_id:
+        return [], None, True
+
+    if ctx.triggered_id == "job-log-select" or not cursor or cursor.get("job") != job_id:
+        # A different job was selected: start over from the beginning of its log.
+        lines, last_id, finished = read_log(job_id)
+        chunks = ["\n".join(lines) + "\n"] if lines else []
+        return chunks, {"job": job_id, "last": last_id, "chunks": len(chunks)}, finished
+
+    lines, last_id, finished = read_log(job_id, cursor["last"])
+    if not lines:
+        return no_update, no_update, finished
+
+    log = Patch()
+    log.append("\n".join(lines) + "\n")
+    if cursor["chunks"] >= LOG_VIEW_CHUNKS:
+        del log[0]
+    return log, {"job": job_id, "last": last_id, "chunks": min(cursor["chunks"] + 1, LOG_VIEW_CHUNKS)}, finished
+
+
+@app.callback(
+    Output("job-trace", "figure"),
+    [Input("job-log-select", "value"),
+     Input("job-log-interval", "n_intervals"),
+     Input("job-trace-refresh", "n_clicks")],
+    prevent_initial_call=True
+)
+@instrument_callback
+def show_job_trace(job_id, n_intervals, n_clicks):
+    """
+    Shows the trace of the submission the selected job belongs to as a waterfall: entity
+    load, enqueue, queue wait, job startup and the command or stages of each of its jobs.
+    """
+    trace_id = job_trace_id(job_id) if job_id else None
+    return waterfall(trace_spans(trace_id) if trace_id else [])
+
+
+@app.callback(
+    Output("alert-stages", "is_open"),
+    Output("alert-stages", "children"),
+    [Input("retry-stages-button", "n_clicks")],
+    [State("extended-entity-data", "data"),
+     State("token_data", "data")],
+    prevent_initial_call=True
+)
+@instrument_callback
+def handle_stage_retry(n_clicks, entity_data, token_data):
+    """
+    Requeues the failed stages of the last staged submission of the current run. Stages
+    which already finished are not run again.
+    """
+    entity = load_entity(entity_data, token_data)
+    if not token_data or not entity or not entity.get("server") or not entity.get("datafolder"):
+        return True, "No run loaded."
+
+    retried = retry_failed_stages(pipeline_key(token_data.get("environment"), entity["server"], entity["datafolder"]))
+    if not retried:
+        return True, "No failed stages to retry for this run."
+    print(f"Requeued failed stages {retried} of {entity['datafolder']}")
+    return True, f"Requeued failed stages: {', '.join(retried)}."
+
+
+@app.callback(
+    Output("batch-results-modal", "is_open"),
+    Output("batch-results", "children"),
+    [Input("batch-submit-button", "n_clicks")],
+    [State("batch-run-ids", "value"),
+     State("draugr-flags", "value"),
+     State("wizard", "on"),
+     State("multiome", "on"),
+     State("bcl-input", "value"),
+     State("cellranger-input", "value"),
+     State("bases2fastq-input", "value"),
+     State("force-submit", "on"),
+     State('url', 'search'),
+     State("token_data", "data")],
+    prevent_initial_call=True
+)
+@instrument_callback
+def handle_batch_submission(n_clicks, run_ids, draugr_flags, wizard, multiome, bcl_flags, cellranger_flags, bases2fastq_flags, force, token, token_data):
+    """
+    Re-triggers demultiplexing of all orders of every listed run, and shows a result table.
+
+    Parameters:
+        n_clicks (int): Number of times the batch submit button was clicked.
+        run_ids (str): Run IDs entered by the user.
+        draugr_flags, wizard, multiome, bcl_flags, cellranger_flags, bases2fastq_flags: Sidebar options, applied to every run.
+        force (bool): Enqueue even if an identical job is already queued or running.
+        token (str): URL search string holding the session token.
+        token_data (dict): Authentication token data.
+    Returns:
+        tuple: Whether the result modal is open, and its content.
+    """
+    run_ids = parse_run_ids(run_ids)
+    if not token_data or not run_ids:
+        return True, dbc.Alert("Please enter at least one run ID.", color="warning")
+
+    results = submit_batch(
+        token_data,
+        token,
+        run_ids,
+        options={
+            "disable_wizard": wizard,
+            "is_multiome": multiome,
+            "bcl_flags": bcl_flags,
+            "cellranger_flags": cellranger_flags,
+            "bases2fastq_flags": bases2fastq_flags,
+            "advanced_options": draugr_flags,
+        },
+        force=force
+    )
+
+    header = html.Thead(html.Tr([html.Th(title) for title in ["Run", "Name", "Server", "Data folder", "Orders", "Status", "Job ID"]]))
+    rows = html.Tbody([
+        html.Tr([
+            html.Td(result["run_id"]),
+            html.Td(result["name"]),
+            html.Td(result["server"]),
+            html.Td(result["datafolder"]),
+            html.Td(result["orders"]),
+            html.Td(result["status"]),
+            html.Td(html.Code(result["job_id"]) if result["job_id"] else ""),
+        ]) for result in results
+    ])
+    return True, dbc.Table([header, rows], bordered=True, hover=True, size="sm")
+
+
+# Expose the collected metrics on /metrics (only if METRICS_ENABLED is set).
+register_metrics_route(app.server)
+
+# Publish the shared queue snapshot shown in the queue tab.
+start_queue_publisher()
 
 # Here we run the app on the specified host and port.
 if __name__ == "__main__":
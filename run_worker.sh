@@ -22,4 +22,7 @@ module load Dev/uv \
 
 # 4. Launch your worker
 source ./.venv/bin/activate  # activate the virtual environment
-python3 scripts/worker.py --queues="$(hostname)"
+# WORKER_PROCESSES > 1 runs a pool that shares the host's cores, memory and scratch between jobs.
+# Besides its own queue, each host serves the queues of the staged pipeline (see utils/stage_utils.py).
+# RUN_WATCHER=1 also submits the host's runs as soon as sequencing completes (see utils/watcher_utils.py).
+python3 scripts/worker.py --queues="$(hostname),$(hostname)-post,$(hostname)-light" --processes="${WORKER_PROCESSES:-1}" ${RUN_WATCHER:+--watch}
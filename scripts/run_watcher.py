@@ -0,0 +1,21 @@
+import sys
+sys.path.append("../bfabric-web-apps")
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import socket
+from utils.config import WATCHER_INTERVAL
+from utils.watcher_utils import run_watcher
+
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Submit the runs of this host to Draugr as soon as sequencing completes.")
+    parser.add_argument("--host", type=str, default=socket.gethostname(),
+                        help="Host whose run folders are watched and whose queue the jobs go to (default: this host).")
+    parser.add_argument("--interval", type=int, default=WATCHER_INTERVAL,
+                        help="Seconds between two passes over the run folder index.")
+    args = parser.parse_args()
+
+    # Needs the run folder index kept by scripts/worker.py on the same host; see utils/watcher_utils.py for the rules.
+    run_watcher(args.host, args.interval)
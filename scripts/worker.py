@@ -1,18 +1,63 @@
 import sys
 sys.path.append("../bfabric-web-apps")
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import argparse
+import multiprocessing
+import socket
 from bfabric_web_apps import run_worker, REDIS_HOST, REDIS_PORT
+from utils.config import WORKER_SCRATCH_PATH
+from utils.worker_pool import run_worker_pool, host_resources
+from utils.log_stream_utils import run_log_tailer
+from utils.readiness_utils import run_folder_indexer
+from utils.reuse_utils import publish_tool_versions
+from utils.watcher_utils import run_watcher
 
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Run worker with specific queues.")
     parser.add_argument("--queues", type=str, default="light,heavy",
                         help="Comma-separated list of queue names (e.g., --queues=queue1,queue2)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Number of worker processes. More than 1 runs a supervised pool sharing the host's resources.")
+    parser.add_argument("--cores", type=int, default=None,
+                        help="Cores the pool may hand out to jobs (default: all cores).")
+    parser.add_argument("--memory-gb", type=int, default=None,
+                        help="Memory in GB the pool may hand out to jobs (default: all memory).")
+    parser.add_argument("--scratch-gb", type=int, default=None,
+                        help="Scratch space in GB the pool may hand out to jobs (default: free space under WORKER_SCRATCH_PATH).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Also run the run watcher, submitting this host's runs as soon as sequencing completes.")
     args = parser.parse_args()
     
     # Convert the comma-separated string into a list
     queue_names = args.queues.split(",")
     
-    # Run the worker with the specified queue names
-    run_worker(REDIS_HOST, REDIS_PORT, queue_names)
\ No newline at end of file
+    # Stream the logs of the jobs running on this host to Redis, for the job log panel
+    tailer = multiprocessing.Process(target=run_log_tailer, args=(queue_names,), name="log-tailer", daemon=True)
+    tailer.start()
+
+    # Tell the web app which tool versions this host demultiplexes with, for reusing outputs
+    publish_tool_versions(socket.gethostname())
+
+    # Keep this host's run folder index up to date, for the pre-flight checks of submissions
+    indexer = multiprocessing.Process(target=run_folder_indexer, args=(socket.gethostname(),), name="run-folder-indexer", daemon=True)
+    indexer.start()
+
+    # Submit this host's runs automatically, see utils/watcher_utils.py (scripts/run_watcher.py runs it on its own)
+    if args.watch:
+        watcher = multiprocessing.Process(target=run_watcher, args=(socket.gethostname(),), name="run-watcher", daemon=True)
+        watcher.start()
+
+    if args.processes > 1:
+        resources = host_resources(WORKER_SCRATCH_PATH)
+        for name, value in (("cores", args.cores), ("memory_gb", args.memory_gb), ("scratch_gb", args.scratch_gb)):
+            if value is not None:
+                resources[name] = value
+
+        # Run a supervised pool of workers, each job waiting for its declared resources
+        run_worker_pool(REDIS_HOST, REDIS_PORT, queue_names, args.processes, resources)
+    else:
+        # Run the worker with the specified queue names
+        run_worker(REDIS_HOST, REDIS_PORT, queue_names)
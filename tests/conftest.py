@@ -0,0 +1,70 @@
+"""
+Shared fixtures. Redis is replaced by fakeredis with Lua support (see requirements-dev.txt).
+
+Run from the repository root with: python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import subprocess
+import fakeredis
+import pytest
+
+
+class FakeRedis(fakeredis.FakeStrictRedis):
+
+    def client_list(self, *args, **kwargs):
+        # Not implemented by fakeredis; rq workers only use it to look up their IP address.
+        return []
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """
+    Points every imported module holding the shared Redis connection, and the queues returned
+    by bfabric_web_apps.q, at an empty fakeredis. Modules under test must be imported by the
+    test module, so they hold the connection when the fixture runs.
+    """
+    import bfabric_web_apps.utils.redis_connection as redis_connection
+    import bfabric_web_apps.utils.redis_queue as redis_queue
+
+    conn = FakeRedis()
+    originals = (redis_connection.redis_conn, redis_queue.conn)
+    for module in list(sys.modules.values()):
+        for name in ("redis_conn", "conn"):
+            if any(getattr(module, name, None) is original for original in originals):
+                monkeypatch.setattr(module, name, conn)
+    return conn
+
+
+@pytest.fixture
+def run_jobs(redis):
+    """
+    Returns a function running the jobs of the given queues in this process until they are
+    empty, as a worker would, callbacks and dependents included.
+    """
+    from rq import Queue, SimpleWorker
+
+    def run(*queue_names):
+        SimpleWorker([Queue(name, connection=redis) for name in queue_names], connection=redis).work(burst=True)
+    return run
+
+
+@pytest.fixture
+def main_job(monkeypatch, tmp_path):
+    """
+    Replaces bfabric_web_apps.run_main_job, which needs a B-Fabric session, by a stand-in
+    running the bash commands the same way: one after the other with /bin/sh, never raising.
+    Job logs go to tmp_path.
+    """
+    import bfabric_web_apps
+    from utils import log_stream_utils
+
+    def run_main_job(bash_commands, **arguments):
+        for command in bash_commands:
+            subprocess.run(command, shell=True)
+
+    monkeypatch.setattr(bfabric_web_apps, "run_main_job", run_main_job)
+    monkeypatch.setattr(log_stream_utils, "JOB_LOG_DIR", str(tmp_path / "logs"))
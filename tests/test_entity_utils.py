@@ -0,0 +1,70 @@
+import json
+import pytest
+from benchmarks.fake_bfabric import FakeBfabric, FakeLogger
+from utils import cache_utils, entity_utils
+from utils.cache_utils import get_loaded_entity, get_partial_entity, peek_cached_entity, is_refreshing, acquire_refresh_lock
+
+
+@pytest.fixture
+def run():
+    return FakeBfabric(lanes=2, samples=4, orders=2)
+
+
+@pytest.fixture
+def partials(monkeypatch):
+    published = []
+    set_partial_entity = entity_utils.set_partial_entity
+
+    def record(*args):
+        published.append(json.loads(args[-1]))
+        set_partial_entity(*args)
+
+    monkeypatch.setattr(entity_utils, "set_partial_entity", record)
+    return published
+
+
+def load(run):
+    token_data = run.token_data()
+    key = entity_utils._entity_cache_key(token_data)
+    acquire_refresh_lock(*key)
+    entity_utils._run_progressive_load(token_data, FakeLogger(), run, run.run)
+    return key
+
+
+@pytest.mark.parametrize("cache_enabled", [True, False])
+def test_progressive_load_publishes_its_final_payload(redis, run, partials, monkeypatch, cache_enabled):
+    monkeypatch.setattr(cache_utils, "ENTITY_CACHE_ENABLED", cache_enabled)
+    key = load(run)
+
+    loaded = json.loads(get_loaded_entity(*key))
+    assert set(loaded["lanes"]) == {"1", "2"} and None not in loaded["lanes"].values()
+    assert get_partial_entity(*key) is None
+    assert not is_refreshing(*key)
+    assert (peek_cached_entity(*key) is not None) == cache_enabled
+
+
+def test_partial_payloads_carry_the_rows_of_the_loaded_lanes(redis, run, partials):
+    load(run)
+
+    assert partials[0]["lanes"] == {"1": None, "2": None} and partials[0]["samplesheet"] == {}
+    resolved = [position for position, lane in partials[1]["lanes"].items() if lane is not None]
+    assert list(partials[1]["samplesheet"]) == resolved
+    assert partials[1]["samples"] == {resolved[0]: 2}
+
+
+def test_failed_progressive_load_publishes_an_error(redis, run, partials, monkeypatch):
+    read = run.read
+
+    def failing_read(endpoint, *args, **kwargs):
+        if endpoint == "sample":
+            raise ConnectionError("B-Fabric is down")
+        return read(endpoint, *args, **kwargs)
+
+    monkeypatch.setattr(run, "read", failing_read)
+    key = load(run)
+
+    loaded = json.loads(get_loaded_entity(*key))
+    assert "B-Fabric is down" in loaded["error"]
+    assert loaded["lanes"] == {}
+    assert get_partial_entity(*key) is None
+    assert not is_refreshing(*key)
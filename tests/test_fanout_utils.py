@@ -0,0 +1,45 @@
+import pytest
+from rq.job import Job, JobStatus
+from utils import fanout_utils
+from utils.fanout_utils import order_groups, enqueue_fanout
+
+
+@pytest.fixture
+def draugr(monkeypatch, tmp_path):
+    # Orders listed in tmp_path/fail fail, the others succeed.
+    fail = tmp_path / "fail"
+    fail.write_text("")
+
+    def generate_draugr_command(order_list, run_folder, **options):
+        return " && ".join(f"! grep -qx {order} {fail}" for order in order_list)
+
+    monkeypatch.setattr(fanout_utils, "generate_draugr_command", generate_draugr_command)
+    return fail
+
+
+def test_order_groups_merges_orders_sharing_a_lane():
+    lanes = {"1": ["10 A", "11 B"], "2": ["12 C"], "3": ["11 B", "13 D"]}
+    assert order_groups(["10", "11", "12", "13"], lanes, "lane") == [["10", "11", "13"], ["12"]]
+    assert order_groups(["10", "11"], lanes, "order") == [["10"], ["11"]]
+    assert order_groups(["10", "11"], lanes, "none") == [["10", "11"]]
+
+
+def test_aggregate_reports_the_failed_group(redis, run_jobs, main_job, draugr):
+    draugr.write_text("2\n")
+    aggregate = enqueue_fanout("host", "host", [["1"], ["2"], ["3"]], {}, {"run_folder": "run"})
+    run_jobs("host", "host-light")
+
+    statuses = [Job.fetch(job_id, connection=redis).get_status() for job_id in aggregate.meta["fanout"]]
+    assert statuses == [JobStatus.FINISHED, JobStatus.FAILED, JobStatus.FINISHED]
+    aggregate = Job.fetch(aggregate.id, connection=redis)
+    assert aggregate.get_status() == JobStatus.FAILED
+    assert "['2']" in aggregate.exc_info
+
+
+def test_aggregate_succeeds_when_every_group_does(redis, run_jobs, main_job, draugr):
+    aggregate = enqueue_fanout("host", "host", [["1"], ["2"]], {}, {"run_folder": "run"})
+    run_jobs("host", "host-light")
+
+    aggregate = Job.fetch(aggregate.id, connection=redis)
+    assert aggregate.get_status() == JobStatus.FINISHED
+    assert [entry["status"] for entry in aggregate.result.values()] == ["finished", "finished"]
@@ -0,0 +1,42 @@
+import bfabric_web_apps
+import pytest
+from rq.job import Job, JobStatus
+from utils import job_utils, reuse_utils
+from utils.job_utils import run_draugr_job, run_commands, CommandFailed
+from utils.callback_utils import tracked
+
+
+def test_run_draugr_job_succeeds_when_all_commands_do(main_job, tmp_path):
+    run_draugr_job(bash_commands=[f"touch {tmp_path}/a", f"touch {tmp_path}/b"], token="t")
+    assert (tmp_path / "a").exists() and (tmp_path / "b").exists()
+
+
+def test_run_draugr_job_fails_on_a_failing_command_and_skips_the_rest(main_job, tmp_path):
+    with pytest.raises(CommandFailed, match="Command 1 of 2 exited with status 3"):
+        run_draugr_job(bash_commands=["exit 3", f"touch {tmp_path}/b"], token="t")
+    assert not (tmp_path / "b").exists()
+
+
+def test_run_draugr_job_fails_when_a_command_did_not_run(monkeypatch):
+    monkeypatch.setattr(bfabric_web_apps, "run_main_job", lambda bash_commands, **arguments: None)
+    with pytest.raises(CommandFailed, match="did not run"):
+        run_draugr_job(bash_commands=["true"], token="t")
+
+
+def test_run_commands_fails_on_a_failing_command():
+    with pytest.raises(CommandFailed, match="status 2"):
+        run_commands(["true", "exit 2"])
+
+
+def test_failed_demux_is_not_recorded_for_reuse(redis, run_jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(reuse_utils, "REUSE_MANIFEST", str(tmp_path / "manifest.jsonl"))
+    reuse = {"reuse": {"fingerprint": "f", "output": str(tmp_path), "orders": ["1"]}}
+
+    failed = bfabric_web_apps.q("host").enqueue(job_utils.run_commands, ["exit 1"], **tracked(reuse))
+    run_jobs("host")
+    assert Job.fetch(failed.id, connection=redis).get_status() == JobStatus.FAILED
+    assert reuse_utils.find_output("f") is None
+
+    succeeded = bfabric_web_apps.q("host").enqueue(job_utils.run_commands, ["true"], **tracked(reuse))
+    run_jobs("host")
+    assert reuse_utils.find_output("f")["job_id"] == succeeded.id
@@ -0,0 +1,30 @@
+from flask import Flask
+from utils import metrics_utils
+from utils.cache_utils import get_cached_entity, set_cached_entity, invalidate_entity_cache
+from utils.metrics_utils import render_metrics, register_metrics_route
+
+
+def test_metrics_include_the_entity_cache_counters(redis):
+    get_cached_entity("test", "Run", 1, "m")
+    set_cached_entity("test", "Run", 1, "m", "{}")
+    get_cached_entity("test", "Run", 1, "m")
+    invalidate_entity_cache("test", "Run", 2)
+
+    lines = render_metrics().splitlines()
+    assert 'draugr_entity_cache_events_total{event="hits"} 1' in lines
+    assert 'draugr_entity_cache_events_total{event="misses"} 1' in lines
+    assert 'draugr_entity_cache_events_total{event="invalidations"} 1' in lines
+    assert "draugr_entity_cache_entries 1" in lines
+
+
+def test_metrics_route_only_exists_when_enabled(redis, monkeypatch):
+    server = Flask(__name__)
+    register_metrics_route(server)
+    assert server.test_client().get("/metrics").status_code == 404
+
+    monkeypatch.setattr(metrics_utils, "METRICS_ENABLED", True)
+    server = Flask(__name__)
+    register_metrics_route(server)
+    response = server.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
@@ -0,0 +1,44 @@
+from dash import Patch
+from rq import Queue
+from utils.queue_utils import get_queue_snapshot, publish_queue_snapshot, queue_cards, queue_layout_update
+
+
+def noop():
+    pass
+
+
+def test_tab_is_sent_only_the_changed_queue_cards(redis):
+    Queue("host-a", connection=redis).enqueue(noop)
+    Queue("host-b", connection=redis).enqueue(noop)
+    publish_queue_snapshot()
+
+    layout, shown = queue_layout_update(get_queue_snapshot())
+    assert len(queue_cards(layout)) == 2
+    assert get_queue_snapshot(known_version=shown["version"]) is None
+
+    Queue("host-b", connection=redis).enqueue(noop)
+    publish_queue_snapshot()
+    snapshot = get_queue_snapshot(known_version=shown["version"])
+    patch, shown = queue_layout_update(snapshot, shown)
+
+    assert isinstance(patch, Patch)
+    cards = queue_cards(snapshot["layout"])
+    changed = next(index for index, card in enumerate(cards) if "host-b" in str(card))
+    operations = patch.to_plotly_json()["operations"]
+    assert len(operations) == 1
+    assert operations[0]["location"] == ["props", "children", "props", "children", changed]
+    assert operations[0]["params"]["value"] == cards[changed]
+
+
+def test_tab_is_sent_the_whole_layout_when_queues_change(redis):
+    Queue("host-a", connection=redis).enqueue(noop)
+    publish_queue_snapshot()
+    _, shown = queue_layout_update(get_queue_snapshot())
+
+    Queue("host-b", connection=redis).enqueue(noop)
+    publish_queue_snapshot()
+    layout, shown = queue_layout_update(get_queue_snapshot(known_version=shown["version"]), shown)
+
+    assert not isinstance(layout, Patch)
+    assert len(queue_cards(layout)) == 2
+    assert len(shown["digests"]) == 2
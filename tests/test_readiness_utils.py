@@ -0,0 +1,54 @@
+import pytest
+from utils import readiness_utils
+from utils.readiness_utils import run_folder_indexer, indexed_run_folders, check_run_folder
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.fixture
+def data_root(monkeypatch, tmp_path):
+    root = tmp_path / "data"
+    run = root / "20250101_A01234_0001_BHXXXXXXXX"
+    run.mkdir(parents=True)
+    (run / "RunInfo.xml").write_text('<RunInfo><Run><Reads><Read NumCycles="151"/><Read NumCycles="8"/></Reads></Run></RunInfo>')
+    (run / "CopyComplete.txt").write_text("")
+    monkeypatch.setattr(readiness_utils, "DATA_ROOT", str(root))
+    monkeypatch.setattr(readiness_utils, "ANALYSIS_ROOT", str(tmp_path))
+    monkeypatch.setattr(readiness_utils, "READINESS_MIN_FREE_GB", 0)
+    monkeypatch.setattr(readiness_utils, "prune_manifest", lambda host: None)
+    return root
+
+
+def index_once(monkeypatch):
+    def stop(seconds):
+        raise Stop()
+
+    monkeypatch.setattr(readiness_utils.time, "sleep", stop)
+    with pytest.raises(Stop):
+        run_folder_indexer("host")
+
+
+def test_indexer_records_the_run_folders(redis, data_root, monkeypatch):
+    index_once(monkeypatch)
+
+    record = indexed_run_folders("host")["20250101_A01234_0001_BHXXXXXXXX"]
+    assert (record["platform"], record["complete"], record["cycles"]) == ("illumina", True, 159)
+    assert check_run_folder("host", "/20250101_A01234_0001_BHXXXXXXXX/")["ready"]
+    assert check_run_folder("host", "missing")["ready"] is False
+
+
+def test_restarted_indexer_does_not_examine_complete_runs_again(redis, data_root, monkeypatch):
+    index_once(monkeypatch)
+    (data_root / "gone").mkdir()
+    index_once(monkeypatch)
+    (data_root / "gone").rmdir()
+
+    inspected = []
+    inspect_run_folder = readiness_utils.inspect_run_folder
+    monkeypatch.setattr(readiness_utils, "inspect_run_folder", lambda path, previous=None: inspected.append(path) or inspect_run_folder(path, previous))
+    index_once(monkeypatch)
+
+    assert inspected == []
+    assert list(indexed_run_folders("host")) == ["20250101_A01234_0001_BHXXXXXXXX"]
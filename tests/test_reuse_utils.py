@@ -0,0 +1,57 @@
+import json
+from types import SimpleNamespace
+import pytest
+from utils import reuse_utils
+from utils.reuse_utils import demux_fingerprint, record_output, prune_manifest, find_output, KEY
+
+RECORD = {"complete": True, "mtime": 1, "size_gb": 10, "cycles": 151}
+SAMPLE_SHEET = {"1": [["s1", "A", "10", "ACGT", ""], ["s2", "B", "10", "TTGA", ""]]}
+
+
+@pytest.fixture
+def manifest(monkeypatch, tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    monkeypatch.setattr(reuse_utils, "REUSE_MANIFEST", str(path))
+    monkeypatch.setattr(reuse_utils.socket, "gethostname", lambda: "host")
+    return path
+
+
+def fingerprint(sample_sheet=SAMPLE_SHEET, orders=("10",), **settings):
+    return demux_fingerprint("host", "/run/", RECORD, sample_sheet, list(orders), tools=["bcl2fastq/2.20"], **settings)
+
+
+def record(fingerprint, output, orders):
+    job = SimpleNamespace(id=f"job-{fingerprint}", meta={"reuse": {"fingerprint": fingerprint, "output": str(output), "orders": orders}})
+    record_output(job, reuse_utils.redis_conn)
+
+
+def test_fingerprint_follows_the_sample_sheet_rows():
+    assert fingerprint() == fingerprint({"1": list(reversed(SAMPLE_SHEET["1"]))})
+    assert fingerprint() != fingerprint({"1": [["s1", "A", "10", "ACGA", ""], SAMPLE_SHEET["1"][1]]})
+    assert fingerprint() != fingerprint({"2": SAMPLE_SHEET["1"]})
+    assert fingerprint() != fingerprint(is_multiome=True)
+    assert demux_fingerprint("host", "run", {"complete": False}, SAMPLE_SHEET, ["10"]) is None
+
+
+def test_newer_demux_of_the_same_orders_supersedes_the_older_one(redis, manifest, tmp_path):
+    record("old", tmp_path, ["10", "11"])
+    record("other", tmp_path, ["12"])
+    record("new", tmp_path, ["11"])
+
+    assert find_output("old") is None
+    assert find_output("other")["orders"] == ["12"]
+    assert find_output("new")["job_id"] == "job-new"
+
+
+def test_prune_drops_superseded_and_removed_outputs(redis, manifest, tmp_path):
+    removed = tmp_path / "removed"
+    record("old", tmp_path, ["10"])
+    record("gone", removed, ["10"])
+    record("new", tmp_path, ["10"])
+    # A worker recording an output elsewhere keeps its Redis entry.
+    redis.hset(KEY, "elsewhere", json.dumps({"fingerprint": "elsewhere", "output": str(removed), "orders": ["10"], "host": "other"}))
+
+    prune_manifest("host")
+
+    assert [json.loads(line)["fingerprint"] for line in manifest.read_text().splitlines()] == ["new"]
+    assert sorted(redis.hkeys(KEY)) == [b"elsewhere", b"new"]
@@ -0,0 +1,54 @@
+import bfabric_web_apps
+from utils import routing_utils
+from utils.routing_utils import route
+
+
+def fill(host, jobs):
+    for _ in range(jobs):
+        bfabric_web_apps.q(host).enqueue(print)
+
+
+def test_route_only_considers_the_given_hosts(redis, monkeypatch):
+    monkeypatch.setattr(routing_utils, "shared_data_groups", [["a", "b"]])
+    monkeypatch.setattr(routing_utils, "HOST_MAX_OUTSTANDING", 2)
+    fill("a", 2)
+
+    assert route("a")["host"] == "b"
+    decision = route("a", hosts=["a"])
+    assert not decision["admitted"]
+    assert list(decision["loads"]) == ["a"]
+
+
+def test_host_load_counts_every_queue_of_the_host(redis):
+    fill("a", 1)
+    fill("a-post", 1)
+    fill("a-light", 2)
+    fill("b", 1)
+
+    load = routing_utils.host_load("a")
+    assert (load["queued"], load["outstanding"]) == (4, 4)
+
+
+def test_jobs_waiting_on_a_submission_count_once(redis, main_job):
+    from utils.stage_utils import enqueue_stages, STAGES
+    enqueue_stages("a", [(stage, "true") for stage in STAGES], {}, "pipeline", "run")
+
+    load = routing_utils.host_load("a")
+    assert (load["queued"], load["deferred"], load["outstanding"]) == (1, 3, 1)
+
+
+def test_dependents_of_failed_jobs_are_not_counted(redis, run_jobs, main_job, monkeypatch):
+    from utils.stage_utils import enqueue_stages, retry_failed_stages, STAGES
+    monkeypatch.setattr(routing_utils, "HOST_MAX_OUTSTANDING", 1)
+    enqueue_stages("a", [(stage, "false") for stage in STAGES], {}, "pipeline", "run")
+    run_jobs("a", "a-light", "a-post")
+
+    load = routing_utils.host_load("a")
+    assert (load["queued"], load["running"], load["deferred"], load["outstanding"]) == (0, 0, 0, 0)
+    assert route("a")["admitted"]
+
+    # Retrying the failed stage revives them.
+    retry_failed_stages("pipeline")
+    load = routing_utils.host_load("a")
+    assert (load["queued"], load["deferred"], load["outstanding"]) == (1, 3, 1)
+    assert not route("a")["admitted"]
@@ -0,0 +1,40 @@
+import json
+import bfabric_web_apps
+from utils.callback_utils import tracked
+from utils.job_utils import run_draugr_job
+from utils.runtime_utils import HISTORY_KEY, KEY_PREFIX, predict_runtime
+
+FEATURES = {"stage": "full", "path": "bcl2fastq", "lanes": 1, "samples": 8, "multiome": False, "host": "host"}
+
+
+def enqueue(command):
+    return bfabric_web_apps.q("host").enqueue(
+        run_draugr_job, kwargs={"bash_commands": [command]}, **tracked({}, FEATURES)
+    )
+
+
+def test_only_succeeded_jobs_are_recorded_in_buckets(redis, run_jobs, main_job):
+    failed = enqueue("false")
+    run_jobs("host")
+
+    history = [json.loads(record) for record in redis.lrange(HISTORY_KEY, 0, -1)]
+    assert [(record["job_id"], record["status"]) for record in history] == [(failed.id, "failed")]
+    assert redis.keys(f"{KEY_PREFIX}:full:*") == []
+
+    finished = enqueue("true")
+    run_jobs("host")
+
+    history = [json.loads(record) for record in redis.lrange(HISTORY_KEY, 0, -1)]
+    assert [(record["job_id"], record["status"]) for record in history] == [(finished.id, "finished"), (failed.id, "failed")]
+    assert redis.lrange(f"{KEY_PREFIX}:full:bcl2fastq", 0, -1) == [b"0"]
+
+
+def test_prediction_uses_the_most_specific_bucket_with_enough_history(redis, monkeypatch):
+    from utils import runtime_utils
+    monkeypatch.setattr(runtime_utils, "RUNTIME_MIN_SAMPLES", 2)
+    redis.rpush(f"{KEY_PREFIX}:full:bcl2fastq", 100, 200, 300)
+    redis.rpush(f"{KEY_PREFIX}:full:bcl2fastq:1", 10)
+
+    prediction = predict_runtime(FEATURES)
+    assert prediction["bucket"] == "full:bcl2fastq"
+    assert prediction["p50"] == 200
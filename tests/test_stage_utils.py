@@ -0,0 +1,42 @@
+import json
+from rq.job import Job, JobStatus
+from utils.stage_utils import STAGES, enqueue_stages, retry_failed_stages
+
+QUEUES = ("host", "host-light", "host-post")
+
+
+def stages(*commands):
+    return list(zip(STAGES, commands))
+
+
+def statuses(redis, jobs):
+    return [Job.fetch(job.id, connection=redis).get_status() for job in jobs]
+
+
+def test_stages_run_in_order(redis, run_jobs, main_job, tmp_path):
+    order = tmp_path / "order"
+    jobs = enqueue_stages("host", stages(*[f"echo {stage['name']} >> {order}" for stage in STAGES]), {}, "pipeline", "run")
+    run_jobs(*QUEUES)
+
+    assert statuses(redis, jobs) == [JobStatus.FINISHED] * len(STAGES)
+    assert order.read_text().split() == [stage["name"] for stage in STAGES]
+    assert jobs[-1].meta["stages"] == [job.id for job in jobs]
+    assert json.loads(redis.get("pipeline")) == [job.id for job in jobs]
+
+
+def test_failed_stage_stops_the_pipeline_and_is_retried(redis, run_jobs, main_job, tmp_path):
+    ready = tmp_path / "ready"
+    done = tmp_path / "done"
+    jobs = enqueue_stages("host", stages("true", f"test -f {ready}", f"touch {done}"), {}, "pipeline", "run")
+    run_jobs(*QUEUES)
+
+    assert statuses(redis, jobs) == [JobStatus.FINISHED, JobStatus.FAILED, JobStatus.DEFERRED]
+    assert not done.exists()
+
+    ready.touch()
+    assert retry_failed_stages("pipeline") == ["demux"]
+    run_jobs(*QUEUES)
+
+    assert statuses(redis, jobs) == [JobStatus.FINISHED] * 3
+    assert done.exists()
+    assert retry_failed_stages("pipeline") == []
@@ -0,0 +1,36 @@
+import bfabric_web_apps
+import pytest
+from utils import routing_utils, watcher_utils
+from utils.watcher_utils import submit_run
+
+RUN_FOLDER = "20250101_A01234_0001_BHXXXXXXXX"
+
+
+@pytest.fixture
+def run(monkeypatch):
+    entity = {"datafolder": RUN_FOLDER, "containers": ["10"], "server": "a", "lanes": {}, "samplesheet": {}}
+    monkeypatch.setattr(watcher_utils, "run_folder_entity", lambda wrapper, run_folder, server=None: entity)
+    monkeypatch.setattr(watcher_utils, "check_run_folder", lambda host, run_folder: {"ready": None, "problems": [], "record": None})
+    monkeypatch.setattr(watcher_utils, "generate_draugr_command", lambda **options: "true")
+    monkeypatch.setattr(routing_utils, "HOST_MAX_OUTSTANDING", 1)
+    return entity
+
+
+def test_watcher_submissions_are_admitted_like_manual_ones(redis, run):
+    bfabric_web_apps.q("a").enqueue(print)
+    assert submit_run("a", None, RUN_FOLDER) == ("refused", None)
+
+    bfabric_web_apps.q("a").empty()
+    status, job_id = submit_run("a", None, RUN_FOLDER)
+    assert status == "submitted"
+    assert bfabric_web_apps.q("a").job_ids == [job_id]
+    assert submit_run("a", None, RUN_FOLDER) == ("duplicate", job_id)
+
+
+def test_watcher_submissions_are_routed_to_hosts_sharing_the_data(redis, run, monkeypatch):
+    monkeypatch.setattr(routing_utils, "shared_data_groups", [["a", "b"]])
+    bfabric_web_apps.q("a").enqueue(print)
+
+    status, job_id = submit_run("a", None, RUN_FOLDER)
+    assert status == "submitted"
+    assert bfabric_web_apps.q("b").job_ids == [job_id]
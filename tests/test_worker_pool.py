@@ -0,0 +1,98 @@
+import multiprocessing
+import time
+import bfabric_web_apps
+import pytest
+from rq import Worker
+from utils import worker_pool
+from utils.worker_pool import ResourceSlots, SlotWorker, RESOURCE_PROFILES
+
+TOTALS = {"cores": 32, "memory_gb": 128, "scratch_gb": 500}
+
+
+@pytest.fixture
+def slots():
+    return ResourceSlots(multiprocessing.get_context("fork"), TOTALS, 3)
+
+
+def test_slots_are_taken_and_released(slots):
+    assert slots.try_acquire(0, RESOURCE_PROFILES["post-demux"])
+    assert slots.free() == {"cores": 24, "memory_gb": 96, "scratch_gb": 400}
+    assert slots.try_acquire(1, RESOURCE_PROFILES["demux"]) is None
+    assert slots.try_acquire(1, RESOURCE_PROFILES["light"])
+
+    slots.release(0)
+    assert slots.free() == {"cores": 31, "memory_gb": 126, "scratch_gb": 500}
+    # Requests beyond the host get the whole host.
+    assert slots.try_acquire(0, {"cores": 64}) is None
+    slots.release(1)
+    assert slots.try_acquire(0, {"cores": 64}) == {"cores": 32, "memory_gb": 0, "scratch_gb": 0}
+
+
+def test_leases_expire_unless_renewed(slots):
+    slots.try_acquire(0, RESOURCE_PROFILES["post-demux"], ttl=0.2)
+    slots.try_acquire(1, RESOURCE_PROFILES["light"], ttl=0.2)
+    slots.renew(1, ttl=60)
+    time.sleep(0.3)
+    assert slots.free() == {"cores": 31, "memory_gb": 126, "scratch_gb": 500}
+
+
+@pytest.fixture
+def worker(redis, slots, monkeypatch):
+    ran = []
+    monkeypatch.setattr(Worker, "execute_job", lambda self, job, queue: ran.append(job.id))
+    monkeypatch.setattr(worker_pool, "SLOT_POLL_SECONDS", 0.1)
+    monkeypatch.setattr(SlotWorker, "slots", slots)
+    monkeypatch.setattr(SlotWorker, "slot", 0)
+    worker = SlotWorker([bfabric_web_apps.q("heavy"), bfabric_web_apps.q("light")], connection=redis)
+    worker.ran = ran
+    return worker
+
+
+def enqueue(queue, profile):
+    return bfabric_web_apps.q(queue).enqueue(print, meta={"resources": RESOURCE_PROFILES[profile]})
+
+
+def step(worker):
+    job, queue = worker.dequeue_job_and_maintain_ttl(None)
+    worker.execute_job(job, queue)
+    return job
+
+
+def test_job_which_does_not_fit_goes_back_to_its_queue(worker, slots):
+    slots.try_acquire(1, RESOURCE_PROFILES["post-demux"])
+    demux = enqueue("heavy", "demux")
+    light = enqueue("light", "light")
+
+    assert step(worker).id == demux.id
+    assert worker.ran == []
+    assert bfabric_web_apps.q("heavy").job_ids == [demux.id]
+    assert "slot_wait_since" in demux.get_meta(refresh=True)
+
+    # The worker goes on with its other queues meanwhile.
+    assert step(worker).id == light.id
+    assert worker.ran == [light.id]
+    assert bfabric_web_apps.q("heavy").job_ids == [demux.id]
+
+
+def test_job_runs_once_resources_are_released(worker, slots):
+    slots.try_acquire(1, RESOURCE_PROFILES["post-demux"])
+    demux = enqueue("heavy", "demux")
+    step(worker)
+
+    slots.release(1)
+    assert step(worker).id == demux.id
+    assert worker.ran == [demux.id]
+    assert bfabric_web_apps.q("heavy").job_ids == []
+    # The worker released its slots after the job.
+    assert slots.free() == TOTALS
+
+
+def test_blocked_queue_is_looked_at_again_after_a_while(worker, slots, monkeypatch):
+    monkeypatch.setattr(worker_pool, "SLOT_WAIT_HEARTBEAT", 0.3)
+    slots.try_acquire(1, RESOURCE_PROFILES["post-demux"], ttl=0.2)
+    demux = enqueue("heavy", "demux")
+    step(worker)
+
+    # The lease expired without a release.
+    assert step(worker).id == demux.id
+    assert worker.ran == [demux.id]
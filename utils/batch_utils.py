@@ -0,0 +1,242 @@
+"""
+Batch re-triggering of several runs in one action.
+
+The runs are resolved concurrently, their commands built and validated, and every valid
+command is routed (see utils.routing_utils) and enqueued within a single Redis transaction.
+Like single submissions, the batch holds the submission lock of each run's fingerprint (see
+utils.submission_utils) and the admission lock of the hosts from the duplicate check until
+the jobs are enqueued. Each run is submitted as one job, traced like a single submission
+(see utils.trace_utils); staged submission and fan-out don't apply.
+"""
+
+import json
+import re
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+import bfabric_web_apps
+from rq import Queue
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.entity_utils import extended_entity_data
+from utils.draugr_utils import generate_draugr_command
+from utils.submission_utils import submission_fingerprint, active_submission, fingerprint_lock, job_status, KEY_PREFIX, RECORD_TTL
+from utils.metrics_utils import timer, ENQUEUE_SECONDS
+from utils.config import BATCH_RESOLVE_WORKERS
+from utils.routing_utils import route, eligible_hosts, admission_lock, AdmissionRefused
+from utils.worker_pool import RESOURCE_PROFILES
+from utils.log_stream_utils import logged_command
+from utils.job_utils import run_draugr_job
+from utils.readiness_utils import check_run_folder
+from utils.runtime_utils import job_features
+from utils.callback_utils import tracked
+from utils.reuse_utils import demux_fingerprint, tool_versions, reuse_meta
+from utils.samplesheet_utils import selected_rows
+from utils.trace_utils import new_trace_id, record_span
+
+
+def parse_run_ids(text: str) -> list:
+    """
+    Extracts the run IDs from free text (comma, space or newline separated), without duplicates.
+    """
+    run_ids = []
+    for run_id in re.findall(r"\d+", text or ""):
+        if run_id not in run_ids:
+            run_ids.append(run_id)
+    return run_ids
+
+
+def resolve_runs(token_data: dict, run_ids: list) -> dict:
+    """
+    Loads the extended entity data of several runs concurrently.
+
+    Returns:
+        dict: {run ID: entity dict, or None if it couldn't be loaded}
+    """
+    def resolve(run_id):
+        try:
+            payload = extended_entity_data({**token_data, "entityClass_data": "Run", "entity_id_data": run_id})
+            return json.loads(payload) if payload else None
+        except Exception as e:
+            print(f"Failed to resolve run {run_id}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=BATCH_RESOLVE_WORKERS) as executor:
+        return dict(zip(run_ids, executor.map(resolve, run_ids)))
+
+
+def submit_batch(token_data: dict, token: str, run_ids: list, options: dict, force: bool = False) -> list:
+    """
+    Re-triggers demultiplexing of all orders of several runs.
+
+    Args:
+        token_data (dict): Token data of the session, used to read the runs.
+        token (str): The session's token, passed on to run_main_job.
+        run_ids (list): IDs of the runs to re-trigger.
+        options (dict): generate_draugr_command keyword arguments shared by all runs
+            (disable_wizard, is_multiome, bcl_flags, cellranger_flags, bases2fastq_flags, advanced_options).
+        force (bool): Also enqueue runs with an identical job already queued or running, or whose run folder does not look ready.
+
+    Returns:
+        list: One result dict per run, with the keys run_id, name, server, datafolder, orders, status and job_id.
+    """
+    env = token_data.get("environment")
+    entities = resolve_runs(token_data, run_ids)
+
+    results = []
+    candidates = []
+    for run_id in run_ids:
+        entity = entities.get(run_id)
+        result = {
+            "run_id": run_id,
+            "name": (entity or {}).get("name", ""),
+            "server": (entity or {}).get("server", ""),
+            "datafolder": (entity or {}).get("datafolder", ""),
+            "orders": len((entity or {}).get("containers", [])),
+            "status": "",
+            "job_id": "",
+        }
+        results.append(result)
+
+        if not entity:
+            result["status"] = "Error: run could not be loaded"
+            continue
+        if not entity.get("server"):
+            result["status"] = "Error: missing 'server' in entity"
+            continue
+        if not entity.get("datafolder"):
+            result["status"] = "Error: missing 'datafolder' in entity"
+            continue
+        if not entity.get("containers"):
+            result["status"] = "Error: run has no orders"
+            continue
+
+        readiness = check_run_folder(entity["server"], entity["datafolder"])
+        if not force and readiness["ready"] is False:
+            result["status"] = "Not ready: " + " ".join(readiness["problems"])
+            continue
+
+        try:
+            command = generate_draugr_command(
+                server=entity["server"],
+                run_folder=entity["datafolder"],
+                order_list=entity["containers"],
+                env=env,
+                **options
+            )
+        except Exception as e:
+            result["status"] = f"Error: {e}"
+            continue
+
+        fingerprint = submission_fingerprint(
+            server=entity["server"],
+            run_folder=entity["datafolder"],
+            order_list=entity["containers"],
+            env=env,
+            **options
+        )
+        candidates.append((result, entity, readiness, command, fingerprint))
+
+    if not candidates:
+        return results
+
+    # Locks are taken in the same order as by single submissions: fingerprints, then hosts, each sorted.
+    try:
+        with ExitStack() as stack:
+            for fingerprint in sorted({fingerprint for *_, fingerprint in candidates}):
+                stack.enter_context(fingerprint_lock(fingerprint))
+            stack.enter_context(admission_lock([host for _, entity, *_ in candidates for host in eligible_hosts(entity["server"])]))
+            _enqueue_batch(candidates, token, options, env, force)
+    except AdmissionRefused as e:
+        for result, *_ in candidates:
+            result["status"] = f"Refused: {e}"
+    except Exception as e:
+        print(f"Batch enqueue failed: {e}")
+        for result, *_ in candidates:
+            if not result["status"]:
+                result["status"] = f"Error: enqueue failed ({e})"
+    return results
+
+
+def _enqueue_batch(candidates: list, token: str, options: dict, env: str, force: bool):
+    """
+    Routes and enqueues the valid runs of a batch, filling in their results. Runs with the
+    submission and admission locks held, see submit_batch.
+    """
+    pending = {}
+    for result, entity, readiness, command, fingerprint in candidates:
+        if not force:
+            active = active_submission(fingerprint)
+            if active:
+                result["status"] = f"Skipped: identical job already {job_status(active)}"
+                result["job_id"] = active.id
+                continue
+
+        decision = route(entity["server"], pending={host: len(entries) for host, entries in pending.items()})
+        if not decision["admitted"]:
+            result["status"] = f"Refused: {decision['reason']}"
+            continue
+
+        trace_id = new_trace_id()
+        job_id, command, log_meta = logged_command(command, entity["datafolder"], trace_id)
+        # Record the demux output for later reuse, see utils.reuse_utils.
+        reuse = {}
+        if "--skip-demux" not in (options.get("advanced_options") or []):
+            reuse = reuse_meta(demux_fingerprint(
+                entity["server"],
+                entity["datafolder"],
+                readiness["record"],
+                selected_rows(entity, entity["containers"]),
+                entity["containers"],
+                disable_wizard=options.get("disable_wizard"),
+                is_multiome=options.get("is_multiome"),
+                bcl_flags=options.get("bcl_flags"),
+                cellranger_flags=options.get("cellranger_flags"),
+                bases2fastq_flags=options.get("bases2fastq_flags"),
+                env=env,
+                tools=tool_versions(entity["server"])
+            ), env, entity["datafolder"], entity["containers"])
+        arguments = {
+            "files_as_byte_strings": {},
+            "bash_commands": [command],
+            "resource_paths": {},
+            "attachment_paths": {},
+            "token": token,
+            "service_id": 0,
+            "charge": []
+        }
+        pending.setdefault(decision["host"], []).append(
+            (result, fingerprint, trace_id, Queue.prepare_data(
+                run_draugr_job, kwargs=arguments, job_id=job_id,
+                **tracked({**log_meta, "resources": RESOURCE_PROFILES["demux"], **reuse}, job_features(
+                    entity,
+                    entity["containers"],
+                    decision["host"],
+                    advanced_options=options.get("advanced_options"),
+                    is_multiome=options.get("is_multiome"),
+                    cellranger_flags=options.get("cellranger_flags"),
+                    bases2fastq_flags=options.get("bases2fastq_flags"),
+                    platform=(readiness["record"] or {}).get("platform")
+                ))
+            ))
+        )
+
+    if not pending:
+        return
+
+    # All jobs, and their submission records, go to Redis in one transaction.
+    start = time.time()
+    with timer(ENQUEUE_SECONDS, queue="batch"):
+        pipe = redis_conn.pipeline()
+        enqueued = []
+        for host, entries in pending.items():
+            jobs = bfabric_web_apps.q(host).enqueue_many([job_data for *_, job_data in entries], pipeline=pipe)
+            for (result, fingerprint, trace_id, _), job in zip(entries, jobs):
+                pipe.set(f"{KEY_PREFIX}:{fingerprint}", job.id, ex=RECORD_TTL)
+                enqueued.append((result, host, trace_id, job))
+        pipe.execute()
+    end = time.time()
+
+    for result, host, trace_id, job in enqueued:
+        result["status"] = f"Queued on '{host}'"
+        result["job_id"] = job.id
+        record_span(trace_id, "enqueue", start, end, job.id, batch=len(enqueued))
@@ -0,0 +1,253 @@
+"""
+Shared cache of extended entity data, kept in the same Redis instance as the job queues.
+
+Payloads are keyed by (environment, entity class, entity id, entity modification time),
+so a modified entity never hits a stale entry. Each entity also keeps a pointer to its most
+recently stored payload. Within ENTITY_CACHE_FRESH_SECONDS of a store that payload is served
+as is; after that it is still served immediately, while a background refresh
+(see utils.entity_utils.cached_entity_data) re-reads the entity from B-Fabric.
+"""
+
+import time
+from redis.exceptions import RedisError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.config import (
+    ENTITY_CACHE_ENABLED,
+    ENTITY_CACHE_TTL,
+    ENTITY_CACHE_FRESH_SECONDS,
+    ENTITY_CACHE_MAX_ENTRIES
+)
+
+KEY_PREFIX = "draugr-ui:entity"
+INDEX_KEY = f"{KEY_PREFIX}:index"
+STATS_KEY = f"{KEY_PREFIX}:stats"
+
+
+def _entity_key(environment, entity_class, entity_id) -> str:
+    return f"{KEY_PREFIX}:{environment}:{entity_class}:{entity_id}"
+
+
+def _entry_key(environment, entity_class, entity_id, modified) -> str:
+    return f"{_entity_key(environment, entity_class, entity_id)}:{modified}"
+
+
+def _count(field: str):
+    try:
+        redis_conn.hincrby(STATS_KEY, field, 1)
+    except RedisError:
+        pass
+
+
+def _latest_payload(entity_key: str):
+    key = redis_conn.get(f"{entity_key}:latest")
+    return redis_conn.get(key) if key else None
+
+
+def get_cached_entity(environment, entity_class, entity_id, modified=None, stale=False):
+    """
+    Looks up a cached extended entity payload.
+
+    Args:
+        environment (str): B-Fabric environment of the session.
+        entity_class (str): Entity class, e.g. "Run".
+        entity_id (str): Entity ID.
+        modified (str, optional): The entity's modification timestamp. If omitted, the most
+            recently stored payload is returned, but only within ENTITY_CACHE_FRESH_SECONDS.
+        stale (bool, optional): With modified omitted, return the most recently stored
+            payload even if it is older than ENTITY_CACHE_FRESH_SECONDS.
+
+    Returns:
+        str: The cached JSON payload, or None on a miss.
+    """
+    if not ENTITY_CACHE_ENABLED:
+        return None
+
+    entity_key = _entity_key(environment, entity_class, entity_id)
+    try:
+        if modified is None:
+            if not stale and not redis_conn.exists(f"{entity_key}:fresh"):
+                _count("misses")
+                return None
+            payload = _latest_payload(entity_key)
+        else:
+            payload = redis_conn.get(_entry_key(environment, entity_class, entity_id, modified))
+    except RedisError as e:
+        print(f"Entity cache lookup failed: {e}")
+        return None
+
+    if stale:
+        # Only called after a missed fresh lookup, which was already counted.
+        if payload:
+            _count("stale_hits")
+    else:
+        _count("hits" if payload else "misses")
+    return payload.decode("utf-8") if payload else None
+
+
+def peek_cached_entity(environment, entity_class, entity_id):
+    """
+    Returns the most recently stored payload of an entity, however old, or None. Unlike
+    get_cached_entity, the lookup isn't counted in the cache statistics, for callers
+    polling for a refresh rather than serving a page load.
+    """
+    if not ENTITY_CACHE_ENABLED:
+        return None
+    try:
+        payload = _latest_payload(_entity_key(environment, entity_class, entity_id))
+    except RedisError as e:
+        print(f"Entity cache lookup failed: {e}")
+        return None
+    return payload.decode("utf-8") if payload else None
+
+
+def set_cached_entity(environment, entity_class, entity_id, modified, payload: str):
+    """
+    Stores an extended entity payload and evicts the oldest entries beyond ENTITY_CACHE_MAX_ENTRIES.
+
+    Args:
+        environment (str): B-Fabric environment of the session.
+        entity_class (str): Entity class, e.g. "Run".
+        entity_id (str): Entity ID.
+        modified (str): The entity's modification timestamp.
+        payload (str): The JSON payload returned by extended_entity_data.
+    """
+    if not ENTITY_CACHE_ENABLED:
+        return
+
+    entity_key = _entity_key(environment, entity_class, entity_id)
+    key = _entry_key(environment, entity_class, entity_id, modified)
+    try:
+        pipe = redis_conn.pipeline()
+        pipe.set(key, payload, ex=ENTITY_CACHE_TTL)
+        pipe.set(f"{entity_key}:latest", key, ex=ENTITY_CACHE_TTL)
+        pipe.set(f"{entity_key}:fresh", 1, ex=ENTITY_CACHE_FRESH_SECONDS)
+        pipe.zadd(INDEX_KEY, {key: time.time()})
+        pipe.execute()
+
+        overflow = redis_conn.zcard(INDEX_KEY) - ENTITY_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = redis_conn.zpopmin(INDEX_KEY, overflow)
+            if evicted:
+                redis_conn.delete(*[member for member, _ in evicted])
+                redis_conn.hincrby(STATS_KEY, "evictions", len(evicted))
+    except RedisError as e:
+        print(f"Entity cache store failed: {e}")
+
+
+def invalidate_entity_cache(environment, entity_class, entity_id) -> int:
+    """
+    Drops every cached payload of an entity, whatever its modification time, along with
+    its pointers to the latest one. A running refresh, and the partial payload it
+    publishes, are left alone.
+
+    Returns:
+        int: Number of deleted keys.
+    """
+    entity_key = _entity_key(environment, entity_class, entity_id)
+    try:
+        entries = {member for member, _ in redis_conn.zscan_iter(INDEX_KEY, match=f"{entity_key}:*")}
+        latest = redis_conn.get(f"{entity_key}:latest")
+        if latest:
+            entries.add(latest)
+        keys = list(entries) + [f"{entity_key}:latest", f"{entity_key}:fresh"]
+
+        pipe = redis_conn.pipeline()
+        if entries:
+            pipe.zrem(INDEX_KEY, *entries)
+        pipe.delete(*keys)
+        pipe.hincrby(STATS_KEY, "invalidations", 1)
+        return pipe.execute()[-2]
+    except RedisError as e:
+        print(f"Entity cache invalidation failed: {e}")
+        return 0
+
+
+def set_partial_entity(environment, entity_class, entity_id, payload: str, timeout: int = 300):
+    """
+    Publishes the partially loaded payload of an entity whose lanes are still being resolved.
+    """
+    try:
+        redis_conn.set(f"{_entity_key(environment, entity_class, entity_id)}:partial", payload, ex=timeout)
+    except RedisError as e:
+        print(f"Entity cache partial store failed: {e}")
+
+
+def set_loaded_entity(environment, entity_class, entity_id, payload: str, timeout: int = 300):
+    """
+    Publishes the outcome of a background load, the final payload or one with an "error",
+    in place of its partial payload. Unlike set_cached_entity this doesn't depend on
+    ENTITY_CACHE_ENABLED, so pollers see the load end either way.
+    """
+    entity_key = _entity_key(environment, entity_class, entity_id)
+    try:
+        pipe = redis_conn.pipeline()
+        pipe.set(f"{entity_key}:loaded", payload, ex=timeout)
+        pipe.delete(f"{entity_key}:partial")
+        pipe.execute()
+    except RedisError as e:
+        print(f"Entity cache loaded store failed: {e}")
+
+
+def get_loaded_entity(environment, entity_class, entity_id):
+    """
+    Returns the outcome of the latest background load of an entity, see set_loaded_entity, or None.
+    """
+    try:
+        payload = redis_conn.get(f"{_entity_key(environment, entity_class, entity_id)}:loaded")
+    except RedisError as e:
+        print(f"Entity cache loaded lookup failed: {e}")
+        return None
+    return payload.decode("utf-8") if payload else None
+
+
+def get_partial_entity(environment, entity_class, entity_id):
+    """
+    Returns the latest partially loaded payload of an entity, or None.
+    """
+    try:
+        payload = redis_conn.get(f"{_entity_key(environment, entity_class, entity_id)}:partial")
+    except RedisError as e:
+        print(f"Entity cache partial lookup failed: {e}")
+        return None
+    return payload.decode("utf-8") if payload else None
+
+
+def acquire_refresh_lock(environment, entity_class, entity_id, timeout: int = 300) -> bool:
+    """
+    Marks a background refresh of an entity as running, so concurrent tabs don't start their own.
+
+    Returns:
+        bool: True if the caller should run the refresh.
+    """
+    try:
+        return bool(redis_conn.set(f"{_entity_key(environment, entity_class, entity_id)}:refreshing", 1, nx=True, ex=timeout))
+    except RedisError as e:
+        print(f"Entity cache refresh lock failed: {e}")
+        return False
+
+
+def release_refresh_lock(environment, entity_class, entity_id):
+    try:
+        redis_conn.delete(f"{_entity_key(environment, entity_class, entity_id)}:refreshing")
+    except RedisError as e:
+        print(f"Entity cache refresh unlock failed: {e}")
+
+
+def is_refreshing(environment, entity_class, entity_id) -> bool:
+    try:
+        return bool(redis_conn.exists(f"{_entity_key(environment, entity_class, entity_id)}:refreshing"))
+    except RedisError:
+        return False
+
+
+def entity_cache_stats() -> dict:
+    """
+    Returns the hit, stale hit, miss, eviction and invalidation counters, plus the current number of entries.
+    """
+    try:
+        stats = {field.decode("utf-8"): int(value) for field, value in redis_conn.hgetall(STATS_KEY).items()}
+        stats["entries"] = redis_conn.zcard(INDEX_KEY)
+        return stats
+    except RedisError as e:
+        print(f"Entity cache stats unavailable: {e}")
+        return {}
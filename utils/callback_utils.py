@@ -0,0 +1,29 @@
+"""
+rq callbacks of Draugr jobs.
+
+Every Draugr job is enqueued with the keyword arguments returned by tracked, so that once
+it finished its run time is recorded (see utils.runtime_utils) and, for successful demux
+jobs, its output is added to the reuse manifest (see utils.reuse_utils). Jobs only count as
+successful if all their commands succeeded, see utils.job_utils.
+"""
+
+from utils.runtime_utils import record_runtime
+from utils.reuse_utils import record_output
+
+
+def tracked(meta: dict, features: dict = None) -> dict:
+    """
+    Returns the enqueue keyword arguments for a job with the given meta and, if given, runtime features.
+    """
+    if features:
+        meta = {**meta, "features": features}
+    return {"meta": meta, "on_success": job_succeeded, "on_failure": job_failed}
+
+
+def job_succeeded(job, connection, result, *args, **kwargs):
+    record_runtime(job, connection, "finished")
+    record_output(job, connection)
+
+
+def job_failed(job, connection, type, value, traceback):
+    record_runtime(job, connection, "failed")
@@ -0,0 +1,130 @@
+"""
+App specific configuration for Draugr UI.
+
+Values are read from the environment, falling back to the draugr_ui.env file in the
+working directory (see draugr_ui.env.example). They are kept out of .env, which
+bfabric_web_apps reads its own settings from and refuses unknown keys in.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv("draugr_ui.env")
+
+
+# Maximum number of B-Fabric reads in flight while loading the lanes of a run.
+# Set to 1 to fetch the lanes sequentially.
+ENTITY_READ_WORKERS = int(os.getenv("ENTITY_READ_WORKERS", 8))
+
+# Shared Redis cache of extended entity data.
+ENTITY_CACHE_ENABLED = os.getenv("ENTITY_CACHE_ENABLED", "True").lower() in ("1", "true", "yes")
+# Lifetime of a cached entity payload, in seconds.
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 6 * 60 * 60))
+# Window in which a repeat open is served without checking the entity's modification time in B-Fabric.
+ENTITY_CACHE_FRESH_SECONDS = int(os.getenv("ENTITY_CACHE_FRESH_SECONDS", 60))
+# Maximum number of cached payloads, the oldest ones are evicted first.
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", 500))
+
+# Load the lanes of an uncached run in the background and show each lane as soon as it is resolved.
+ENTITY_PROGRESSIVE_LOAD = os.getenv("ENTITY_PROGRESSIVE_LOAD", "True").lower() in ("1", "true", "yes")
+
+# Number of B-Fabric call records a request buffers before handing them to the background log flusher.
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", 200))
+# Maximum number of pending log flushes. When full, the caller flushes synchronously instead of dropping records.
+LOG_FLUSH_QUEUE_SIZE = int(os.getenv("LOG_FLUSH_QUEUE_SIZE", 100))
+# Seconds the process waits at shutdown for the pending log flushes.
+LOG_FLUSH_SHUTDOWN_TIMEOUT = int(os.getenv("LOG_FLUSH_SHUTDOWN_TIMEOUT", 30))
+
+# Collect latency histograms and expose them on /metrics in the Prometheus text format.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "False").lower() in ("1", "true", "yes")
+
+# Number of decoded entity payloads each app process keeps in memory.
+PAYLOAD_LRU_SIZE = int(os.getenv("PAYLOAD_LRU_SIZE", 64))
+# zlib-compress the entity payloads stored in Redis.
+PAYLOAD_COMPRESSION = os.getenv("PAYLOAD_COMPRESSION", "True").lower() in ("1", "true", "yes")
+
+# Run the pure UI callbacks (modal, order dropdown, enabling the controls) in the browser.
+CLIENTSIDE_CALLBACKS = os.getenv("CLIENTSIDE_CALLBACKS", "True").lower() in ("1", "true", "yes")
+
+# Seconds between two snapshots of the rq queues published for the queue tab.
+QUEUE_SNAPSHOT_INTERVAL = int(os.getenv("QUEUE_SNAPSHOT_INTERVAL", 5))
+
+# Number of runs resolved at the same time by a batch submission. Each run's lanes are read concurrently as well.
+BATCH_RESOLVE_WORKERS = int(os.getenv("BATCH_RESOLVE_WORKERS", 4))
+
+# Number of demux jobs each sequencer host runs at the same time, e.g. "fgcz-c-042:2,fgcz-c-043:1".
+# Hosts not listed run DEFAULT_HOST_CAPACITY jobs.
+HOST_CAPACITY = os.getenv("HOST_CAPACITY", "")
+DEFAULT_HOST_CAPACITY = int(os.getenv("DEFAULT_HOST_CAPACITY", 1))
+# Maximum number of queued, deferred and running jobs per host. Further submissions are refused.
+HOST_MAX_OUTSTANDING = int(os.getenv("HOST_MAX_OUTSTANDING", 4))
+# Groups of hosts that can read each other's run folders, e.g. "fgcz-c-042,fgcz-c-043;fgcz-c-044,fgcz-c-045".
+# Jobs for a run on one of them may be routed to the least loaded host of its group.
+SHARED_DATA_HOSTS = os.getenv("SHARED_DATA_HOSTS", "")
+# Assumed duration of a demux job in seconds, used to estimate queue wait times.
+AVERAGE_JOB_SECONDS = int(os.getenv("AVERAGE_JOB_SECONDS", 2 * 60 * 60))
+
+# Directory whose free space a pooled worker hands out to jobs as scratch (scripts/worker.py --processes).
+WORKER_SCRATCH_PATH = os.getenv("WORKER_SCRATCH_PATH", "/export/local/data")
+
+# Default of the "Staged Submission" switch: enqueue each Draugr stage as its own job (see utils/stage_utils.py).
+STAGED_SUBMISSION = os.getenv("STAGED_SUBMISSION", "False").lower() in ("1", "true", "yes")
+
+# Directory on the worker hosts where the output of each Draugr job is written, for live log streaming.
+JOB_LOG_DIR = os.getenv("JOB_LOG_DIR", "/export/local/analyses/draugr_ui_logs")
+# Maximum number of lines kept in the Redis stream of a job's log.
+LOG_STREAM_MAXLEN = int(os.getenv("LOG_STREAM_MAXLEN", 5000))
+# Seconds the log stream of a finished job is kept.
+LOG_STREAM_TTL = int(os.getenv("LOG_STREAM_TTL", 24 * 60 * 60))
+# Seconds between two reads of the log files of running jobs on a worker host.
+LOG_TAIL_INTERVAL = float(os.getenv("LOG_TAIL_INTERVAL", 1))
+# Maximum number of log chunks (one per poll, at most LOG_READ_BATCH lines each) the job log panel keeps.
+LOG_VIEW_CHUNKS = int(os.getenv("LOG_VIEW_CHUNKS", 20))
+LOG_READ_BATCH = int(os.getenv("LOG_READ_BATCH", 500))
+
+# Seconds between two scans of the run folders by the readiness indexer of each worker host.
+READINESS_INTERVAL = int(os.getenv("READINESS_INTERVAL", 60))
+# An Illumina run with RTAComplete.txt but no CopyComplete.txt counts as complete once unchanged for this many seconds.
+READINESS_SETTLE_SECONDS = int(os.getenv("READINESS_SETTLE_SECONDS", 15 * 60))
+# Free space the analysis folder needs: at least READINESS_MIN_FREE_GB, and READINESS_SPACE_FACTOR times the run's size.
+READINESS_MIN_FREE_GB = float(os.getenv("READINESS_MIN_FREE_GB", 100))
+READINESS_SPACE_FACTOR = float(os.getenv("READINESS_SPACE_FACTOR", 1.5))
+
+# Number of finished jobs kept in the runtime history, and per feature bucket for the duration predictor.
+RUNTIME_HISTORY_SIZE = int(os.getenv("RUNTIME_HISTORY_SIZE", 5000))
+RUNTIME_BUCKET_SIZE = int(os.getenv("RUNTIME_BUCKET_SIZE", 200))
+# Minimum number of finished jobs in a bucket before its quantiles are used for predictions.
+RUNTIME_MIN_SAMPLES = int(os.getenv("RUNTIME_MIN_SAMPLES", 5))
+
+# Manifest of finished demux outputs kept by each worker host, for reusing them on identical re-triggers.
+REUSE_MANIFEST = os.getenv("REUSE_MANIFEST", "/export/local/analyses/.draugr_ui_manifest.jsonl")
+
+# Default of the "Use Precomputed Sample Sheets" switch: ship the sample sheets built by the UI with the job
+# and run it with --skip-ss-generation (see utils/samplesheet_utils.py).
+PRECOMPUTED_SAMPLESHEETS = os.getenv("PRECOMPUTED_SAMPLESHEETS", "False").lower() in ("1", "true", "yes")
+
+# Run watcher (scripts/run_watcher.py): automatic submission of runs as soon as sequencing completes.
+# Comma-separated instrument IDs (second field of the run folder name) whose runs are submitted; empty for all.
+WATCHER_INSTRUMENTS = os.getenv("WATCHER_INSTRUMENTS", "")
+# Comma-separated advanced Draugr options of automatic submissions, e.g. "--skip-gstore-copy".
+WATCHER_FLAGS = os.getenv("WATCHER_FLAGS", "")
+# Local hours without automatic submissions, as "start-end", e.g. "8-18" or "22-6"; empty for none.
+# Runs completing meanwhile are submitted once the quiet hours are over.
+WATCHER_QUIET_HOURS = os.getenv("WATCHER_QUIET_HOURS", "")
+# Environment of automatic submissions, 'test' or 'production'.
+WATCHER_ENV = os.getenv("WATCHER_ENV", "production")
+# Seconds between two passes of the watcher.
+WATCHER_INTERVAL = int(os.getenv("WATCHER_INTERVAL", 60))
+# Runs whose folder was last modified longer ago than this are left to manual submission.
+WATCHER_MAX_AGE_HOURS = float(os.getenv("WATCHER_MAX_AGE_HOURS", 72))
+# Longest wait, in seconds, before trying again a run that could not be submitted yet (unresolved,
+# without orders or not ready). The wait doubles with every attempt, starting at WATCHER_INTERVAL.
+WATCHER_MAX_BACKOFF = int(os.getenv("WATCHER_MAX_BACKOFF", 60 * 60))
+
+# Trace spans of submissions, from the Submit click through the worker to the Draugr stages (see utils/trace_utils.py).
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "True").lower() in ("1", "true", "yes")
+# JSON-lines file each host appends the spans it records to, e.g. "/export/local/analyses/draugr_ui_logs/traces.jsonl".
+# Empty to keep the spans in Redis only.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Seconds the spans of a trace are kept in Redis.
+TRACE_TTL = int(os.getenv("TRACE_TTL", 7 * 24 * 60 * 60))
@@ -1,5 +1,24 @@
 import os
 
+# Directory Draugr writes its log files to (--logger-rep).
+LOGGER_REP = os.path.join('/srv', 'GT', 'analysis', 'falkonoe', 'dmx_logs', 'prod')
+# Directory holding the run folders on each sequencer host.
+DATA_ROOT = os.path.join('/export', 'local', 'data')
+# Directory the analyses are written to on each sequencer host.
+ANALYSIS_ROOT = os.path.join('/export', 'local', 'analyses')
+# bfabricpy configuration Draugr, and the run watcher, read B-Fabric with.
+BFABRIC_LOGIN_CONFIG = os.path.join('/home', 'illumina', 'bfabric_cred', '.bfabricpy.yml')
+
+def analysis_folder(env):
+    """
+    Returns the folder Draugr writes its analyses to for an environment, e.g. 'test' or 'production'.
+    """
+    return {
+        "test": os.path.join(ANALYSIS_ROOT, 'draugr_ui_test'),
+        "production": ANALYSIS_ROOT
+    }.get(env)
+
+
 def generate_draugr_command(
     server,
     run_folder, 
@@ -36,20 +55,17 @@ def generate_draugr_command(
         "production": "export BFABRICPY_CONFIG_ENV=PRODUCTION && ",
     }.get(env)
 
-    outfolder = {
-        "test": os.path.join('/export', 'local', 'analyses', 'draugr_ui_test'),
-        "production": os.path.join('/export', 'local', 'analyses')
-    }.get(env)
+    outfolder = analysis_folder(env)
 
     run_folder = run_folder.lstrip('/')
 
     draugr_command = (
     f"cd {os.path.join('/usr', 'local', 'ngseq', 'opt', 'draugr')} && uv run draugr.py"
     # f"cd {os.path.join('/export', 'local', 'analyses', 'draugr_exec')} && uv run draugr.py"
-    f" --login-config {os.path.join('/home', 'illumina', 'bfabric_cred', '.bfabricpy.yml')}"
-    f" --run-folder {os.path.join('/export', 'local', 'data', run_folder)}"
+    f" --login-config {BFABRIC_LOGIN_CONFIG}"
+    f" --run-folder {os.path.join(DATA_ROOT, run_folder)}"
     f" --analysis-folder {outfolder}"
-    f" --logger-rep {os.path.join('/srv', 'GT', 'analysis', 'falkonoe', 'dmx_logs', 'prod')}"
+    f" --logger-rep {LOGGER_REP}"
     f" --scripts-destination {os.path.join('/srv', 'GT', 'analysis', 'datasets')}"
     # f" --logger-rep {os.path.join('/home', 'illumina', 'DRAUGR_TESTING', 'DUMMY')}"
     # f" --scripts-destination {os.path.join('/home', 'illumina', 'DRAUGR_TESTING', 'DUMMY')}"
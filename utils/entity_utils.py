@@ -1,122 +1,438 @@
 import json
-from bfabric_web_apps import get_logger, bfabric_interface
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bfabric_web_apps import bfabric_interface
+from utils.config import ENTITY_READ_WORKERS, ENTITY_PROGRESSIVE_LOAD
+from utils.log_utils import get_buffered_logger, PlainLogger
+from utils.payload_utils import publish_entity, resolve_entity
+from utils.metrics_utils import timed_read, observe, ENTITY_LOAD_SECONDS, sample_count_bucket
+from utils.samplesheet_utils import sample_rows, lane_conflicts
+from utils.cache_utils import (
+    get_cached_entity,
+    set_cached_entity,
+    set_partial_entity,
+    set_loaded_entity,
+    acquire_refresh_lock,
+    release_refresh_lock
+)
 
-def extended_entity_data(token_data: dict) -> str:
-    """
-    This function takes in a token from B-Fabric and returns the entity data for the token.
-    Edit this function to change which data is stored in the browser for this entity
+# B-Fabric caps the number of IDs accepted in a single read.
+READ_CHUNK_SIZE = 100
+
+
+def chunked_read(L, wrapper, endpoint: str, ids: list) -> list:
     """
+    Reads all records for the given IDs from one endpoint, READ_CHUNK_SIZE IDs per call.
 
-    entity_class_map = {
-        "Run": "run",
-        "Sample": "sample",
-        "Project": "container",
-        "Order": "container",
-        "Container": "container",
-        "Plate": "plate"
-    }
+    Args:
+        L (Logger): Logger used to record the API calls.
+        wrapper (Bfabric): The B-Fabric wrapper.
+        endpoint (str): The endpoint to read from, e.g. "sample" or "container".
+        ids (list): The IDs to read.
 
-    if not token_data:
-        return None
+    Returns:
+        list: The records of all chunks, in chunk order.
+    """
+    records = []
+    for i in range(0, len(ids), READ_CHUNK_SIZE):
+        records += L.logthis(
+            api_call=timed_read(wrapper.read),
+            endpoint=endpoint,
+            obj={"id": ids[i:i+READ_CHUNK_SIZE]},
+            max_results=None,
+            flush_logs=False
+        )
+    return records
 
-    wrapper = bfabric_interface.get_wrapper()
-    entity_class = token_data.get('entityClass_data')
-    endpoint = entity_class_map.get(entity_class)
-    entity_id = token_data.get('entity_id_data')
-    jobId = token_data.get('jobId', None)
-    username = token_data.get("user_data", "None")
 
-    sample_lanes = {}
+def iter_concurrent_chunked_read(L, wrapper, endpoint: str, id_groups: dict, max_workers: int = ENTITY_READ_WORKERS):
+    """
+    Reads the records of several groups of IDs from one endpoint, issuing the chunked reads of all groups in parallel.
 
-    if wrapper and entity_class and endpoint and entity_id:
+    Args:
+        L (Logger): Logger used to record the API calls.
+        wrapper (Bfabric): The B-Fabric wrapper.
+        endpoint (str): The endpoint to read from, e.g. "sample".
+        id_groups (dict): Maps a group key (e.g. a lane position) to the IDs to read for it.
+        max_workers (int): Maximum number of reads in flight. 1 reads everything sequentially.
 
-        L = get_logger(token_data)
+    Yields:
+        tuple: (group key, records) as soon as all chunks of a group are read, records in chunk order.
+    """
+    if max_workers <= 1:
+        for key, ids in id_groups.items():
+            yield key, chunked_read(L, wrapper, endpoint, ids)
+        return
 
-        entity_data_list = L.logthis(
-            api_call=wrapper.read,
+    def read_chunk(chunk):
+        return L.logthis(
+            api_call=timed_read(wrapper.read),
             endpoint=endpoint,
-            obj={"id": entity_id},
+            obj={"id": chunk},
             max_results=None,
-            flush_logs = False
+            flush_logs=False
         )
 
-        if not entity_data_list:
-            return json.dumps({})
-        entity_data_dict = entity_data_list[0]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            key: [executor.submit(read_chunk, ids[i:i+READ_CHUNK_SIZE]) for i in range(0, len(ids), READ_CHUNK_SIZE)]
+            for key, ids in id_groups.items()
+        }
+        future_keys = {future: key for key, chunk_futures in futures.items() for future in chunk_futures}
+        remaining = {key: len(chunk_futures) for key, chunk_futures in futures.items()}
 
-        rununit_id = entity_data_dict.get("rununit", {}).get("id")
-        if not rununit_id:
-            return json.dumps({})
+        # Groups without IDs are complete right away.
+        for key in [key for key, count in remaining.items() if count == 0]:
+            yield key, []
 
-        #lane_data_list = wrapper.read(endpoint="rununit", obj={"id": str(rununit_id)}, max_results=None)
+        for future in as_completed(future_keys):
+            key = future_keys[future]
+            remaining[key] -= 1
+            if remaining[key] == 0:
+                yield key, [record for chunk_future in futures[key] for record in chunk_future.result()]
 
-        lane_data_list = L.logthis(
-                    api_call=wrapper.read,
-                    endpoint="rununit",
-                    obj={"id": str(rununit_id)},
-                    max_results=None,
-                    flush_logs = False
-        )
 
-        if not lane_data_list:
-            return json.dumps({})
-        lane_data = lane_data_list[0]
+def concurrent_chunked_read(L, wrapper, endpoint: str, id_groups: dict, max_workers: int = ENTITY_READ_WORKERS) -> dict:
+    """
+    Same as iter_concurrent_chunked_read, but waits for all groups.
 
-        #lane_samples = wrapper.read(endpoint="rununitlane", obj={"id": [str(elt["id"]) for elt in lane_data.get("rununitlane", [])]}, max_results=None)
+    Returns:
+        dict: Maps each group key to its records, in the same order as chunked_read would return them.
+    """
+    records = dict(iter_concurrent_chunked_read(L, wrapper, endpoint, id_groups, max_workers=max_workers))
+    return {key: records[key] for key in id_groups}
 
-        lane_samples = L.logthis(
-            api_call=wrapper.read,
-            endpoint="rununitlane",
-            obj={"id": [str(elt["id"]) for elt in lane_data.get("rununitlane", [])]},
-            max_results=None,
-            flush_logs=False
-        )
 
-        for lane in lane_samples:
-            samples = []
-            sample_ids = [str(elt["id"]) for elt in lane.get("sample", [])]
-            if sample_ids:
-                if len(sample_ids) < 100:
-                    
-                    #samples = wrapper.read(endpoint="sample", obj={"id": sample_ids}, max_results=None)
-                    samples = L.logthis(
-                        api_call=wrapper.read,
-                        endpoint="sample",
-                        obj={"id": sample_ids},
-                        max_results=None,
-                        flush_logs=False
-                    )
-
-                else:
-                    for i in range(0, len(sample_ids), 100):
-                        
-                        #samples += wrapper.read(endpoint="sample", obj={"id": sample_ids[i:i+100]}, max_results=None)
-                        samples += L.logthis(
-                            api_call=wrapper.read,
-                            endpoint="sample",
-                            obj={"id": sample_ids[i:i+100]},
-                            max_results=None,
-                            flush_logs=False
-                        )
-
-            container_ids = list(set([sample.get("container", {}).get("id") for sample in samples if sample.get("container")]))
-            sample_lanes[str(lane.get("position"))] = [f"{container_id} {L.logthis(api_call=wrapper.read,endpoint='container', obj={'id': str(container_id)}, max_results=None, flush_logs=True )[0].get('name', '')}"
-                                                       for container_id in container_ids
-        ]
-    else:
-        L.flush_logs()
-        return json.dumps({})
+# Background refreshes and progressive loads run here, off the callback's request thread.
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="entity-refresh")
+
+entity_class_map = {
+    "Run": "run",
+    "Sample": "sample",
+    "Project": "container",
+    "Order": "container",
+    "Container": "container",
+    "Plate": "plate"
+}
+
+
+def _container_ids(samples: list) -> list:
+    return list(set([sample.get("container", {}).get("id") for sample in samples if sample.get("container")]))
+
 
-    json_data = {
+def _walk_lanes(L, wrapper, entity_data_dict: dict, max_workers: int = ENTITY_READ_WORKERS, on_progress=None):
+    """
+    Walks run -> rununit -> rununitlane -> sample -> container and returns the container labels per lane position.
+
+    Args:
+        L (Logger): Logger used to record the API calls.
+        wrapper (Bfabric): The B-Fabric wrapper.
+        entity_data_dict (dict): The run entity as read from B-Fabric.
+        max_workers (int): Maximum number of sample reads in flight.
+        on_progress (callable, optional): Called with copies of the lane dict and of the sample sheet
+            rows each time a lane is resolved. Unresolved lanes are None, and have no rows yet. When given, containers are resolved lane by lane instead of in
+            one batch at the end, so that each lane can be shown as early as possible.
+
+    Returns:
+        tuple: ({lane position: ["<container id> <container name>", ...]}, {lane position: sample sheet rows}),
+            or (None, None) if the run has no lanes. See utils.samplesheet_utils.sample_rows for the rows.
+    """
+    start = time.perf_counter()
+
+    rununit_id = entity_data_dict.get("rununit", {}).get("id")
+    if not rununit_id:
+        return None, None
+
+    #lane_data_list = wrapper.read(endpoint="rununit", obj={"id": str(rununit_id)}, max_results=None)
+
+    lane_data_list = L.logthis(
+                api_call=timed_read(wrapper.read),
+                endpoint="rununit",
+                obj={"id": str(rununit_id)},
+                max_results=None,
+                flush_logs = False
+    )
+
+    if not lane_data_list:
+        return None, None
+    lane_data = lane_data_list[0]
+
+    #lane_samples = wrapper.read(endpoint="rununitlane", obj={"id": [str(elt["id"]) for elt in lane_data.get("rununitlane", [])]}, max_results=None)
+
+    lane_samples = L.logthis(
+        api_call=timed_read(wrapper.read),
+        endpoint="rununitlane",
+        obj={"id": [str(elt["id"]) for elt in lane_data.get("rununitlane", [])]},
+        max_results=None,
+        flush_logs=False
+    )
+
+    lane_sample_ids = {
+        str(lane.get("position")): [str(elt["id"]) for elt in lane.get("sample", [])]
+        for lane in lane_samples
+    }
+
+    sample_lanes, lane_rows = _resolve_lanes(L, wrapper, lane_sample_ids, max_workers=max_workers, on_progress=on_progress)
+
+    observe(
+        ENTITY_LOAD_SECONDS,
+        time.perf_counter() - start,
+        lanes=len(lane_sample_ids),
+        samples=sample_count_bucket(sum(len(ids) for ids in lane_sample_ids.values()))
+    )
+    return sample_lanes, lane_rows
+
+
+def _resolve_lanes(L, wrapper, lane_sample_ids: dict, max_workers: int = ENTITY_READ_WORKERS, on_progress=None) -> tuple:
+    if on_progress is not None:
+        sample_lanes = {position: None for position in lane_sample_ids}
+        lane_rows = {}
+        on_progress(dict(sample_lanes), dict(lane_rows))
+
+        container_names = {}
+        for position, samples in iter_concurrent_chunked_read(L, wrapper, "sample", lane_sample_ids, max_workers=max_workers):
+            lane_rows[position] = sample_rows(samples)
+            ids = _container_ids(samples)
+            unseen = [str(container_id) for container_id in ids if str(container_id) not in container_names]
+            container_names.update({str(container.get("id")): container.get("name", "") for container in chunked_read(L, wrapper, "container", unseen)})
+            sample_lanes[position] = [f"{container_id} {container_names.get(str(container_id), '')}" for container_id in ids]
+            on_progress(dict(sample_lanes), dict(lane_rows))
+        return sample_lanes, lane_rows
+
+    samples_per_lane = concurrent_chunked_read(L, wrapper, "sample", lane_sample_ids, max_workers=max_workers)
+    lane_container_ids = {position: _container_ids(samples) for position, samples in samples_per_lane.items()}
+
+    # Every container is resolved exactly once, no matter how many lanes it sits on.
+    container_ids = list(set([container_id for ids in lane_container_ids.values() for container_id in ids]))
+    containers = chunked_read(L, wrapper, "container", [str(container_id) for container_id in container_ids])
+    container_names = {str(container.get("id")): container.get("name", "") for container in containers}
+
+    sample_lanes = {
+        position: [f"{container_id} {container_names.get(str(container_id), '')}" for container_id in ids]
+        for position, ids in lane_container_ids.items()
+    }
+    return sample_lanes, {position: sample_rows(samples) for position, samples in samples_per_lane.items()}
+
+
+def _entity_payload(entity_data_dict: dict, sample_lanes: dict, lane_rows: dict = None) -> dict:
+    lane_rows = lane_rows or {}
+    return {
         "name": entity_data_dict.get("name", ""),
         "createdby": entity_data_dict.get("createdby", ""),
         "created": entity_data_dict.get("created", ""),
         "modified": entity_data_dict.get("modified", ""),
         "lanes": sample_lanes,
+        "samples": {position: len(rows) for position, rows in lane_rows.items()},
+        "samplesheet": lane_rows,
+        "samplesheet_conflicts": lane_conflicts(lane_rows, entity_data_dict.get("datafolder")),
         "containers": [container["id"] for container in entity_data_dict.get("container", []) if container.get("classname") == "order"],
         "server": entity_data_dict.get("serverlocation", ""),
         "datafolder": entity_data_dict.get("datafolder", "")
     }
 
+
+def _read_entity(token_data: dict):
+    """
+    Reads the token's entity from B-Fabric.
+
+    Returns:
+        tuple: (logger, wrapper, entity dict), or None if the token doesn't point to a readable entity.
+    """
+    wrapper = bfabric_interface.get_wrapper()
+    entity_class = token_data.get('entityClass_data')
+    endpoint = entity_class_map.get(entity_class)
+    entity_id = token_data.get('entity_id_data')
+
+    if not (wrapper and entity_class and endpoint and entity_id):
+        return None
+
+    L = get_buffered_logger(token_data)
+
+    entity_data_list = L.logthis(
+        api_call=timed_read(wrapper.read),
+        endpoint=endpoint,
+        obj={"id": entity_id},
+        max_results=None,
+        flush_logs = False
+    )
+
+    if not entity_data_list:
+        return None
+    return L, wrapper, entity_data_list[0]
+
+
+def extended_entity_data(token_data: dict, max_workers: int = ENTITY_READ_WORKERS, use_cache: bool = True, on_progress=None) -> str:
+    """
+    This function takes in a token from B-Fabric and returns the entity data for the token.
+    Edit this function to change which data is stored in the browser for this entity
+
+    The sample reads of all lanes are sent concurrently, with at most max_workers reads in flight.
+    Results are cached in Redis per entity modification time (see utils.cache_utils), so an
+    unmodified entity costs a single read. With use_cache=False the full walk is always done,
+    and its result replaces the cached one. Use cached_entity_data to also skip that read.
+    on_progress is passed on to _walk_lanes.
+    """
+
+    if not token_data:
+        return None
+
+    entity = _read_entity(token_data)
+    if not entity:
+        return json.dumps({})
+    L, wrapper, entity_data_dict = entity
+
+    cached = get_cached_entity(*_entity_cache_key(token_data), entity_data_dict.get("modified", "")) if use_cache else None
+    if cached:
+        L.flush_logs()
+        return cached
+
+    return _build_entity_payload(token_data, L, wrapper, entity_data_dict, max_workers=max_workers, on_progress=on_progress)
+
+
+def _build_entity_payload(token_data: dict, L, wrapper, entity_data_dict: dict, max_workers: int = ENTITY_READ_WORKERS, on_progress=None) -> str:
+    start = time.time()
+    sample_lanes, lane_rows = _walk_lanes(L, wrapper, entity_data_dict, max_workers=max_workers, on_progress=on_progress)
+    if sample_lanes is None:
+        return json.dumps({})
+
+    json_data = _entity_payload(entity_data_dict, sample_lanes, lane_rows)
+    # When and how long the lane walk took, for the trace of later submissions (see utils.trace_utils).
+    json_data["walk"] = {"start": start, "end": time.time()}
+
+    payload = json.dumps(json_data)
+    set_cached_entity(*_entity_cache_key(token_data), json_data["modified"], payload)
+
     L.flush_logs()
-    return json.dumps(json_data)
\ No newline at end of file
+    return payload
+
+
+def run_folder_entity(wrapper, run_folder: str, server: str = None, L=None) -> dict:
+    """
+    Reads the run stored in a run folder, with its lanes, without a session token. Used by
+    the run watcher (scripts/run_watcher.py), which reads B-Fabric with its own wrapper.
+
+    Args:
+        wrapper (Bfabric): The B-Fabric wrapper.
+        run_folder (str): The run's datafolder.
+        server (str, optional): Only consider runs stored on this server location.
+        L (Logger, optional): Logger used to record the API calls. By default they aren't recorded.
+
+    Returns:
+        dict: The extended entity data of the run, or None if no run (with lanes) has this datafolder.
+    """
+    L = L or PlainLogger()
+    runs = L.logthis(
+        api_call=timed_read(wrapper.read),
+        endpoint="run",
+        obj={"datafolder": run_folder},
+        max_results=None,
+        flush_logs=False
+    )
+    runs = [run for run in runs or [] if not server or run.get("serverlocation") == server]
+    if not runs:
+        return None
+
+    entity_data_dict = runs[0]
+    sample_lanes, lane_rows = _walk_lanes(L, wrapper, entity_data_dict)
+    if sample_lanes is None:
+        return None
+    return _entity_payload(entity_data_dict, sample_lanes, lane_rows)
+
+
+def _entity_cache_key(token_data: dict) -> tuple:
+    return (token_data.get("environment", "None"), token_data.get("entityClass_data"), token_data.get("entity_id_data"))
+
+
+def _run_refresh(token_data: dict):
+    try:
+        extended_entity_data(token_data, use_cache=False)
+    except Exception as e:
+        print(f"Background refresh of {_entity_cache_key(token_data)} failed: {e}")
+    finally:
+        release_refresh_lock(*_entity_cache_key(token_data))
+
+
+def _run_progressive_load(token_data: dict, L, wrapper, entity_data_dict: dict):
+    key = _entity_cache_key(token_data)
+
+    def publish(sample_lanes, lane_rows):
+        set_partial_entity(*key, json.dumps(_entity_payload(entity_data_dict, sample_lanes, lane_rows)))
+
+    # The outcome is published before the lock is released, so pollers seeing the load end find it.
+    try:
+        payload = _build_entity_payload(token_data, L, wrapper, entity_data_dict, on_progress=publish)
+    except Exception as e:
+        print(f"Progressive load of {key} failed: {e}")
+        payload = json.dumps({**_entity_payload(entity_data_dict, {}), "error": str(e)})
+    try:
+        set_loaded_entity(*key, payload)
+    finally:
+        release_refresh_lock(*key)
+
+
+def refresh_extended_entity_data(token_data: dict):
+    """
+    Re-reads the entity from B-Fabric and stores the result in the cache, unless another
+    refresh of the same entity is already running.
+    """
+    if acquire_refresh_lock(*_entity_cache_key(token_data)):
+        _run_refresh(token_data)
+
+
+def cached_entity_data(token_data: dict) -> tuple:
+    """
+    Stale-while-revalidate variant of extended_entity_data.
+
+    A cached payload that is past its freshness window is returned right away, and a
+    background refresh is started that updates the cache once B-Fabric has been re-read.
+
+    Without any cached payload and with ENTITY_PROGRESSIVE_LOAD on, only the entity itself
+    is read before returning (enough for the order dropdown). Its lanes are loaded in the
+    background and published lane by lane, see get_partial_entity.
+
+    Returns:
+        tuple: (payload, refreshing) where refreshing tells whether a background load was started.
+    """
+    if token_data:
+        key = _entity_cache_key(token_data)
+        fresh = get_cached_entity(*key)
+        if fresh:
+            return fresh, False
+        stale = get_cached_entity(*key, stale=True)
+        if stale:
+            # The lock is taken before submitting, so pollers see the refresh as running
+            # even while it waits for a free executor thread.
+            if acquire_refresh_lock(*key):
+                _refresh_executor.submit(_run_refresh, token_data)
+            return stale, True
+
+        if ENTITY_PROGRESSIVE_LOAD:
+            entity = _read_entity(token_data)
+            if not entity:
+                return json.dumps({}), False
+            L, wrapper, entity_data_dict = entity
+
+            cached = get_cached_entity(*key, entity_data_dict.get("modified", ""))
+            if cached:
+                L.flush_logs()
+                return cached, False
+
+            if acquire_refresh_lock(*key):
+                _refresh_executor.submit(_run_progressive_load, token_data, L, wrapper, entity_data_dict)
+            return json.dumps(_entity_payload(entity_data_dict, {})), True
+
+    return extended_entity_data(token_data), False
+
+
+def load_entity(handle: dict, token_data: dict = None):
+    """
+    Returns the decoded extended entity data behind a handle from the "extended-entity-data" store.
+    If the payload expired server side and token_data is given, it is loaded again.
+
+    Returns:
+        dict: The extended entity data, or None.
+    """
+    entity = resolve_entity(handle)
+    if entity is None and handle and token_data:
+        entity = resolve_entity(publish_entity(cached_entity_data(token_data)[0]))
+    return entity
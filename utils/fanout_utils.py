@@ -0,0 +1,142 @@
+"""
+Per-order fan-out of Draugr re-demultiplexing.
+
+Rather than reprocessing all selected orders in one Draugr process, a fan-out submission
+enqueues one job per order, or per group of orders sharing lanes, so they run in parallel on
+the worker pool (and on every host able to read the run, see utils.routing_utils). A final
+aggregation job waits for all of them, whether they succeed or fail, and reports their
+combined status. Group jobs fail when their Draugr command does (see utils.job_utils), so
+the status of each job is the status of its orders.
+"""
+
+from rq.job import Job, JobStatus, Dependency
+from rq.exceptions import NoSuchJobError
+import bfabric_web_apps
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import generate_draugr_command
+from utils.routing_utils import route, AdmissionRefused
+from utils.worker_pool import RESOURCE_PROFILES
+from utils.log_stream_utils import logged_command
+from utils.callback_utils import tracked
+from utils.job_utils import run_draugr_job
+
+FANOUT_MODES = ("none", "order", "lane")
+
+
+def order_groups(orders: list, lanes: dict, mode: str) -> list:
+    """
+    Splits the selected orders into the groups processed by one job each.
+
+    Args:
+        orders (list): Selected order IDs.
+        lanes (dict): {lane position: ["<container id> <container name>", ...]} as in the entity payload.
+        mode (str): "order" for one group per order, "lane" for one group per set of lanes
+            shared by orders, anything else for a single group.
+
+    Returns:
+        list: Lists of order IDs, in the order they were selected.
+    """
+    orders = list(orders or [])
+    if mode == "order":
+        return [[order] for order in orders]
+    if mode != "lane":
+        return [orders]
+
+    # Orders sharing a lane must be demultiplexed together, so merge overlapping lane groups.
+    groups = [[order] for order in orders]
+    for labels in (lanes or {}).values():
+        on_lane = {label.split(" ", 1)[0] for label in labels or []}
+        sharing = [group for group in groups if any(str(order) in on_lane for order in group)]
+        if len(sharing) > 1:
+            merged = [order for group in sharing for order in group]
+            groups = [group for group in groups if not any(group is other for other in sharing)] + [merged]
+    position = {str(order): index for index, order in enumerate(orders)}
+    groups = [sorted(group, key=lambda order: position[str(order)]) for group in groups]
+    return sorted(groups, key=lambda group: position[str(group[0])])
+
+
+def enqueue_fanout(server: str, host: str, groups: list, arguments: dict, command_options: dict, features: list = None,
+                   meta: list = None, trace_id: str = None) -> Job:
+    """
+    Enqueues one Draugr job per order group and the aggregation job depending on all of them.
+
+    The first group goes to host, which already passed admission; the others are routed
+    across the eligible hosts like separate submissions. The fan-out is admitted as a whole:
+    if any group is refused, nothing is enqueued.
+
+    Args:
+        server (str): The run's serverlocation.
+        host (str): The host chosen for the submission.
+        groups (list): Order groups, see order_groups.
+        arguments (dict): Keyword arguments of run_main_job, without bash_commands.
+        command_options (dict): Arguments of generate_draugr_command, without order_list. Must include run_folder.
+        features (list, optional): Runtime features of each group's job, see utils.runtime_utils.job_features.
+        meta (list, optional): Additional meta of each group's job, e.g. utils.reuse_utils.reuse_meta.
+        trace_id (str, optional): The trace of the submission, see utils.trace_utils.
+
+    Returns:
+        Job: The aggregation job, deferred until every group job has finished.
+
+    Raises:
+        AdmissionRefused: If no eligible host admits one of the groups.
+    """
+    targets = [host]
+    pending = {host: 1}
+    for _ in groups[1:]:
+        decision = route(server, pending=pending)
+        if not decision["admitted"]:
+            raise AdmissionRefused(f"Fan-out of {len(groups)} jobs: {decision['reason']}")
+        targets.append(decision["host"])
+        pending[decision["host"]] = pending.get(decision["host"], 0) + 1
+
+    jobs = []
+    for index, (group, target) in enumerate(zip(groups, targets)):
+        job_id, command, log_meta = logged_command(
+            generate_draugr_command(order_list=group, **command_options), command_options["run_folder"], trace_id
+        )
+        jobs.append(bfabric_web_apps.q(target).enqueue(
+            run_draugr_job,
+            kwargs={**arguments, "bash_commands": [command]},
+            job_id=job_id,
+            description=f"{command_options['run_folder']} [orders {','.join(str(order) for order in group)}]",
+            **tracked(
+                {
+                    **log_meta,
+                    "resources": RESOURCE_PROFILES["demux"],
+                    "orders": [str(order) for order in group],
+                    **(meta[index] if meta else {})
+                },
+                {**features[index], "host": target} if features else None
+            )
+        ))
+
+    return bfabric_web_apps.q(f"{host}-light").enqueue(
+        aggregate_fanout,
+        args=([job.id for job in jobs],),
+        depends_on=Dependency(jobs=jobs, allow_failure=True),
+        description=f"{command_options['run_folder']} [fan-out of {len(jobs)} jobs]",
+        meta={"resources": RESOURCE_PROFILES["light"], "fanout": [job.id for job in jobs], "trace_id": trace_id}
+    )
+
+
+def aggregate_fanout(job_ids: list) -> dict:
+    """
+    Runs on a worker once all jobs of a fan-out have finished, and collects their status.
+    Fails if any of them did, so the combined status shows in the queue tab.
+
+    Returns:
+        dict: {job ID: {"orders": [...], "status": "finished" | "failed" | ...}}
+    """
+    summary = {}
+    for job_id in job_ids:
+        try:
+            job = Job.fetch(job_id, connection=redis_conn)
+            summary[job_id] = {"orders": job.meta.get("orders", []), "status": JobStatus(job.get_status()).value}
+        except NoSuchJobError:
+            summary[job_id] = {"orders": [], "status": "missing"}
+
+    failed = [entry["orders"] for entry in summary.values() if entry["status"] != JobStatus.FINISHED.value]
+    print(f"Fan-out of {len(job_ids)} jobs done, {len(failed)} not finished: {failed}")
+    if failed:
+        raise RuntimeError(f"Demultiplexing failed for orders {failed}: {summary}")
+    return summary
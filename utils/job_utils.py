@@ -0,0 +1,86 @@
+"""
+rq job functions running Draugr commands.
+
+bfabric_web_apps.run_main_job logs a failing bash command and carries on, so the rq job
+finishes as successful whatever Draugr did. Draugr jobs are therefore enqueued with
+run_draugr_job, which runs them through run_main_job but fails the job when one of its
+commands exits with a nonzero status. That way rq only runs the dependents of a job (later
+stages, the aggregation of a fan-out) and the success callbacks of utils.callback_utils
+(runtime history, reuse manifest) when the commands really succeeded.
+"""
+
+import os
+import shlex
+import tempfile
+import subprocess
+import bfabric_web_apps
+
+
+class CommandFailed(Exception):
+    """
+    Raised by the job functions when one of a job's commands exits with a nonzero status.
+    """
+
+
+def status_commands(bash_commands: list, folder: str) -> tuple:
+    """
+    Wraps commands so each writes its exit status to a file in folder, and only runs if
+    the one before it succeeded.
+
+    Returns:
+        tuple: (wrapped commands, status file of each command)
+    """
+    paths = [os.path.join(folder, f"{index}.status") for index in range(len(bash_commands))]
+    wrapped = []
+    for index, (command, path) in enumerate(zip(bash_commands, paths)):
+        # run_main_job runs the commands with /bin/sh.
+        run = f"( {command} ); echo $? > {shlex.quote(path)}"
+        if index:
+            run = f"if [ \"$(cat {shlex.quote(paths[index - 1])} 2>/dev/null)\" = 0 ]; then {run}; fi"
+        wrapped.append(run)
+    return wrapped, paths
+
+
+def check_statuses(bash_commands: list, paths: list):
+    """
+    Raises CommandFailed for the first command whose status file is missing or not 0.
+    """
+    for index, path in enumerate(paths):
+        try:
+            with open(path) as f:
+                status = f.read().strip()
+        except OSError:
+            status = None
+        if status != "0":
+            raise CommandFailed(
+                f"Command {index + 1} of {len(bash_commands)} "
+                + (f"exited with status {status}" if status else "did not run")
+            )
+
+
+def run_draugr_job(bash_commands: list, **arguments):
+    """
+    rq job function running bfabric_web_apps.run_main_job, failing if any of the bash
+    commands failed.
+
+    Args:
+        bash_commands (list): The commands, run one after the other. A command only runs
+            if the one before it succeeded.
+        **arguments: The other keyword arguments of run_main_job.
+    """
+    with tempfile.TemporaryDirectory(prefix="draugr-ui-") as folder:
+        wrapped, paths = status_commands(bash_commands, folder)
+        bfabric_web_apps.run_main_job(bash_commands=wrapped, **arguments)
+        check_statuses(bash_commands, paths)
+
+
+def run_commands(bash_commands: list):
+    """
+    rq job function running bash commands one after the other, failing on the first failing one.
+
+    Automatic submissions have no user session, and thus no token to call run_main_job with.
+    """
+    for index, command in enumerate(bash_commands):
+        status = subprocess.run(command, shell=True, executable="/bin/bash").returncode
+        if status:
+            raise CommandFailed(f"Command {index + 1} of {len(bash_commands)} exited with status {status}")
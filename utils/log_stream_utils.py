@@ -0,0 +1,235 @@
+"""
+Live streaming of Draugr job logs.
+
+Commands are wrapped so their stdout and stderr are also appended to a log file on the
+worker host (see logged_command). A single tailer per worker host follows the log files of
+the jobs running there, the command output and Draugr's own log file, reading from the last
+offset, and appends new lines to a capped Redis stream per job. When the job finishes, the
+tailer appends an end marker and lets the stream expire.
+
+Viewers read the stream from their last entry ID (see read_log), so each poll only returns
+new lines and any number of viewers costs one file reader. The tailer also records the
+trace spans of the jobs it follows, see utils.trace_utils.
+"""
+
+import os
+import glob
+import shlex
+import time
+import uuid
+from redis.exceptions import RedisError
+from rq.job import Job, JobStatus
+from rq.registry import StartedJobRegistry
+from rq.exceptions import NoSuchJobError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import LOGGER_REP
+from utils.submission_utils import ACTIVE_STATUSES
+from utils.trace_utils import new_trace_id, traced_command, parse_marker, record_span
+from utils.config import JOB_LOG_DIR, LOG_STREAM_MAXLEN, LOG_STREAM_TTL, LOG_TAIL_INTERVAL, LOG_READ_BATCH
+
+KEY_PREFIX = "draugr-ui:log"
+
+# Maximum number of bytes read from one log file per poll.
+MAX_READ_BYTES = 1024 * 1024
+
+
+def stream_key(job_id: str) -> str:
+    return f"{KEY_PREFIX}:{job_id}"
+
+
+def logged_command(command: str, run_folder: str, trace_id: str = None) -> tuple:
+    """
+    Prepares a command for live log streaming and tracing.
+
+    Args:
+        command (str): The command to run.
+        run_folder (str): The run folder, used to find Draugr's log file.
+        trace_id (str, optional): The trace of the submission, see utils.trace_utils. A new one by default.
+
+    Returns:
+        tuple: (job ID to enqueue the job with, wrapped command, job meta naming its log files and trace)
+    """
+    job_id = str(uuid.uuid4())
+    trace_id = trace_id or new_trace_id()
+    log_path = os.path.join(JOB_LOG_DIR, f"{job_id}.log")
+    # run_main_job runs commands with /bin/sh, which has no pipefail; without it tee would hide failures.
+    wrapped = (
+        f"mkdir -p {shlex.quote(JOB_LOG_DIR)} && "
+        f"bash -o pipefail -c {shlex.quote(f'( {traced_command(command, trace_id)} ) 2>&1 | tee -a {shlex.quote(log_path)}')}"
+    )
+    meta = {
+        "log_files": {
+            "output": log_path,
+            "draugr": os.path.join(LOGGER_REP, f"*{os.path.basename(run_folder.strip('/'))}*"),
+        },
+        "trace_id": trace_id,
+    }
+    return job_id, wrapped, meta
+
+
+def log_job_options(job: Job) -> list:
+    """
+    Returns dropdown options for the jobs writing logs for a submission: the stages of a
+    staged submission, the order jobs of a fan-out, or the job itself.
+    """
+    job_ids = job.meta.get("fanout") or job.meta.get("stages") or [job.id]
+    options = []
+    for log_job in Job.fetch_many(job_ids, connection=redis_conn):
+        if log_job is None:
+            continue
+        if log_job.meta.get("stage"):
+            label = log_job.meta["stage"]
+        elif log_job.meta.get("orders"):
+            label = "orders " + ",".join(log_job.meta["orders"])
+        else:
+            label = "Draugr job"
+        options.append({"label": f"{label} ({log_job.id})", "value": log_job.id})
+    return options
+
+
+def read_log(job_id: str, last_id: str = None, count: int = LOG_READ_BATCH) -> tuple:
+    """
+    Reads the log lines of a job appended after last_id.
+
+    Returns:
+        tuple: (lines, ID of the last entry read, finished) where finished tells whether
+               the job is done and all of its log was read.
+    """
+    try:
+        response = redis_conn.xread({stream_key(job_id): last_id or "0-0"}, count=count)
+    except RedisError as e:
+        print(f"Error reading log stream of job {job_id}: {e}")
+        return [], last_id, False
+
+    lines = []
+    for _, entries in response:
+        for entry_id, fields in entries:
+            last_id = entry_id.decode("utf-8")
+            if b"eof" in fields:
+                lines.append(f"--- job {fields[b'eof'].decode('utf-8')} ---")
+                return lines, last_id, True
+            prefix = "[draugr] " if fields.get(b"file") == b"draugr" else ""
+            lines.append(prefix + fields.get(b"line", b"").decode("utf-8", "replace"))
+
+    if not lines and last_id is None:
+        # Nothing was streamed: jobs submitted without streaming, or already done, won't produce any.
+        try:
+            job = Job.fetch(job_id, connection=redis_conn)
+        except NoSuchJobError:
+            return ["--- job not found ---"], last_id, True
+        if job.get_status() not in ACTIVE_STATUSES:
+            return ["--- no log was streamed for this job ---"], last_id, True
+    return lines, last_id, False
+
+
+class _JobTail:
+    """
+    Follows the log files of one running job.
+    """
+
+    def __init__(self, job: Job):
+        self.key = stream_key(job.id)
+        self.files = dict(job.meta["log_files"])
+        started = job.started_at or job.enqueued_at
+        self.since = started.timestamp() if started else time.time()
+        self.paths = {}
+        self.offsets = {}
+        self.remainders = {}
+
+        # Spans of the job's trace, see utils.trace_utils.
+        self.job_id = job.id
+        self.trace_id = job.meta.get("trace_id")
+        self.label = job.meta.get("stage") or "command"
+        self.opened = {}
+        if job.enqueued_at and job.started_at:
+            record_span(self.trace_id, "queue wait", job.enqueued_at.timestamp(), job.started_at.timestamp(), job.id, queue=job.origin)
+
+    def _trace(self, line: bytes):
+        marker = parse_marker(line)
+        if not marker:
+            return
+        event, name, at, rest = marker
+        if name == "command":
+            name = self.label
+            if event == "start":
+                # From the worker picking the job up until the command actually runs.
+                record_span(self.trace_id, "job startup", self.since, at, self.job_id)
+        if event == "start":
+            self.opened[name] = at
+        elif event == "end" and name in self.opened:
+            record_span(self.trace_id, name, self.opened.pop(name), at, self.job_id, status=rest[0] if rest else None)
+
+    def _resolve(self, name: str):
+        pattern = self.files[name]
+        if not glob.has_magic(pattern):
+            return pattern if os.path.exists(pattern) else None
+        # Draugr's log file name is not known up front: take the newest match written since the job started.
+        candidates = [path for path in glob.glob(pattern) if os.path.getmtime(path) >= self.since - 60]
+        return max(candidates, key=os.path.getmtime) if candidates else None
+
+    def poll(self) -> int:
+        read = 0
+        pipe = redis_conn.pipeline(transaction=False)
+        for name in self.files:
+            path = self.paths.get(name) or self._resolve(name)
+            if not path:
+                continue
+            self.paths[name] = path
+            with open(path, "rb") as f:
+                f.seek(self.offsets.get(name, 0))
+                data = f.read(MAX_READ_BYTES)
+            self.offsets[name] = self.offsets.get(name, 0) + len(data)
+            read += len(data)
+
+            *lines, self.remainders[name] = (self.remainders.get(name, b"") + data).split(b"\n")
+            for line in lines:
+                pipe.xadd(self.key, {"file": name, "line": line}, maxlen=LOG_STREAM_MAXLEN, approximate=True)
+                self._trace(line)
+        pipe.execute()
+        return read
+
+    def close(self, status: str):
+        pipe = redis_conn.pipeline(transaction=False)
+        for name, remainder in self.remainders.items():
+            if remainder:
+                pipe.xadd(self.key, {"file": name, "line": remainder}, maxlen=LOG_STREAM_MAXLEN, approximate=True)
+        pipe.xadd(self.key, {"eof": status}, maxlen=LOG_STREAM_MAXLEN, approximate=True)
+        pipe.expire(self.key, LOG_STREAM_TTL)
+        pipe.execute()
+
+
+def run_log_tailer(queue_names: list, interval: float = LOG_TAIL_INTERVAL):
+    """
+    Follows the logs of the jobs running on the given queues and publishes them to Redis,
+    until the process is stopped. Run once per worker host, see scripts/worker.py.
+    """
+    tails = {}
+    while True:
+        try:
+            running = set()
+            for name in queue_names:
+                running.update(StartedJobRegistry(name, connection=redis_conn).get_job_ids())
+
+            for job_id in running - set(tails):
+                try:
+                    job = Job.fetch(job_id, connection=redis_conn)
+                except NoSuchJobError:
+                    continue
+                if "log_files" in job.meta:
+                    tails[job_id] = _JobTail(job)
+
+            for job_id, tail in list(tails.items()):
+                tail.poll()
+                if job_id not in running:
+                    # The job is done: publish what is left and mark the end of its log.
+                    try:
+                        status = JobStatus(Job.fetch(job_id, connection=redis_conn).get_status()).value
+                    except NoSuchJobError:
+                        status = "gone"
+                    while tail.poll():
+                        pass
+                    tail.close(status)
+                    del tails[job_id]
+        except (RedisError, OSError) as e:
+            print(f"Log tailer error: {e}")
+        time.sleep(interval)
@@ -0,0 +1,172 @@
+"""
+Buffered, asynchronous logging of B-Fabric calls.
+
+The bfabric_web_apps Logger writes its records to B-Fabric synchronously whenever a call is
+logged with flush_logs=True. BufferedLogger keeps every record in memory instead and hands
+them to a background thread once per request (or whenever LOG_BUFFER_SIZE records have
+piled up), so that writing the logs never sits on the critical path of a page load.
+"""
+
+import atexit
+import copy
+import queue
+import threading
+from bfabric_web_apps import get_logger
+from utils.config import LOG_BUFFER_SIZE, LOG_FLUSH_QUEUE_SIZE, LOG_FLUSH_SHUTDOWN_TIMEOUT
+
+
+class _LogFlusher:
+    """
+    Single background thread writing buffered log records to B-Fabric.
+    """
+
+    def __init__(self, max_pending: int):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="bfabric-log-flusher", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _flush(logger, entries):
+        # Flush a shallow copy so the request's logger can keep collecting records meanwhile.
+        snapshot = copy.copy(logger)
+        snapshot.logs = entries
+        snapshot.flush_logs()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._flush(*item)
+            except Exception as e:
+                print(f"Failed to flush buffered logs: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, logger, entries: list):
+        """
+        Queues records for flushing. If the queue is full the records are flushed by the
+        caller, so no record is ever dropped.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((logger, entries))
+        except queue.Full:
+            self._flush(logger, entries)
+
+    def shutdown(self, timeout: float = LOG_FLUSH_SHUTDOWN_TIMEOUT):
+        """
+        Waits for the pending flushes. Whatever the thread didn't get to within the timeout
+        is flushed by the calling thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+                self._thread.join(timeout)
+            except queue.Full:
+                pass
+
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                try:
+                    self._flush(*item)
+                except Exception as e:
+                    print(f"Failed to flush buffered logs at shutdown: {e}")
+
+
+_flusher = _LogFlusher(LOG_FLUSH_QUEUE_SIZE)
+atexit.register(_flusher.shutdown)
+
+
+class BufferedLogger:
+    """
+    Drop-in replacement for the bfabric_web_apps Logger, as far as logthis, log_operation
+    and flush_logs go. flush_logs=True on individual calls is ignored: records are only
+    written when flush_logs() is called or the buffer is full, and always from the
+    background flusher.
+    """
+
+    def __init__(self, logger, max_buffer: int = LOG_BUFFER_SIZE):
+        """
+        Args:
+            logger (Logger): The bfabric_web_apps Logger to buffer for.
+            max_buffer (int): Number of records after which the buffer is handed off early.
+        """
+        self.logger = logger
+        self.max_buffer = max_buffer
+        self._entries = []
+        self._lock = threading.Lock()
+
+    @property
+    def logs(self):
+        with self._lock:
+            return list(self._entries)
+
+    def _record(self, method: str, *args, **kwargs):
+        # The wrapped Logger appends to its own logs list, which isn't safe across the threads
+        # reading lanes concurrently. Each call records into a copy of it with a list of its
+        # own, whose records are then moved to this buffer under the lock.
+        recorder = copy.copy(self.logger)
+        recorder.logs = []
+        result = getattr(recorder, method)(*args, flush_logs=False, **kwargs)
+        with self._lock:
+            self._entries.extend(recorder.logs)
+        self._hand_off()
+        return result
+
+    def _hand_off(self, force: bool = False):
+        with self._lock:
+            if not force and len(self._entries) < self.max_buffer:
+                return
+            entries, self._entries = self._entries, []
+        if entries:
+            _flusher.submit(self.logger, entries)
+
+    def logthis(self, api_call: callable, *args, params=None, flush_logs: bool = True, **kwargs) -> any:
+        return self._record("logthis", api_call, *args, params=params, **kwargs)
+
+    def log_operation(self, operation: str, message: str, params=None, flush_logs: bool = True):
+        self._record("log_operation", operation, message, params)
+
+    def flush_logs(self):
+        """
+        Hands all buffered records to the background flusher.
+        """
+        self._hand_off(force=True)
+
+
+def get_buffered_logger(token_data: dict) -> BufferedLogger:
+    """
+    Same as bfabric_web_apps.get_logger, but buffered (see BufferedLogger).
+    """
+    return BufferedLogger(get_logger(token_data))
+
+
+class PlainLogger:
+    """
+    Stand-in for the Logger in processes without a B-Fabric session to log to, such as the
+    run watcher (scripts/run_watcher.py). API calls are made without being recorded, and
+    operations are printed.
+    """
+
+    logs = []
+
+    def logthis(self, api_call: callable, *args, params=None, flush_logs: bool = True, **kwargs) -> any:
+        return api_call(*args, **kwargs)
+
+    def log_operation(self, operation: str, message: str, params=None, flush_logs: bool = True):
+        print(f"{operation}: {message}")
+
+    def flush_logs(self):
+        pass
@@ -0,0 +1,209 @@
+"""
+Minimal in-process metrics, exposed on /metrics in the Prometheus text format.
+
+Covered paths:
+  - B-Fabric reads issued while loading entities (latency and result size, per endpoint).
+  - The full lane walk of a run (latency, per lane count and sample count bucket).
+  - Dash callbacks (latency and errors, per callback).
+  - Job enqueues (latency, per queue).
+  - The shared entity cache (hits, stale hits, misses, evictions, invalidations and entries).
+
+With METRICS_ENABLED off, the decorators and helpers return the wrapped functions unchanged,
+so instrumentation costs nothing. Metrics are kept per process; when the app runs with
+several worker processes, each process reports its own values. The entity cache counters
+are kept in Redis (see utils.cache_utils) and cover all processes.
+"""
+
+import time
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+from utils.config import METRICS_ENABLED
+from utils.cache_utils import entity_cache_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}_total{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["count"] += 1
+            series["sum"] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+        return lines
+
+
+BFABRIC_READ_SECONDS = Histogram("draugr_bfabric_read_seconds", "Latency of B-Fabric reads by endpoint.")
+BFABRIC_READ_RESULTS = Histogram("draugr_bfabric_read_results", "Number of records returned by B-Fabric reads by endpoint.", SIZE_BUCKETS)
+ENTITY_LOAD_SECONDS = Histogram("draugr_entity_load_seconds", "Latency of loading the lanes of a run by flowcell size.")
+CALLBACK_SECONDS = Histogram("draugr_callback_seconds", "Latency of Dash callbacks.")
+CALLBACK_ERRORS = Counter("draugr_callback_errors", "Dash callbacks that raised an exception.")
+ENQUEUE_SECONDS = Histogram("draugr_enqueue_seconds", "Latency of enqueuing jobs by queue.")
+
+REGISTRY = [
+    BFABRIC_READ_SECONDS,
+    BFABRIC_READ_RESULTS,
+    ENTITY_LOAD_SECONDS,
+    CALLBACK_SECONDS,
+    CALLBACK_ERRORS,
+    ENQUEUE_SECONDS,
+]
+
+
+def sample_count_bucket(count: int) -> str:
+    """
+    Coarse sample count label, used to compare load times between flowcells of similar size.
+    """
+    for bound in (10, 100, 500, 1000, 3000):
+        if count <= bound:
+            return f"<={bound}"
+    return ">3000"
+
+
+@contextmanager
+def _timer(histogram: Histogram, labels: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def timer(histogram: Histogram, **labels):
+    """
+    Context manager recording the duration of its block in a histogram.
+    """
+    if not METRICS_ENABLED:
+        return nullcontext()
+    return _timer(histogram, labels)
+
+
+def observe(histogram: Histogram, value: float, **labels):
+    if METRICS_ENABLED:
+        histogram.observe(value, **labels)
+
+
+def timed_read(read: callable) -> callable:
+    """
+    Wraps a B-Fabric wrapper's read method, recording latency and result size per endpoint.
+    """
+    if not METRICS_ENABLED:
+        return read
+
+    @functools.wraps(read)
+    def wrapped(endpoint, *args, **kwargs):
+        start = time.perf_counter()
+        result = read(endpoint, *args, **kwargs)
+        BFABRIC_READ_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        BFABRIC_READ_RESULTS.observe(len(result) if result is not None else 0, endpoint=endpoint)
+        return result
+
+    return wrapped
+
+
+def instrument_callback(func: callable) -> callable:
+    """
+    Decorator recording latency and errors of a Dash callback. Apply it below @app.callback.
+    """
+    if not METRICS_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            CALLBACK_ERRORS.inc(callback=func.__name__)
+            raise
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - start, callback=func.__name__)
+
+    return wrapped
+
+
+def _entity_cache_lines() -> list:
+    stats = entity_cache_stats()
+    if not stats:
+        return []
+    entries = stats.pop("entries", 0)
+    lines = [
+        "# HELP draugr_entity_cache_events Lookups and removals of the shared entity cache by kind.",
+        "# TYPE draugr_entity_cache_events counter",
+    ]
+    lines += [f"draugr_entity_cache_events_total{_format_labels((('event', event),))} {value}" for event, value in sorted(stats.items())]
+    lines += [
+        "# HELP draugr_entity_cache_entries Payloads held by the shared entity cache.",
+        "# TYPE draugr_entity_cache_entries gauge",
+        f"draugr_entity_cache_entries {entries}",
+    ]
+    return lines
+
+
+def render_metrics() -> str:
+    lines = [line for metric in REGISTRY for line in metric.render()]
+    return "\n".join(lines + _entity_cache_lines()) + "\n"
+
+
+def register_metrics_route(server):
+    """
+    Adds the /metrics route to the Flask server under the Dash app, if metrics are enabled.
+    """
+    if not METRICS_ENABLED:
+        return
+
+    @server.route("/metrics")
+    def metrics():
+        return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
@@ -0,0 +1,154 @@
+"""
+Compact, server-side storage of extended entity payloads.
+
+Instead of the full payload, the browser's "extended-entity-data" store only holds a small
+handle, {"v": <schema version>, "key": <content digest>}, plus the few header fields the
+clientside callbacks need (orders, server, datafolder). The payload itself is stored in
+Redis in a compact form (container labels interned, lanes as index arrays, optionally
+zlib-compressed) and every app process keeps the most recently used decoded payloads in
+an in-memory LRU, so callbacks get an already decoded dict without any json.loads.
+"""
+
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from redis.exceptions import RedisError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.config import ENTITY_CACHE_TTL, PAYLOAD_LRU_SIZE, PAYLOAD_COMPRESSION
+
+PAYLOAD_VERSION = 2
+KEY_PREFIX = "draugr-ui:payload"
+
+
+def compact_payload(entity: dict) -> dict:
+    """
+    Converts an extended entity payload to the compact schema: every container label is
+    stored once in "labels", and each lane refers to its labels by index.
+    """
+    labels = []
+    index = {}
+    lanes = {}
+    for position, containers in entity.get("lanes", {}).items():
+        if containers is None:
+            lanes[position] = None
+            continue
+        lanes[position] = []
+        for label in containers:
+            if label not in index:
+                index[label] = len(labels)
+                labels.append(label)
+            lanes[position].append(index[label])
+    return {**{k: v for k, v in entity.items() if k != "lanes"}, "v": PAYLOAD_VERSION, "labels": labels, "lanes": lanes}
+
+
+def expand_payload(compact: dict) -> dict:
+    """
+    Inverse of compact_payload.
+    """
+    labels = compact.get("labels", [])
+    entity = {k: v for k, v in compact.items() if k not in ("v", "labels", "lanes")}
+    entity["lanes"] = {
+        position: None if indices is None else [labels[i] for i in indices]
+        for position, indices in compact.get("lanes", {}).items()
+    }
+    return entity
+
+
+def _encode(compact: dict) -> bytes:
+    data = json.dumps(compact, separators=(",", ":")).encode("utf-8")
+    return b"z" + zlib.compress(data) if PAYLOAD_COMPRESSION else b"j" + data
+
+
+def _decode(data: bytes) -> dict:
+    if data[:1] == b"z":
+        data = zlib.decompress(data[1:])
+    else:
+        data = data[1:]
+    return json.loads(data)
+
+
+class _LRU:
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_lru = _LRU(PAYLOAD_LRU_SIZE)
+
+
+def publish_entity(payload: str) -> dict:
+    """
+    Stores an extended entity payload (as returned by extended_entity_data) server side.
+
+    Args:
+        payload (str): The JSON payload.
+
+    Returns:
+        dict: The handle to keep in the browser, or None for an empty payload.
+    """
+    if not payload:
+        return None
+
+    key = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    entity = _lru.get(key)
+    if entity is None:
+        entity = json.loads(payload)
+        _lru.put(key, entity)
+        try:
+            redis_conn.set(f"{KEY_PREFIX}:{key}", _encode(compact_payload(entity)), ex=ENTITY_CACHE_TTL)
+        except RedisError as e:
+            print(f"Payload store failed: {e}")
+    return {
+        "v": PAYLOAD_VERSION,
+        "key": key,
+        "empty": not entity,
+        "containers": entity.get("containers", []),
+        "server": entity.get("server", ""),
+        "datafolder": entity.get("datafolder", ""),
+    }
+
+
+def resolve_entity(handle: dict):
+    """
+    Returns the decoded payload of a handle, from the process LRU or Redis.
+
+    Returns:
+        dict: The extended entity data, or None if the handle is empty or expired.
+    """
+    if not handle or handle.get("v") != PAYLOAD_VERSION:
+        return None
+
+    key = handle["key"]
+    entity = _lru.get(key)
+    if entity is not None:
+        return entity
+
+    try:
+        data = redis_conn.get(f"{KEY_PREFIX}:{key}")
+    except RedisError as e:
+        print(f"Payload lookup failed: {e}")
+        return None
+    if not data:
+        return None
+
+    entity = expand_payload(_decode(data))
+    _lru.put(key, entity)
+    return entity
@@ -0,0 +1,174 @@
+"""
+Shared, versioned snapshot of the rq queues for the queue tab.
+
+A single publisher thread (one per deployment, elected through a Redis lock) scans the
+queued, started, finished and failed registries of every queue on a fixed cadence. Only
+when something changed does it rebuild the queue layout and store it together with a new
+version. Browser tabs poll with the version they already show and get "not modified"
+(no_update) until it changes, so Redis load stays flat however many tabs are open. When it
+changes, a tab is sent only the queue cards which differ from the ones it shows, as a
+dash.Patch, rather than the whole layout.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from dash import Patch
+from plotly.utils import PlotlyJSONEncoder
+from redis.exceptions import RedisError
+from rq import Queue
+from rq.registry import StartedJobRegistry, FinishedJobRegistry, FailedJobRegistry
+from bfabric_web_apps import get_redis_queue_layout
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.config import QUEUE_SNAPSHOT_INTERVAL
+
+KEY_PREFIX = "draugr-ui:queue"
+SNAPSHOT_KEY = f"{KEY_PREFIX}:snapshot"
+VERSION_KEY = f"{KEY_PREFIX}:version"
+PUBLISHER_KEY = f"{KEY_PREFIX}:publisher"
+
+_publisher_id = f"{socket.gethostname()}:{os.getpid()}"
+_publisher_thread = None
+
+
+def snapshot_queues() -> dict:
+    """
+    Returns the job IDs of every queue's queued, started, finished and failed registries.
+    """
+    snapshot = {}
+    for queue in Queue.all(connection=redis_conn):
+        snapshot[queue.name] = {
+            "queued": queue.get_job_ids(),
+            "started": StartedJobRegistry(queue.name, connection=redis_conn).get_job_ids(),
+            "finished": FinishedJobRegistry(queue.name, connection=redis_conn).get_job_ids(),
+            "failed": FailedJobRegistry(queue.name, connection=redis_conn).get_job_ids(),
+        }
+    return snapshot
+
+
+def queue_cards(layout: dict) -> list:
+    """
+    Returns the queue cards of a serialized get_redis_queue_layout layout (a container
+    holding a row of cards, one per queue).
+    """
+    return layout["props"]["children"]["props"]["children"]
+
+
+def card_digests(layout: dict) -> list:
+    """
+    Returns a digest of each queue card of a serialized layout, in the order of the cards.
+    """
+    return [
+        hashlib.sha1(json.dumps(card, sort_keys=True).encode("utf-8")).hexdigest()
+        for card in queue_cards(layout)
+    ]
+
+
+def publish_queue_snapshot() -> str:
+    """
+    Takes a snapshot and, if it differs from the published one, publishes the rebuilt layout.
+
+    Returns:
+        str: The current snapshot version.
+    """
+    snapshot = snapshot_queues()
+    version = hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode("utf-8")).hexdigest()
+
+    current = redis_conn.get(VERSION_KEY)
+    if current and current.decode("utf-8") == version:
+        return version
+
+    layout = json.loads(json.dumps(get_redis_queue_layout(), cls=PlotlyJSONEncoder))
+    pipe = redis_conn.pipeline()
+    pipe.set(SNAPSHOT_KEY, json.dumps({
+        "version": version, "queues": snapshot, "layout": layout, "digests": card_digests(layout),
+    }))
+    pipe.set(VERSION_KEY, version)
+    pipe.execute()
+    return version
+
+
+def get_queue_snapshot(known_version: str = None):
+    """
+    Returns the published snapshot, unless the caller already has its version.
+
+    Args:
+        known_version (str, optional): The version the caller currently shows.
+
+    Returns:
+        dict: {"version", "queues", "layout", "digests"}, or None if nothing changed or nothing is published.
+    """
+    try:
+        version = redis_conn.get(VERSION_KEY)
+        if not version or version.decode("utf-8") == known_version:
+            return None
+        snapshot = redis_conn.get(SNAPSHOT_KEY)
+    except RedisError as e:
+        print(f"Queue snapshot lookup failed: {e}")
+        return None
+    return json.loads(snapshot) if snapshot else None
+
+
+def queue_layout_update(snapshot: dict, shown: dict = None):
+    """
+    Returns what to send a tab for a newly published snapshot.
+
+    If the tab shows the same queues, only the cards which changed are sent, as a dash.Patch
+    of the layout it shows. Otherwise (first poll, queues added or removed) the whole layout is.
+
+    Args:
+        snapshot (dict): The snapshot returned by get_queue_snapshot.
+        shown (dict, optional): {"version", "digests"} of the layout the tab shows.
+
+    Returns:
+        tuple: (layout or dash.Patch, {"version", "digests"} of the new layout)
+    """
+    digests = snapshot.get("digests") or card_digests(snapshot["layout"])
+    state = {"version": snapshot["version"], "digests": digests}
+    previous = (shown or {}).get("digests")
+    if previous is None or len(previous) != len(digests):
+        return snapshot["layout"], state
+
+    patch = Patch()
+    cards = queue_cards(snapshot["layout"])
+    for index, (old, new) in enumerate(zip(previous, digests)):
+        if old != new:
+            patch["props"]["children"]["props"]["children"][index] = cards[index]
+    return patch, state
+
+
+def _is_publisher() -> bool:
+    """
+    Takes or renews the publisher lease. Only the lease holder publishes snapshots.
+    """
+    lease = QUEUE_SNAPSHOT_INTERVAL * 3
+    if redis_conn.set(PUBLISHER_KEY, _publisher_id, nx=True, ex=lease):
+        return True
+    holder = redis_conn.get(PUBLISHER_KEY)
+    if holder and holder.decode("utf-8") == _publisher_id:
+        redis_conn.expire(PUBLISHER_KEY, lease)
+        return True
+    return False
+
+
+def _publish_forever():
+    while True:
+        try:
+            if _is_publisher():
+                publish_queue_snapshot()
+        except Exception as e:
+            print(f"Queue snapshot publishing failed: {e}")
+        time.sleep(QUEUE_SNAPSHOT_INTERVAL)
+
+
+def start_queue_publisher():
+    """
+    Starts the background publisher thread of this process, once.
+    """
+    global _publisher_thread
+    if _publisher_thread is None:
+        _publisher_thread = threading.Thread(target=_publish_forever, name="queue-snapshot-publisher", daemon=True)
+        _publisher_thread.start()
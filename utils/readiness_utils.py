@@ -0,0 +1,207 @@
+"""
+Pre-flight readiness of run folders.
+
+Each worker host runs an indexer (see scripts/worker.py) which keeps a view of the run
+folders under DATA_ROOT in a Redis hash: whether the run has finished, its cycle count and
+size, and the free space of the analysis folder. Folders are only re-examined when their
+modification time changed or the run was not complete yet, so a pass over the data folder
+is cheap.
+
+Submissions look up a single field of that hash (see check_run_folder) before enqueueing,
+so jobs for missing, unfinished or too large runs are refused right away instead of failing
+an hour into their queue slot.
+"""
+
+import os
+import json
+import time
+import shutil
+import xml.etree.ElementTree as ET
+from redis.exceptions import RedisError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import DATA_ROOT, ANALYSIS_ROOT
+from utils.reuse_utils import prune_manifest
+from utils.config import READINESS_INTERVAL, READINESS_SETTLE_SECONDS, READINESS_MIN_FREE_GB, READINESS_SPACE_FACTOR
+
+KEY_PREFIX = "draugr-ui:runfolders"
+
+# Files marking a finished run, per platform.
+ILLUMINA_MARKERS = ("RTAComplete.txt", "CopyComplete.txt")
+ELEMENT_MARKERS = ("RunUploaded.json",)
+
+
+def _illumina_cycles(path: str):
+    try:
+        reads = ET.parse(os.path.join(path, "RunInfo.xml")).getroot().iter("Read")
+        return sum(int(read.get("NumCycles", 0)) for read in reads)
+    except (OSError, ET.ParseError, ValueError):
+        return None
+
+
+def _element_cycles(path: str):
+    try:
+        with open(os.path.join(path, "RunParameters.json")) as f:
+            cycles = json.load(f).get("Cycles", {})
+        return sum(int(value) for value in cycles.values())
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _folder_size_gb(path: str) -> float:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return round(size / 1024 ** 3, 1)
+
+
+def inspect_run_folder(path: str, previous: dict = None) -> dict:
+    """
+    Examines one run folder.
+
+    Args:
+        path (str): The run folder.
+        previous (dict, optional): The last record of the folder, whose size is reused.
+
+    Returns:
+        dict: {"platform", "markers", "complete", "cycles", "size_gb", "mtime"}
+    """
+    markers = [name for name in ILLUMINA_MARKERS + ELEMENT_MARKERS if os.path.exists(os.path.join(path, name))]
+    mtime = os.path.getmtime(path)
+
+    if os.path.exists(os.path.join(path, "RunInfo.xml")):
+        platform = "illumina"
+        cycles = _illumina_cycles(path)
+        # Instruments copying their output write CopyComplete.txt; the others only RTAComplete.txt.
+        complete = "CopyComplete.txt" in markers or (
+            "RTAComplete.txt" in markers and time.time() - mtime > READINESS_SETTLE_SECONDS
+        )
+    elif os.path.exists(os.path.join(path, "RunParameters.json")):
+        platform = "element"
+        cycles = _element_cycles(path)
+        complete = "RunUploaded.json" in markers
+    else:
+        platform, cycles, complete = None, None, False
+
+    # A finished run no longer changes, so its size is computed once.
+    size_gb = (previous or {}).get("size_gb") if complete else None
+    if complete and size_gb is None:
+        size_gb = _folder_size_gb(path)
+
+    return {"platform": platform, "markers": markers, "complete": complete, "cycles": cycles, "size_gb": size_gb, "mtime": mtime}
+
+
+def index_run_folders(host: str, records: dict) -> dict:
+    """
+    Updates the index of a host with one pass over DATA_ROOT.
+
+    Args:
+        host (str): The host name the index is stored under.
+        records (dict): The records of the previous pass, {folder name: record}.
+
+    Returns:
+        dict: The records of this pass.
+    """
+    current = {}
+    for entry in os.scandir(DATA_ROOT):
+        if not entry.is_dir():
+            continue
+        previous = records.get(entry.name)
+        # Complete runs whose folder did not change are not looked at again.
+        if previous and previous["complete"] and previous["mtime"] == entry.stat().st_mtime:
+            current[entry.name] = previous
+            continue
+        try:
+            current[entry.name] = inspect_run_folder(entry.path, previous)
+        except OSError as e:
+            print(f"Could not inspect run folder {entry.path}: {e}")
+
+    key = f"{KEY_PREFIX}:{host}"
+    pipe = redis_conn.pipeline()
+    changed = {name: json.dumps(record) for name, record in current.items() if record != records.get(name)}
+    if changed:
+        pipe.hset(key, mapping=changed)
+    removed = [name for name in records if name not in current]
+    if removed:
+        pipe.hdel(key, *removed)
+    pipe.hset(f"{key}:meta", mapping={
+        "updated": time.time(),
+        "analysis_free_gb": round(shutil.disk_usage(ANALYSIS_ROOT).free / 1024 ** 3, 1),
+    })
+    pipe.execute()
+    return current
+
+
+def indexed_run_folders(host: str) -> dict:
+    """
+    Returns the index of a host, {folder name: record}.
+    """
+    return {
+        name.decode("utf-8"): json.loads(record)
+        for name, record in redis_conn.hgetall(f"{KEY_PREFIX}:{host}").items()
+    }
+
+
+def run_folder_indexer(host: str, interval: int = READINESS_INTERVAL):
+    """
+    Keeps the run folder index of a host up to date until the process is stopped.
+    Also drops the reuse manifest entries whose output was deleted.
+
+    Starts from the index left by the previous indexer of the host, so a restarted worker
+    doesn't examine every complete run again.
+    """
+    try:
+        records = indexed_run_folders(host)
+    except (RedisError, ValueError) as e:
+        print(f"Could not load the run folder index of {host}, rebuilding it: {e}")
+        records = {}
+    while True:
+        try:
+            records = index_run_folders(host, records)
+            prune_manifest(host)
+        except (RedisError, OSError, ValueError) as e:
+            print(f"Run folder indexer error: {e}")
+        time.sleep(interval)
+
+
+def check_run_folder(host: str, run_folder: str) -> dict:
+    """
+    Checks whether a run folder on a host is ready to be demultiplexed.
+
+    Args:
+        host (str): The host storing the run, i.e. the entity's serverlocation.
+        run_folder (str): The run's datafolder.
+
+    Returns:
+        dict: {"ready": True, False, or None if the host has no up to date index,
+               "problems": [reasons the run is not ready], "record": the indexed record or None}
+    """
+    key = f"{KEY_PREFIX}:{host}"
+    try:
+        pipe = redis_conn.pipeline()
+        pipe.hget(key, run_folder.strip("/").split("/")[0])
+        pipe.hgetall(f"{key}:meta")
+        record, meta = pipe.execute()
+    except RedisError as e:
+        print(f"Error reading the run folder index of {host}: {e}")
+        return {"ready": None, "problems": [], "record": None}
+
+    if not meta or time.time() - float(meta.get(b"updated", 0)) > 3 * READINESS_INTERVAL:
+        return {"ready": None, "problems": [], "record": None}
+    if not record:
+        return {"ready": False, "problems": [f"Run folder {run_folder} does not exist on {host}."], "record": None}
+
+    record = json.loads(record)
+    problems = []
+    if not record["complete"]:
+        problems.append("The run has not finished yet (no completion marker).")
+    if not record["cycles"]:
+        problems.append("The run's cycle count could not be read (RunInfo.xml / RunParameters.json missing).")
+    free_gb = float(meta.get(b"analysis_free_gb", 0))
+    needed_gb = max(READINESS_MIN_FREE_GB, (record["size_gb"] or 0) * READINESS_SPACE_FACTOR)
+    if free_gb < needed_gb:
+        problems.append(f"Only {free_gb:.0f} GB free in the analysis folder, {needed_gb:.0f} GB needed.")
+    return {"ready": not problems, "problems": problems, "record": record}
@@ -0,0 +1,219 @@
+"""
+Content-addressed reuse of demux outputs.
+
+A demux is fingerprinted by its inputs: the identity of the run folder (as indexed by
+utils.readiness_utils), the sample sheet rows of the demultiplexed orders, the tool flags,
+and the versions of the tool modules loaded on the worker host. Successful demux jobs carry
+their fingerprint in job.meta["reuse"]; once they finish, the worker appends it to a local
+manifest (REUSE_MANIFEST) and mirrors it to Redis. Every demux of a run writes to the same
+output folder, so a newer demux of any of the same orders supersedes the entries before it.
+The run folder indexer drops superseded entries and those whose output no longer exists.
+
+When a submission's fingerprint matches a recorded output, the user can skip straight to
+post-demux and gstore copy with --skip-demux.
+"""
+
+import os
+import re
+import fcntl
+import json
+import time
+import socket
+import hashlib
+from pathlib import Path
+from redis.exceptions import RedisError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import analysis_folder
+from utils.config import REUSE_MANIFEST
+
+KEY = "draugr-ui:reuse"
+TOOLS_KEY_PREFIX = "draugr-ui:tools"
+
+RUN_WORKER_SCRIPT = Path(__file__).resolve().parent.parent / "run_worker.sh"
+
+
+class _ManifestLock:
+    """
+    Serializes the worker processes of a host appending to and pruning the manifest.
+    """
+
+    def __enter__(self):
+        self.f = open(REUSE_MANIFEST + ".lock", "w")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def worker_modules() -> list:
+    """
+    Returns the modules loaded by run_worker.sh, e.g. ["Dev/uv", "Tools/bcl2fastq", ...].
+    """
+    try:
+        script = RUN_WORKER_SCRIPT.read_text()
+    except OSError:
+        return []
+    match = re.search(r"^module load((?:.*\\\n)*.*)$", script, re.MULTILINE)
+    if not match:
+        return []
+    return match.group(1).replace("\\\n", " ").split()
+
+
+def publish_tool_versions(host: str):
+    """
+    Publishes the versions of the modules loaded on this worker host. Lmod lists them,
+    with their resolved versions, in LOADEDMODULES.
+    """
+    loaded = os.environ.get("LOADEDMODULES")
+    modules = sorted(loaded.split(":")) if loaded else worker_modules()
+    try:
+        redis_conn.set(f"{TOOLS_KEY_PREFIX}:{host}", json.dumps(modules))
+    except RedisError as e:
+        print(f"Could not publish the tool versions of {host}: {e}")
+
+
+def tool_versions(host: str) -> list:
+    """
+    Returns the tool modules of a worker host, as published by the host, or as listed in
+    run_worker.sh if the host did not publish them.
+    """
+    try:
+        modules = redis_conn.get(f"{TOOLS_KEY_PREFIX}:{host}")
+    except RedisError:
+        modules = None
+    return json.loads(modules) if modules else worker_modules()
+
+
+def demux_fingerprint(server: str, run_folder: str, run_record: dict, sample_sheet: dict, orders: list, disable_wizard=False,
+                      is_multiome=False, bcl_flags=None, cellranger_flags=None, bases2fastq_flags=None, env=None, tools=None) -> str:
+    """
+    Hashes the inputs of a demux.
+
+    Args:
+        server (str): The host storing the run.
+        run_folder (str): The run's datafolder.
+        run_record (dict): The run folder's record in the readiness index. Without one, the
+            run folder's identity is unknown and None is returned.
+        sample_sheet (dict): {lane position: rows} of the demultiplexed orders, see
+            utils.samplesheet_utils.selected_rows.
+        orders (list): The demultiplexed orders.
+        disable_wizard, is_multiome, bcl_flags, cellranger_flags, bases2fastq_flags, env: The demux settings.
+        tools (list): The tool modules, see tool_versions.
+
+    Returns:
+        str: Hex digest, or None.
+    """
+    if not run_record or not run_record.get("complete"):
+        return None
+    inputs = {
+        "run": [server, run_folder.strip("/"), run_record.get("mtime"), run_record.get("size_gb"), run_record.get("cycles")],
+        "sample_sheet": [
+            {str(position): sorted(json.dumps(row) for row in rows) for position, rows in (sample_sheet or {}).items()},
+            sorted(str(order) for order in orders)
+        ],
+        "flags": [bool(disable_wizard), bool(is_multiome), bcl_flags or "", cellranger_flags or "", bases2fastq_flags or ""],
+        "env": env,
+        "tools": sorted(tools or []),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def reuse_meta(fingerprint: str, env: str, run_folder: str, orders: list) -> dict:
+    """
+    Returns the job meta marking a demux job's output for reuse, or {} without a fingerprint.
+    """
+    if not fingerprint:
+        return {}
+    return {"reuse": {
+        "fingerprint": fingerprint,
+        "output": os.path.join(analysis_folder(env), run_folder.strip("/")),
+        "orders": [str(order) for order in orders],
+    }}
+
+
+def find_output(fingerprint: str):
+    """
+    Returns the recorded output of an identical demux, or None.
+
+    Returns:
+        dict: {"fingerprint", "output", "orders", "host", "job_id", "finished"}
+    """
+    if not fingerprint:
+        return None
+    try:
+        record = redis_conn.hget(KEY, fingerprint)
+    except RedisError as e:
+        print(f"Error reading the reuse manifest: {e}")
+        return None
+    return json.loads(record) if record else None
+
+
+def supersedes(record: dict, other: dict) -> bool:
+    """
+    Whether record, a newer demux, overwrote the output of other: both wrote to the same
+    output folder, and they share orders.
+    """
+    return (
+        record["fingerprint"] != other["fingerprint"]
+        and record["output"] == other["output"]
+        and bool(set(record["orders"]) & set(other["orders"]))
+    )
+
+
+def record_output(job, connection):
+    """
+    Adds the output of a successful demux job to the local manifest and to Redis, and drops
+    the Redis entries it supersedes. Runs on the worker.
+    """
+    reuse = job.meta.get("reuse")
+    if not reuse:
+        return
+    record = {**reuse, "host": socket.gethostname(), "job_id": job.id, "finished": time.time()}
+    try:
+        with _ManifestLock(), open(REUSE_MANIFEST, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        superseded = [
+            fingerprint for fingerprint, other in connection.hgetall(KEY).items()
+            if supersedes(record, json.loads(other))
+        ]
+        pipe = connection.pipeline()
+        if superseded:
+            pipe.hdel(KEY, *superseded)
+        pipe.hset(KEY, reuse["fingerprint"], json.dumps(record))
+        pipe.execute()
+    except (OSError, RedisError) as e:
+        print(f"Could not record the output of job {job.id} for reuse: {e}")
+
+
+def prune_manifest(host: str):
+    """
+    Drops the manifest entries of this host which were superseded or whose output no longer
+    exists, locally and in Redis.
+    """
+    if not os.path.exists(REUSE_MANIFEST):
+        return
+    with _ManifestLock():
+        with open(REUSE_MANIFEST) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+        # Later entries of a fingerprint replace earlier ones, and later demuxes of the same output supersede them.
+        latest = {}
+        for record in records:
+            latest = {fingerprint: other for fingerprint, other in latest.items() if not supersedes(record, other)}
+            latest[record["fingerprint"]] = record
+        kept = {fingerprint: record for fingerprint, record in latest.items() if os.path.isdir(record["output"])}
+        gone = [fingerprint for fingerprint in {record["fingerprint"] for record in records} if fingerprint not in kept]
+        if not gone and len(kept) == len(records):
+            return
+
+        with open(REUSE_MANIFEST + ".tmp", "w") as f:
+            for record in kept.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(REUSE_MANIFEST + ".tmp", REUSE_MANIFEST)
+
+    # Only drop Redis entries still pointing to this host; the output may have been recreated elsewhere.
+    for fingerprint in gone:
+        current = find_output(fingerprint)
+        if current and current.get("host") == host:
+            redis_conn.hdel(KEY, fingerprint)
@@ -0,0 +1,231 @@
+"""
+Load-aware routing of Draugr jobs to sequencer host queues, with per-host admission control.
+
+Every host runs workers on a queue named after itself, and on the queues of the pipeline
+stages running next to the demux. Routing looks at each eligible host's queue depths,
+running and deferred jobs and configured capacity, refuses submissions beyond
+HOST_MAX_OUTSTANDING, and, for runs whose data several hosts can read (SHARED_DATA_HOSTS),
+picks the host with the shortest expected wait. Wait times are estimated from the predicted
+run times of the jobs ahead (see utils.runtime_utils).
+
+Submissions hold the admission lock of the hosts they may go to from routing until their
+jobs are enqueued, so concurrent submissions can't all be admitted on the same load.
+"""
+
+from contextlib import contextmanager, ExitStack
+from redis.exceptions import LockError
+from rq.job import Job, JobStatus
+from rq.registry import StartedJobRegistry, DeferredJobRegistry
+from rq.utils import utcnow
+import bfabric_web_apps
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.config import (
+    HOST_CAPACITY,
+    DEFAULT_HOST_CAPACITY,
+    HOST_MAX_OUTSTANDING,
+    SHARED_DATA_HOSTS,
+    AVERAGE_JOB_SECONDS
+)
+from utils.runtime_utils import predict_runtime
+from utils.stage_utils import STAGES, stage_queue
+
+LOCK_PREFIX = "draugr-ui:admission-lock"
+
+OUTSTANDING_STATUSES = {JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED}
+FAILED_STATUSES = {JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED}
+
+
+class AdmissionRefused(Exception):
+    """
+    Raised when no eligible host admits another job.
+    """
+
+
+def _parse_capacities(value: str) -> dict:
+    capacities = {}
+    for entry in value.split(","):
+        if ":" in entry:
+            host, capacity = entry.rsplit(":", 1)
+            capacities[host.strip()] = int(capacity)
+    return capacities
+
+
+def _parse_groups(value: str) -> list:
+    return [[host.strip() for host in group.split(",") if host.strip()] for group in value.split(";") if group.strip()]
+
+
+capacities = _parse_capacities(HOST_CAPACITY)
+shared_data_groups = _parse_groups(SHARED_DATA_HOSTS)
+
+
+def eligible_hosts(server: str) -> list:
+    """
+    Returns the hosts that can process a run stored on server, server itself first.
+    """
+    hosts = [server]
+    for group in shared_data_groups:
+        if server in group:
+            hosts += [host for host in group if host not in hosts]
+    return hosts
+
+
+@contextmanager
+def admission_lock(hosts: list):
+    """
+    Holds the admission lock of each of the hosts, taken in sorted order so that submissions
+    locking overlapping hosts can't deadlock. Callers also holding a submission lock (see
+    utils.submission_utils.fingerprint_lock) take it first.
+
+    Raises:
+        AdmissionRefused: If the locks aren't free within 30 seconds.
+    """
+    with ExitStack() as stack:
+        for host in sorted(set(hosts)):
+            try:
+                stack.enter_context(redis_conn.lock(f"{LOCK_PREFIX}:{host}", timeout=60, blocking_timeout=30))
+            except LockError:
+                raise AdmissionRefused(f"Timed out waiting for other submissions to {host}, try again.")
+        yield
+
+
+def host_queues(host: str) -> list:
+    """
+    Returns the queues a host's workers listen on: its own, and those of the pipeline stages
+    running next to the demux (see utils.stage_utils).
+    """
+    return list(dict.fromkeys([host] + [stage_queue(host, stage) for stage in STAGES]))
+
+
+def _dependency_state(job) -> str:
+    """
+    Returns "failed" if the deferred job waits on a job which failed or no longer exists,
+    directly or through other deferred jobs, "waiting" if it waits on an outstanding job,
+    and "ready" otherwise.
+    """
+    dependency_ids = [job_id.decode("utf-8") for job_id in redis_conn.smembers(job.dependencies_key)]
+    dependencies = Job.fetch_many(dependency_ids, connection=redis_conn)
+    statuses = [dependency.get_status() if dependency else None for dependency in dependencies]
+    if not job.allow_dependency_failures and any(
+        status is None or status in FAILED_STATUSES
+        or (status == JobStatus.DEFERRED and _dependency_state(dependency) == "failed")
+        for dependency, status in zip(dependencies, statuses)
+    ):
+        return "failed"
+    if any(status in OUTSTANDING_STATUSES for status in statuses):
+        return "waiting"
+    return "ready"
+
+
+def host_load(host: str) -> dict:
+    """
+    Returns the number of queued, running and deferred jobs on all queues of a host, its
+    capacity, the number of jobs counting towards HOST_MAX_OUTSTANDING, and the predicted
+    number of seconds of work these jobs have left.
+
+    Deferred jobs, such as the later stages of a staged submission, wait for other jobs before
+    they are queued. Those waiting on an outstanding job belong to the same submission, which
+    is already counted, and rq never queues those whose dependency failed, so neither counts
+    towards the limit. The latter aren't counted at all: they only leave the registry when
+    the failed job is retried.
+    """
+    queued_ids, running_ids, deferred_ids = [], [], []
+    for name in host_queues(host):
+        queued_ids += bfabric_web_apps.q(name).job_ids
+        running_ids += StartedJobRegistry(name, connection=redis_conn).get_job_ids()
+        deferred_ids += DeferredJobRegistry(name, connection=redis_conn).get_job_ids()
+
+    backlog = 0
+    deferred = ready = 0
+    for job in Job.fetch_many(queued_ids + running_ids + deferred_ids, connection=redis_conn):
+        if job is None:
+            continue
+        if job.id in deferred_ids:
+            state = _dependency_state(job)
+            if state == "failed":
+                continue
+            deferred += 1
+            ready += state == "ready"
+        seconds = predict_runtime(job.meta.get("features"))["p50"]
+        if job.started_at:
+            # Jobs running for longer than predicted are assumed to be close to done.
+            seconds = max(seconds - (utcnow() - job.started_at).total_seconds(), 0.1 * seconds)
+        backlog += seconds
+
+    return {
+        "queued": len(queued_ids),
+        "running": len(running_ids),
+        "deferred": deferred,
+        "outstanding": len(queued_ids) + len(running_ids) + ready,
+        "capacity": capacities.get(host, DEFAULT_HOST_CAPACITY),
+        "backlog_seconds": backlog,
+    }
+
+
+def expected_wait(load: dict, job_seconds: float = AVERAGE_JOB_SECONDS) -> float:
+    """
+    Estimates how long a new job would wait on a host before it starts, in seconds.
+    job_seconds is the assumed run time of jobs ahead whose run time is not predicted,
+    e.g. those counted as pending by route.
+    """
+    capacity = max(1, load["capacity"])
+    ahead = load["queued"] + load["running"] - capacity + 1
+    if ahead <= 0:
+        return 0
+    return (load.get("backlog_seconds", 0) + load.get("pending", 0) * job_seconds) / capacity
+
+
+def route(server: str, pending: dict = None, hosts: list = None) -> dict:
+    """
+    Picks the queue for a job of a run stored on server.
+
+    Args:
+        server (str): The run's serverlocation.
+        pending (dict, optional): {host: number of jobs} about to be enqueued but not yet
+            visible in Redis, e.g. earlier runs of the same batch.
+        hosts (list, optional): The candidate hosts, eligible_hosts(server) by default, e.g.
+            only the host holding a reused demux output.
+
+    Returns:
+        dict: {"host": chosen host or None, "admitted": bool, "expected_wait": seconds,
+               "reason": explanation if refused, "loads": {host: load}}
+    """
+    pending = pending or {}
+    loads = {}
+    for host in hosts or eligible_hosts(server):
+        load = host_load(host)
+        load["queued"] += pending.get(host, 0)
+        load["outstanding"] += pending.get(host, 0)
+        load["pending"] = pending.get(host, 0)
+        loads[host] = load
+
+    admissible = [host for host, load in loads.items() if load["outstanding"] < HOST_MAX_OUTSTANDING]
+    if not admissible:
+        return {
+            "host": None,
+            "admitted": False,
+            "expected_wait": None,
+            "reason": f"All eligible hosts ({', '.join(loads)}) already have {HOST_MAX_OUTSTANDING} or more outstanding jobs.",
+            "loads": loads,
+        }
+
+    # min() keeps the first of equal candidates, so the run's own server wins ties.
+    host = min(admissible, key=lambda candidate: expected_wait(loads[candidate]))
+    return {
+        "host": host,
+        "admitted": True,
+        "expected_wait": expected_wait(loads[host]),
+        "reason": "",
+        "loads": loads,
+    }
+
+
+def format_wait(seconds: float) -> str:
+    """
+    Formats a wait time for display, e.g. "1 h 20 min".
+    """
+    if not seconds:
+        return "starts immediately"
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"~{minutes} min"
+    return f"~{minutes // 60} h {minutes % 60} min"
@@ -0,0 +1,130 @@
+"""
+Runtime history and duration prediction of Draugr jobs.
+
+Jobs are enqueued with their features in job.meta["features"] (see job_features), and the
+rq callbacks in utils.callback_utils record every finished job, with its run time, in a
+capped Redis list. The run times of jobs whose commands succeeded are also kept per feature
+bucket, from specific (stage, path, lanes, sample count, multiome) to coarse (stage, path).
+Draugr jobs only succeed when their commands do (see utils.job_utils), so runs that fail
+quickly don't make predictions shorter.
+
+predict_runtime returns quantiles of the most specific bucket with enough history. It is
+used for the expected run time in the confirmation modal, and by utils.routing_utils to
+estimate how long the jobs ahead of a new one will take.
+"""
+
+import json
+import time
+from redis.exceptions import RedisError
+from rq.utils import utcnow
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.metrics_utils import sample_count_bucket
+from utils.config import AVERAGE_JOB_SECONDS, RUNTIME_HISTORY_SIZE, RUNTIME_BUCKET_SIZE, RUNTIME_MIN_SAMPLES
+
+KEY_PREFIX = "draugr-ui:runtime"
+HISTORY_KEY = f"{KEY_PREFIX}:history"
+
+
+def job_features(entity: dict, orders: list, host: str, advanced_options: list = None, is_multiome: bool = False,
+                 cellranger_flags: str = None, bases2fastq_flags: str = None, platform: str = None, stage: str = "full") -> dict:
+    """
+    Describes a Draugr job by what drives its run time.
+
+    Args:
+        entity (dict): The extended entity data of the run.
+        orders (list): The orders the job processes.
+        host (str): The host the job runs on.
+        advanced_options (list): The advanced Draugr options.
+        is_multiome (bool): Multiome mode.
+        cellranger_flags (str): Custom Cellranger flags.
+        bases2fastq_flags (str): Custom Bases2fastq flags.
+        platform (str, optional): "illumina" or "element", as indexed by utils.readiness_utils.
+        stage (str): The pipeline stage the job runs, "full" for the whole pipeline.
+
+    Returns:
+        dict: The job's features.
+    """
+    if platform == "element" or bases2fastq_flags:
+        path = "bases2fastq"
+    elif is_multiome or cellranger_flags:
+        path = "cellranger"
+    else:
+        path = "bcl2fastq"
+
+    selected = {str(order) for order in orders}
+    lanes = [
+        position for position, labels in (entity.get("lanes") or {}).items()
+        if any(label.split(" ", 1)[0] in selected for label in labels or [])
+    ]
+    samples = sum((entity.get("samples") or {}).get(position, 0) for position in lanes)
+    return {
+        "stage": stage,
+        "path": path,
+        "lanes": len(lanes),
+        "samples": samples,
+        "orders": len(orders),
+        "flags": sorted(advanced_options or []),
+        "multiome": bool(is_multiome),
+        "host": host,
+    }
+
+
+def _buckets(features: dict) -> list:
+    # Most specific first.
+    return [
+        f"{features['stage']}:{features['path']}:{features['lanes']}:{sample_count_bucket(features['samples'])}:{features['multiome']}",
+        f"{features['stage']}:{features['path']}:{features['lanes']}",
+        f"{features['stage']}:{features['path']}",
+    ]
+
+
+def record_runtime(job, connection, status: str):
+    """
+    Records a finished job in the runtime history, and its run time in its buckets if it succeeded.
+    """
+    features = job.meta.get("features")
+    if not features or not job.started_at:
+        return
+    seconds = round((utcnow() - job.started_at).total_seconds())
+    record = {**features, "job_id": job.id, "status": status, "seconds": seconds, "finished": time.time()}
+    try:
+        pipe = connection.pipeline()
+        pipe.lpush(HISTORY_KEY, json.dumps(record))
+        pipe.ltrim(HISTORY_KEY, 0, RUNTIME_HISTORY_SIZE - 1)
+        if status == "finished":
+            for bucket in _buckets(features):
+                pipe.lpush(f"{KEY_PREFIX}:{bucket}", seconds)
+                pipe.ltrim(f"{KEY_PREFIX}:{bucket}", 0, RUNTIME_BUCKET_SIZE - 1)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Could not record the runtime of job {job.id}: {e}")
+
+
+def _quantile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def predict_runtime(features: dict = None) -> dict:
+    """
+    Predicts a job's run time from the history of the most specific bucket with at least
+    RUNTIME_MIN_SAMPLES finished jobs.
+
+    Returns:
+        dict: {"p50": seconds, "p90": seconds or None, "samples": history size, "bucket": bucket or None}.
+              Without any usable history, p50 is AVERAGE_JOB_SECONDS.
+    """
+    if features:
+        try:
+            pipe = redis_conn.pipeline(transaction=False)
+            for bucket in _buckets(features):
+                pipe.lrange(f"{KEY_PREFIX}:{bucket}", 0, -1)
+            histories = pipe.execute()
+        except RedisError as e:
+            print(f"Could not read the runtime history: {e}")
+            histories = []
+        for bucket, history in zip(_buckets(features), histories):
+            if len(history) >= RUNTIME_MIN_SAMPLES:
+                values = [float(value) for value in history]
+                return {"p50": _quantile(values, 0.5), "p90": _quantile(values, 0.9), "samples": len(values), "bucket": bucket}
+    return {"p50": AVERAGE_JOB_SECONDS, "p90": None, "samples": 0, "bucket": None}
@@ -0,0 +1,201 @@
+"""
+Sample sheets built from the sample records read at entity load time.
+
+extended_entity_data keeps, per lane, one row per sample: [sample ID, name, order ID, i7
+index, i5 index]. From these rows the per-lane sample sheets are written and index
+conflicts detected, so they show in the UI before submission. Conflicts are computed once
+per set of rows and kept in Redis, so reloading a run doesn't check its barcodes again.
+
+With precomputed sample sheets enabled, the sheets are shipped with the job through
+files_as_byte_strings. run_main_job writes them before running the job's commands but
+doesn't create directories, so they are staged in ANALYSIS_ROOT, which exists on every
+host, and the command moves them to where Draugr keeps the sheets it generates,
+<analysis folder>/<run folder>/SampleSheets/SampleSheet_L<lane>.csv. They are complete
+bcl2fastq sample sheets ([Header], [Reads], [Data]), as Draugr writes them. Draugr only runs
+with --skip-ss-generation once the sheets are in place, and generates them itself otherwise.
+"""
+
+import os
+import re
+import json
+import uuid
+import shlex
+import hashlib
+from itertools import combinations
+from redis.exceptions import RedisError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import analysis_folder, ANALYSIS_ROOT
+from utils.config import ENTITY_CACHE_TTL
+
+KEY_PREFIX = "draugr-ui:samplesheet-conflicts"
+
+SAMPLESHEET_HEADER = ["Lane", "Sample_ID", "Sample_Name", "index", "index2", "Sample_Project"]
+
+# Minimum number of differing bases between two barcodes of a lane, as needed by the default
+# demultiplexing with one allowed mismatch.
+MIN_INDEX_DISTANCE = 3
+# Lanes with more samples are only checked for identical barcodes, not for close ones.
+MAX_DISTANCE_CHECK_SAMPLES = 1000
+
+_SEQUENCE = re.compile(r"^[ACGTN]+$")
+
+
+def sample_rows(samples: list) -> list:
+    """
+    Reduces B-Fabric sample records to sample sheet rows.
+    """
+    return [
+        [
+            str(sample.get("id", "")),
+            sample.get("name", ""),
+            str(sample.get("container", {}).get("id", "")),
+            (sample.get("multiplexiddmx") or "").strip().upper(),
+            (sample.get("multiplexid2dmx") or "").strip().upper(),
+        ]
+        for sample in samples
+    ]
+
+
+def _distance(a: tuple, b: tuple) -> int:
+    """
+    Returns the distance between two (i7, i5) barcodes: the larger of the mismatches of
+    their i7 and of their i5 indexes, as each index is demultiplexed with its own allowed
+    mismatches. Indexes of different lengths are compared on their common prefix.
+    """
+    return max(sum(x != y for x, y in zip(index_a, index_b)) for index_a, index_b in zip(a, b))
+
+
+def find_conflicts(rows: list) -> list:
+    """
+    Finds the index problems of one lane.
+
+    Args:
+        rows (list): The lane's sample sheet rows, see sample_rows.
+
+    Returns:
+        list: Human readable problems, empty if there are none.
+    """
+    problems = []
+    missing = [name for _, name, _, index, _ in rows if not index]
+    if missing and len(missing) < len(rows):
+        problems.append(f"{len(missing)} samples without index: {', '.join(missing[:5])}{'...' if len(missing) > 5 else ''}")
+
+    # Kit names such as 10x "SI-GA-A1" are resolved by cellranger and not compared here.
+    barcodes = [(name, (index, index2)) for _, name, _, index, index2 in rows if index and _SEQUENCE.match(index + index2)]
+    lengths = sorted({len(index) for _, _, _, index, _ in rows if index and _SEQUENCE.match(index)})
+    if len(lengths) > 1:
+        problems.append(f"Mixed i7 index lengths: {', '.join(str(length) for length in lengths)}")
+
+    seen = {}
+    for name, barcode in barcodes:
+        if barcode in seen:
+            problems.append(f"{seen[barcode]} and {name} have the same index {'+'.join(filter(None, barcode))}")
+        else:
+            seen[barcode] = name
+
+    if len(seen) <= MAX_DISTANCE_CHECK_SAMPLES:
+        for (name_a, a), (name_b, b) in combinations([(name, barcode) for barcode, name in seen.items()], 2):
+            if _distance(a, b) < MIN_INDEX_DISTANCE:
+                problems.append(
+                    f"{name_a} ({'+'.join(filter(None, a))}) and {name_b} ({'+'.join(filter(None, b))}) "
+                    f"differ in fewer than {MIN_INDEX_DISTANCE} bases"
+                )
+    return problems
+
+
+def lane_conflicts(lane_rows: dict, run_folder: str = None) -> dict:
+    """
+    Returns {lane position: problems} for the lanes with problems.
+
+    Given the run folder, the result is kept in Redis for these rows, and reused as long as
+    the selected samples of the run don't change.
+    """
+    key = None
+    if run_folder:
+        digest = hashlib.sha1(json.dumps(lane_rows, sort_keys=True).encode("utf-8")).hexdigest()
+        key = f"{KEY_PREFIX}:{run_folder.strip('/')}:{digest}"
+        try:
+            cached = redis_conn.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        except RedisError as e:
+            print(f"Could not read the sample sheet conflicts of {run_folder}: {e}")
+
+    conflicts = {}
+    for position, rows in lane_rows.items():
+        problems = find_conflicts(rows)
+        if problems:
+            conflicts[position] = problems
+
+    if key:
+        try:
+            redis_conn.set(key, json.dumps(conflicts), ex=ENTITY_CACHE_TTL)
+        except RedisError as e:
+            print(f"Could not store the sample sheet conflicts of {run_folder}: {e}")
+    return conflicts
+
+
+def selected_rows(entity: dict, orders: list) -> dict:
+    """
+    Returns {lane position: rows} restricted to the samples of the given orders.
+    """
+    selected = {str(order) for order in orders}
+    lanes = {}
+    for position, rows in (entity.get("samplesheet") or {}).items():
+        rows = [row for row in rows if row[2] in selected]
+        if rows:
+            lanes[position] = rows
+    return lanes
+
+
+def _csv_field(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"' if any(char in value for char in ',"\n') else value
+
+
+def samplesheet_csv(position: str, rows: list) -> bytes:
+    """
+    Renders one lane's sample sheet, as a complete bcl2fastq sample sheet. The read lengths
+    are left to the run folder's RunInfo.xml.
+    """
+    lines = ["[Header]", "IEMFileVersion,4", "", "[Reads]", "", "[Data]", ",".join(SAMPLESHEET_HEADER)]
+    for sample_id, name, order_id, index, index2 in rows:
+        lines.append(",".join(_csv_field(value) for value in [position, sample_id, name, index, index2, order_id]))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def samplesheet_folder(env: str, run_folder: str) -> str:
+    return os.path.join(analysis_folder(env), run_folder.strip("/"), "SampleSheets")
+
+
+def samplesheet_files(entity: dict, orders: list, env: str) -> tuple:
+    """
+    Stages the sample sheets of the given orders.
+
+    Returns:
+        tuple: (files_as_byte_strings for run_main_job, writing the sheets to ANALYSIS_ROOT,
+               bash command moving them to samplesheet_folder), or ({}, "") if the orders
+               have no samples.
+    """
+    folder = samplesheet_folder(env, entity["datafolder"])
+    # Unique per submission, so concurrent submissions of the same run don't overwrite each other's sheets.
+    prefix = os.path.join(ANALYSIS_ROOT, f".draugr_ui_{uuid.uuid4().hex[:12]}_")
+    files = {}
+    moves = [f"mkdir -p {shlex.quote(folder)}"]
+    for position, rows in selected_rows(entity, orders).items():
+        name = f"SampleSheet_L{position}.csv"
+        files[prefix + name] = samplesheet_csv(position, rows)
+        moves.append(f"mv -f {shlex.quote(prefix + name)} {shlex.quote(os.path.join(folder, name))}")
+    if not files:
+        return {}, ""
+    return files, " && ".join(moves)
+
+
+def with_samplesheets(install: str, command: str, fallback: str) -> str:
+    """
+    Runs command, using the precomputed sample sheets, once install put them in place, and
+    fallback, generating them, if it failed.
+    """
+    return (
+        f"if {install}; then {command}; "
+        f"else echo 'Could not install the precomputed sample sheets, generating them.' >&2; {fallback}; fi"
+    )
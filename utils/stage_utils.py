@@ -0,0 +1,152 @@
+"""
+Staged submission of Draugr runs.
+
+Instead of one job running the whole pipeline, a staged submission enqueues sample sheet
+generation, demux, post-demux and gstore copy as separate jobs, each depending on the one
+before. Each stage runs Draugr with the skip flags of all other stages, goes to a queue sized
+for it (see STAGES) and declares its own resources (see utils.worker_pool). The next run's
+demux can therefore start while the previous run is still copying to gstore, and a failed
+stage can be requeued without redoing the ones that finished: rq enqueues the remaining
+stages once it succeeds. A stage fails when its Draugr command does (see utils.job_utils),
+so the stages after a failed one don't run.
+"""
+
+import json
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
+import bfabric_web_apps
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import generate_draugr_command
+from utils.submission_utils import RECORD_TTL
+from utils.worker_pool import RESOURCE_PROFILES
+from utils.log_stream_utils import logged_command
+from utils.job_utils import run_draugr_job
+from utils.callback_utils import tracked
+
+KEY_PREFIX = "draugr-ui:pipeline"
+
+# Pipeline stages in order, with the Draugr flag skipping them, the suffix of their queue
+# name (appended to the host) and their resource profile.
+STAGES = [
+    {"name": "ss-generation", "skip_flag": "--skip-ss-generation", "queue_suffix": "-light", "resources": "light"},
+    {"name": "demux", "skip_flag": "--skip-demux", "queue_suffix": "", "resources": "demux"},
+    {"name": "post-demux", "skip_flag": "--skip-post-demux", "queue_suffix": "-post", "resources": "post-demux"},
+    {"name": "gstore-copy", "skip_flag": "--skip-gstore-copy", "queue_suffix": "-light", "resources": "gstore-copy"},
+]
+SKIP_FLAGS = [stage["skip_flag"] for stage in STAGES]
+DEMUX_ONLY_FLAG = "--demux-only-mode"
+
+
+def stage_queue(host: str, stage: dict) -> str:
+    """
+    Returns the name of the queue a stage runs on for a host.
+    """
+    return host + stage["queue_suffix"]
+
+
+def stage_commands(advanced_options: list = None, **command_options) -> list:
+    """
+    Builds one Draugr command per stage to run.
+
+    Stages skipped in advanced_options are left out, as are post-demux and gstore copy in
+    demux-only mode. Every command skips all stages but its own.
+
+    Args:
+        advanced_options (list): The advanced options selected by the user.
+        **command_options: The other arguments of generate_draugr_command.
+
+    Returns:
+        list: [(stage, command)] in pipeline order.
+    """
+    advanced_options = advanced_options or []
+    passthrough = [option for option in advanced_options if option not in SKIP_FLAGS]
+    stages = [stage for stage in STAGES if stage["skip_flag"] not in advanced_options]
+    if DEMUX_ONLY_FLAG in advanced_options:
+        stages = [stage for stage in stages if stage["name"] in ("ss-generation", "demux")]
+
+    commands = []
+    for stage in stages:
+        skips = [flag for flag in SKIP_FLAGS if flag != stage["skip_flag"]]
+        commands.append((stage, generate_draugr_command(advanced_options=passthrough + skips, **command_options)))
+    return commands
+
+
+def pipeline_key(env: str, server: str, run_folder: str) -> str:
+    return f"{KEY_PREFIX}:{env}:{server}:{run_folder.strip('/')}"
+
+
+def enqueue_stages(host: str, commands: list, arguments: dict, key: str, run_folder: str, features: dict = None,
+                   demux_meta: dict = None, trace_id: str = None) -> list:
+    """
+    Enqueues the stages of a pipeline on a host, each depending on the previous one.
+
+    Args:
+        host (str): The host running the pipeline.
+        commands (list): [(stage, command)], see stage_commands.
+        arguments (dict): Keyword arguments of run_main_job, without bash_commands.
+        key (str): Redis key under which the stage jobs are recorded, see pipeline_key.
+        run_folder (str): The run folder, shown in the job descriptions.
+        features (dict, optional): Runtime features of the submission, see utils.runtime_utils.job_features.
+        demux_meta (dict, optional): Additional meta of the demux stage's job, e.g. utils.reuse_utils.reuse_meta.
+        trace_id (str, optional): The trace of the submission, see utils.trace_utils.
+
+    Returns:
+        list: The stage jobs in pipeline order. The last one stays deferred until all
+              stages before it succeeded. Its meta lists all stage job IDs.
+    """
+    jobs = []
+    for stage, command in commands:
+        job_id, command, log_meta = logged_command(command, run_folder, trace_id)
+        jobs.append(bfabric_web_apps.q(stage_queue(host, stage)).enqueue(
+            run_draugr_job,
+            kwargs={**arguments, "bash_commands": [command]},
+            job_id=job_id,
+            depends_on=jobs[-1] if jobs else None,
+            description=f"{run_folder} [{stage['name']}]",
+            **tracked(
+                {
+                    **log_meta,
+                    "resources": RESOURCE_PROFILES[stage["resources"]],
+                    "stage": stage["name"],
+                    **((demux_meta or {}) if stage["name"] == "demux" else {})
+                },
+                {**features, "stage": stage["name"]} if features else None
+            )
+        ))
+    jobs[-1].meta["stages"] = [job.id for job in jobs]
+    jobs[-1].save_meta()
+    redis_conn.set(key, json.dumps([job.id for job in jobs]), ex=RECORD_TTL)
+    return jobs
+
+
+def pipeline_jobs(key: str) -> list:
+    """
+    Returns the stage jobs of the last staged submission recorded under key.
+    """
+    job_ids = redis_conn.get(key)
+    if not job_ids:
+        return []
+    jobs = []
+    for job_id in json.loads(job_ids):
+        try:
+            jobs.append(Job.fetch(job_id, connection=redis_conn))
+        except NoSuchJobError:
+            continue
+    return jobs
+
+
+def retry_failed_stages(key: str) -> list:
+    """
+    Requeues the failed stages of the pipeline recorded under key. The stages after them
+    are still deferred and run once the requeued stage succeeds; finished stages are not
+    run again.
+
+    Returns:
+        list: Names of the requeued stages.
+    """
+    retried = []
+    for job in pipeline_jobs(key):
+        if job.get_status() == JobStatus.FAILED:
+            job.requeue()
+            retried.append(job.meta.get("stage", job.id))
+    return retried
@@ -0,0 +1,99 @@
+"""
+Idempotent submission of Draugr jobs.
+
+Each submission is fingerprinted by everything that determines what Draugr will do. While a
+job with the same fingerprint is still queued or running, submitting again returns that job
+instead of enqueuing a duplicate, unless the submission is explicitly forced.
+"""
+
+import hashlib
+import json
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+
+KEY_PREFIX = "draugr-ui:submission"
+
+# A job in one of these states still counts as the active submission of its fingerprint.
+ACTIVE_STATUSES = (JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED)
+
+# How long the fingerprint -> job ID record is kept, in seconds.
+RECORD_TTL = 7 * 24 * 60 * 60
+
+
+def submission_fingerprint(server, run_folder, order_list, advanced_options=None, disable_wizard=False, is_multiome=False,
+                           bcl_flags=None, cellranger_flags=None, bases2fastq_flags=None, env=None) -> str:
+    """
+    Hashes the parameters of a Draugr submission. Order and flag order don't matter.
+
+    Returns:
+        str: Hex digest identifying the submission.
+    """
+    parameters = {
+        "server": server,
+        "run_folder": run_folder.strip("/") if run_folder else run_folder,
+        "orders": sorted(str(order) for order in order_list or []),
+        "advanced_options": sorted(advanced_options or []),
+        "disable_wizard": bool(disable_wizard),
+        "is_multiome": bool(is_multiome),
+        "bcl_flags": bcl_flags or "",
+        "cellranger_flags": cellranger_flags or "",
+        "bases2fastq_flags": bases2fastq_flags or "",
+        "env": env,
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def job_status(job: Job) -> str:
+    """
+    Returns the status of a job as a plain string, e.g. "queued".
+    """
+    return JobStatus(job.get_status()).value
+
+
+def active_submission(fingerprint: str):
+    """
+    Returns the queued or running job recorded for a fingerprint, or None.
+    """
+    job_id = redis_conn.get(f"{KEY_PREFIX}:{fingerprint}")
+    if not job_id:
+        return None
+    try:
+        job = Job.fetch(job_id.decode("utf-8"), connection=redis_conn)
+    except NoSuchJobError:
+        return None
+    return job if job.get_status() in ACTIVE_STATUSES else None
+
+
+def fingerprint_lock(fingerprint: str):
+    """
+    Returns the Redis lock serializing the submissions of a fingerprint, to be used as a
+    context manager around the active submission check and the enqueue.
+    """
+    return redis_conn.lock(f"{KEY_PREFIX}-lock:{fingerprint}", timeout=60, blocking_timeout=30)
+
+
+def submit_once(fingerprint: str, enqueue: callable, force: bool = False) -> tuple:
+    """
+    Enqueues a job unless an identical one is still queued or running.
+
+    The check and the enqueue run under a Redis lock per fingerprint, so two clicks racing
+    each other cannot both enqueue.
+
+    Args:
+        fingerprint (str): The submission fingerprint, see submission_fingerprint.
+        enqueue (callable): Enqueues the job and returns it.
+        force (bool): Enqueue even if an identical job is active.
+
+    Returns:
+        tuple: (job, duplicate) where duplicate tells whether job is the already active one.
+    """
+    with fingerprint_lock(fingerprint):
+        if not force:
+            job = active_submission(fingerprint)
+            if job:
+                return job, True
+
+        job = enqueue()
+        redis_conn.set(f"{KEY_PREFIX}:{fingerprint}", job.id, ex=RECORD_TTL)
+        return job, False
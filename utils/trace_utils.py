@@ -0,0 +1,181 @@
+"""
+End-to-end trace spans of Draugr submissions.
+
+A trace ID is created when a submission is made and carried in the meta of each of its
+jobs and, as DRAUGR_TRACE_ID, in the environment of their commands (see
+utils.log_stream_utils.logged_command). Spans are recorded along the way:
+
+  - in the web app: reading the entity, and routing and enqueueing the jobs;
+  - by the log tailer of the worker host: the time each job waited in its queue, from
+    the job's start until its command started, and the command itself;
+  - from the job output: any line "@@draugr-trace start|end <name> <epoch seconds>",
+    as written by the command wrapper and, given DRAUGR_TRACE_ID, by Draugr around its
+    stages, becomes a span <name>.
+
+Each span is appended to a Redis list per trace, read by the trace panel of the app, and,
+if TRACE_FILE is set, to that local JSON-lines file on the host recording it.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+from contextlib import contextmanager
+from redis.exceptions import RedisError
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.config import TRACING_ENABLED, TRACE_FILE, TRACE_TTL
+
+KEY_PREFIX = "draugr-ui:trace"
+
+# Prefix of the lines in a job's output marking span boundaries.
+MARKER = "@@draugr-trace"
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def record_span(trace_id: str, name: str, start: float, end: float, job_id: str = None, **attributes):
+    """
+    Records a span of a trace, in Redis and, if TRACE_FILE is set, in the local trace file.
+
+    Args:
+        trace_id (str): The trace the span belongs to. Nothing is recorded without one.
+        name (str): What the span measures, e.g. "enqueue" or "demux".
+        start (float): Start, in epoch seconds.
+        end (float): End, in epoch seconds.
+        job_id (str, optional): The job the span belongs to.
+        **attributes: Additional JSON serializable details.
+    """
+    if not TRACING_ENABLED or not trace_id:
+        return
+    line = json.dumps({
+        "trace_id": trace_id,
+        "span_id": uuid.uuid4().hex[:16],
+        "name": name,
+        "start": start,
+        "end": end,
+        "job_id": job_id,
+        "host": socket.gethostname(),
+        "attributes": attributes,
+    })
+
+    key = f"{KEY_PREFIX}:{trace_id}"
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.rpush(key, line)
+        pipe.expire(key, TRACE_TTL)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Could not record span {name} of trace {trace_id}: {e}")
+
+    if not TRACE_FILE:
+        return
+    try:
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        with open(TRACE_FILE, "a") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"Could not write span {name} of trace {trace_id} to {TRACE_FILE}: {e}")
+
+
+@contextmanager
+def span(trace_id: str, name: str, job_id: str = None, **attributes):
+    """
+    Records the code run within the with block as a span.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(trace_id, name, start, time.time(), job_id, **attributes)
+
+
+def trace_spans(trace_id: str) -> list:
+    """
+    Returns the spans recorded for a trace, ordered by start.
+    """
+    try:
+        spans = [json.loads(line) for line in redis_conn.lrange(f"{KEY_PREFIX}:{trace_id}", 0, -1)]
+    except RedisError as e:
+        print(f"Could not read trace {trace_id}: {e}")
+        return []
+    return sorted(spans, key=lambda entry: entry["start"])
+
+
+def traced_command(command: str, trace_id: str, name: str = "command") -> str:
+    """
+    Wraps a command so it runs with DRAUGR_TRACE_ID set, between a start and an end marker.
+    The end marker carries the command's exit status, which the wrapped command keeps.
+    """
+    return (
+        f"export DRAUGR_TRACE_ID={trace_id}; "
+        f"echo \"{MARKER} start {name} $(date +%s.%N)\"; "
+        f"( {command} ); status=$?; "
+        f"echo \"{MARKER} end {name} $(date +%s.%N) $status\"; "
+        f"exit $status"
+    )
+
+
+def parse_marker(line: bytes):
+    """
+    Returns (event, name, time, rest) of a marker line, or None for any other line.
+    """
+    # Lines of Draugr's log file carry a timestamp and level before the marker.
+    position = line.find(MARKER.encode("utf-8"))
+    if position < 0:
+        return None
+    fields = line[position:].decode("utf-8", "replace").split()
+    try:
+        return fields[1], fields[2], float(fields[3]), fields[4:]
+    except (IndexError, ValueError):
+        return None
+
+
+def job_trace_id(job_id: str):
+    """
+    Returns the trace ID a job was enqueued with, or None.
+    """
+    try:
+        return Job.fetch(job_id, connection=redis_conn).meta.get("trace_id")
+    except NoSuchJobError:
+        return None
+
+
+def waterfall(spans: list) -> dict:
+    """
+    Returns a Plotly figure showing the spans of a trace as a waterfall, one bar per span,
+    in seconds since the first one started.
+    """
+    if not spans:
+        return {"data": [], "layout": {"title": {"text": "No spans recorded yet"}, "height": 200}}
+
+    origin = min(entry["start"] for entry in spans)
+    labels = [
+        f"{index + 1}. {entry['name']}" + (f" ({entry['job_id'][:8]})" if entry.get("job_id") else "")
+        for index, entry in enumerate(spans)
+    ]
+    return {
+        "data": [{
+            "type": "bar",
+            "orientation": "h",
+            "y": labels,
+            "base": [entry["start"] - origin for entry in spans],
+            "x": [max(entry["end"] - entry["start"], 0) for entry in spans],
+            "hovertext": [
+                f"{entry['name']} on {entry['host']}: {entry['end'] - entry['start']:.1f} s"
+                + "".join(f"<br>{key}: {value}" for key, value in (entry.get("attributes") or {}).items())
+                for entry in spans
+            ],
+            "hoverinfo": "text",
+        }],
+        "layout": {
+            "xaxis": {"title": {"text": "Seconds since the submission"}},
+            "yaxis": {"autorange": "reversed", "automargin": True},
+            "height": max(200, 40 + 30 * len(spans)),
+            "margin": {"t": 20},
+        },
+    }
@@ -0,0 +1,258 @@
+"""
+Automatic submission of runs as soon as sequencing completes.
+
+The run watcher (scripts/run_watcher.py, or scripts/worker.py --watch) runs next to the
+worker on each sequencer host. It reads the run folder index kept by the host's readiness
+indexer (see utils.readiness_utils), and every run that completed recently, on an
+instrument named in WATCHER_INSTRUMENTS and outside WATCHER_QUIET_HOURS, is resolved in
+B-Fabric and submitted with all its orders and WATCHER_FLAGS.
+
+Submissions go through the same fingerprinting as manual ones (see
+utils.submission_utils.submit_once), with the defaults of the app's switches, so the watcher
+never enqueues a job identical to one already queued or running, a Submit with default
+options in the app finds the watcher's job, and runs whose demux output can be reused are
+left alone. They are also routed and admitted like manual ones (see utils.routing_utils):
+runs refused because every eligible host is full are tried again later. Each run looked at is recorded in Redis, so restarting the watcher doesn't submit
+it again. Runs which could not be submitted yet are tried again with a backoff doubling from
+WATCHER_INTERVAL up to WATCHER_MAX_BACKOFF.
+"""
+
+import json
+import time
+import bfabric_web_apps
+from bfabric import Bfabric
+from datetime import datetime
+from redis.exceptions import RedisError
+from bfabric_web_apps.utils.redis_connection import redis_conn
+from utils.draugr_utils import generate_draugr_command, BFABRIC_LOGIN_CONFIG
+from utils.entity_utils import run_folder_entity
+from utils.readiness_utils import check_run_folder, KEY_PREFIX as RUNFOLDERS_KEY_PREFIX
+from utils.submission_utils import submission_fingerprint, submit_once
+from utils.routing_utils import route, eligible_hosts, admission_lock, AdmissionRefused
+from utils.reuse_utils import demux_fingerprint, tool_versions, find_output, reuse_meta
+from utils.samplesheet_utils import selected_rows
+from utils.log_stream_utils import logged_command
+# run_commands used to live here; jobs enqueued before it moved still refer to this module.
+from utils.job_utils import run_commands
+from utils.runtime_utils import job_features
+from utils.callback_utils import tracked
+from utils.worker_pool import RESOURCE_PROFILES
+from utils.config import (
+    WATCHER_INSTRUMENTS, WATCHER_FLAGS, WATCHER_QUIET_HOURS, WATCHER_ENV, WATCHER_INTERVAL, WATCHER_MAX_AGE_HOURS,
+    WATCHER_MAX_BACKOFF
+)
+
+KEY_PREFIX = "draugr-ui:watcher"
+
+# Runs in one of these states are done with; the others are tried again after a backoff, see retry_delay.
+FINAL_STATUSES = ("submitted", "duplicate", "reused")
+
+
+def instrument_of(run_folder: str) -> str:
+    """
+    Returns the instrument ID of a run folder named <date>_<instrument>_..., or "".
+    """
+    fields = run_folder.strip("/").split("/")[0].split("_")
+    return fields[1] if len(fields) > 1 else ""
+
+
+def instrument_allowed(run_folder: str, instruments: str = WATCHER_INSTRUMENTS) -> bool:
+    allowed = [instrument.strip() for instrument in instruments.split(",") if instrument.strip()]
+    return not allowed or instrument_of(run_folder) in allowed
+
+
+def in_quiet_hours(now: datetime = None, quiet_hours: str = WATCHER_QUIET_HOURS) -> bool:
+    """
+    Tells whether the local time is within the quiet hours, given as "start-end" in whole
+    hours. A window such as "22-6" spans midnight.
+    """
+    if not quiet_hours.strip():
+        return False
+    start, end = (int(hour) for hour in quiet_hours.split("-"))
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def bfabric_wrapper(env: str = WATCHER_ENV):
+    """
+    Returns a B-Fabric wrapper for the environment, logged in with the same configuration as Draugr.
+    """
+    return Bfabric.from_config(config_env={"test": "TEST", "production": "PRODUCTION"}.get(env), config_path=BFABRIC_LOGIN_CONFIG)
+
+
+def handled_runs(host: str) -> dict:
+    """
+    Returns {run folder: {"status", "job_id", "time", "attempts", "retry_at"}} of the runs the
+    watcher of a host looked at. Runs in one of FINAL_STATUSES are done with; the others are
+    tried again from retry_at on.
+    """
+    return {
+        name.decode("utf-8"): json.loads(value)
+        for name, value in redis_conn.hgetall(f"{KEY_PREFIX}:{host}").items()
+    }
+
+
+def retry_delay(attempts: int, interval: int = WATCHER_INTERVAL, max_backoff: int = WATCHER_MAX_BACKOFF) -> float:
+    """
+    Returns the seconds to wait before the next attempt at a run after attempts failed ones.
+    """
+    return min(interval * 2 ** (attempts - 1), max_backoff)
+
+
+def submit_run(host: str, wrapper, run_folder: str, env: str = WATCHER_ENV, flags: list = None) -> tuple:
+    """
+    Submits all orders of the run in a run folder of a host.
+
+    Args:
+        host (str): The host storing the run. The job goes to it, or to another host able to read the run.
+        wrapper (Bfabric): The B-Fabric wrapper to resolve the run with.
+        run_folder (str): The run folder's name under DATA_ROOT.
+        env (str): Environment to submit to, 'test' or 'production'.
+        flags (list): Advanced Draugr options.
+
+    Returns:
+        tuple: (status, job ID or None). status is one of FINAL_STATUSES, "unresolved",
+               "no orders", "not ready" or "refused".
+    """
+    entity = run_folder_entity(wrapper, run_folder, server=host)
+    if not entity:
+        return "unresolved", None
+    if not entity.get("containers"):
+        return "no orders", None
+
+    readiness = check_run_folder(host, entity["datafolder"])
+    if readiness["ready"] is False:
+        print(f"Run folder {run_folder} not ready: {readiness['problems']}")
+        return "not ready", None
+
+    # The other options keep the defaults of the app's switches, so the fingerprint is the one of a default Submit.
+    options = dict(
+        advanced_options=sorted(flags or []),
+    )
+    fingerprint = demux_fingerprint(
+        host,
+        entity["datafolder"],
+        readiness["record"],
+        selected_rows(entity, entity["containers"]),
+        entity["containers"],
+        env=env,
+        tools=tool_versions(host)
+    )
+    reused = find_output(fingerprint)
+    if reused:
+        return "reused", reused["job_id"]
+
+    command = generate_draugr_command(
+        server=host,
+        run_folder=entity["datafolder"],
+        order_list=entity["containers"],
+        env=env,
+        **options
+    )
+
+    def enqueue():
+        # Like a Submit in the app: the hosts stay locked until the job is in its queue.
+        with admission_lock(eligible_hosts(host)):
+            decision = route(host)
+            if not decision["admitted"]:
+                raise AdmissionRefused(decision["reason"])
+            return enqueue_admitted(decision["host"])
+
+    def enqueue_admitted(target):
+        job_id, logged, log_meta = logged_command(command, entity["datafolder"])
+        reuse = {} if "--skip-demux" in options["advanced_options"] else reuse_meta(fingerprint, env, entity["datafolder"], entity["containers"])
+        return bfabric_web_apps.q(target).enqueue(
+            run_commands,
+            kwargs={"bash_commands": [logged]},
+            job_id=job_id,
+            description=f"Automatic submission of {run_folder}",
+            **tracked(
+                {**log_meta, "resources": RESOURCE_PROFILES["demux"], "automatic": True, **reuse},
+                job_features(
+                    entity,
+                    entity["containers"],
+                    target,
+                    advanced_options=options["advanced_options"],
+                    platform=(readiness["record"] or {}).get("platform")
+                )
+            )
+        )
+
+    try:
+        job, duplicate = submit_once(
+            submission_fingerprint(
+                server=host,
+                run_folder=entity["datafolder"],
+                order_list=entity["containers"],
+                env=env,
+                **options
+            ),
+            enqueue
+        )
+    except AdmissionRefused as e:
+        print(f"Automatic submission of {run_folder} refused: {e}")
+        return "refused", None
+    return ("duplicate" if duplicate else "submitted"), job.id
+
+
+def watch_pass(host: str, wrapper, max_age_hours: float = WATCHER_MAX_AGE_HOURS) -> dict:
+    """
+    Submits the runs of a host which completed since the last pass.
+
+    Returns:
+        dict: {run folder: status} of the runs looked at in this pass.
+    """
+    if in_quiet_hours():
+        return {}
+
+    handled = handled_runs(host)
+    records = {name.decode("utf-8"): json.loads(record) for name, record in redis_conn.hgetall(f"{RUNFOLDERS_KEY_PREFIX}:{host}").items()}
+    # Forget the runs whose folder was removed.
+    gone = [name for name in handled if name not in records]
+    if gone:
+        redis_conn.hdel(f"{KEY_PREFIX}:{host}", *gone)
+
+    statuses = {}
+    now = time.time()
+    for name, record in records.items():
+        if not record["complete"] or not instrument_allowed(name):
+            continue
+        previous = handled.get(name)
+        if previous and (previous["status"] in FINAL_STATUSES or previous.get("retry_at", 0) > now):
+            continue
+        # Older runs were there before the watcher, or were left alone on purpose.
+        if now - record["mtime"] > max_age_hours * 60 * 60:
+            continue
+
+        try:
+            status, job_id = submit_run(host, wrapper, name, flags=[flag.strip() for flag in WATCHER_FLAGS.split(",") if flag.strip()])
+        except Exception as e:
+            print(f"Automatic submission of {name} failed: {e}")
+            status, job_id = "error", None
+        statuses[name] = status
+
+        entry = {"status": status, "job_id": job_id, "time": time.time()}
+        if status in FINAL_STATUSES:
+            print(f"Run watcher: {name} {status}{f' ({job_id})' if job_id else ''}")
+        else:
+            # Not submitted yet: tried again later, less often with every attempt.
+            entry["attempts"] = (previous or {}).get("attempts", 0) + 1
+            entry["retry_at"] = entry["time"] + retry_delay(entry["attempts"])
+            print(f"Run watcher: {name} {status}, attempt {entry['attempts']}, next in {entry['retry_at'] - entry['time']:.0f} s")
+        redis_conn.hset(f"{KEY_PREFIX}:{host}", name, json.dumps(entry))
+    return statuses
+
+
+def run_watcher(host: str, interval: int = WATCHER_INTERVAL):
+    """
+    Watches the run folders of a host until the process is stopped.
+    """
+    wrapper = bfabric_wrapper()
+    while True:
+        try:
+            watch_pass(host, wrapper)
+        except (RedisError, ValueError) as e:
+            print(f"Run watcher error: {e}")
+        time.sleep(interval)
@@ -0,0 +1,296 @@
+"""
+Pool of rq worker processes sharing the resources of one sequencer host.
+
+A supervisor process starts N worker processes on the same queues. Jobs declare what they
+need in job.meta["resources"] (cores, memory_gb, scratch_gb, see RESOURCE_PROFILES) and a
+worker only starts a job once the host has enough of each resource free, so light
+post-demux or gstore-copy jobs can run next to a heavy demux without oversubscribing it.
+Jobs which don't fit yet go back to their queue (see SlotWorker).
+
+Signals sent to the supervisor:
+  - SIGTERM / SIGINT: drain, i.e. let every worker finish its current job, then exit.
+  - SIGHUP: rolling restart, one worker at a time, each after finishing its current job.
+"""
+
+import os
+import shutil
+import signal
+import time
+import multiprocessing
+from redis import Redis
+from rq import Worker, Queue
+from utils.trace_utils import record_span
+
+# What each kind of job needs. Jobs without a declaration get DEFAULT_RESOURCES.
+RESOURCE_PROFILES = {
+    "demux": {"cores": 32, "memory_gb": 128, "scratch_gb": 500},
+    "post-demux": {"cores": 8, "memory_gb": 32, "scratch_gb": 100},
+    "gstore-copy": {"cores": 2, "memory_gb": 4, "scratch_gb": 0},
+    "light": {"cores": 1, "memory_gb": 2, "scratch_gb": 0},
+}
+DEFAULT_RESOURCES = RESOURCE_PROFILES["light"]
+RESOURCE_NAMES = ("cores", "memory_gb", "scratch_gb")
+
+# Seconds a worker holds the resources of its job without renewing its lease. Workers renew
+# it with every heartbeat of the job (job_monitoring_interval, 30 seconds by default).
+SLOT_LEASE_SECONDS = 300
+# Seconds a worker leaves aside the queues whose next job didn't fit, unless resources are released earlier.
+SLOT_WAIT_HEARTBEAT = 30
+# Seconds between looks at the other queues meanwhile.
+SLOT_POLL_SECONDS = 5
+
+
+def host_resources(scratch_path: str = "/") -> dict:
+    """
+    Returns the cores, memory and free scratch space of this host.
+    """
+    memory_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    scratch_gb = shutil.disk_usage(scratch_path).free / 1024 ** 3 if os.path.exists(scratch_path) else 0
+    return {"cores": os.cpu_count() or 1, "memory_gb": int(memory_gb), "scratch_gb": int(scratch_gb)}
+
+
+class ResourceSlots:
+    """
+    Resource budget shared by all worker processes of a pool.
+
+    Each worker holds at most one lease, on the resources of the job it runs. What is free is
+    what the leases which haven't expired leave of the totals, so the resources of a worker
+    which died are back once its lease expires, or as soon as the supervisor releases them.
+    """
+
+    def __init__(self, ctx, totals: dict, holders: int):
+        self.totals = dict(totals)
+        self._held = ctx.Array("d", holders * len(RESOURCE_NAMES), lock=False)
+        self._expires = ctx.Array("d", holders, lock=False)
+        self._releases = ctx.Value("i", 0, lock=False)
+        self._condition = ctx.Condition()
+
+    def _clamp(self, request: dict) -> dict:
+        # A job asking for more than the host has would never start; give it the whole host instead.
+        return {name: min(float(request.get(name, 0)), self.totals[name]) for name in RESOURCE_NAMES}
+
+    def _free(self) -> dict:
+        now = time.time()
+        free = {name: float(self.totals[name]) for name in RESOURCE_NAMES}
+        for holder, expires in enumerate(self._expires):
+            if expires > now:
+                for index, name in enumerate(RESOURCE_NAMES):
+                    free[name] -= self._held[holder * len(RESOURCE_NAMES) + index]
+        return free
+
+    def try_acquire(self, holder: int, request: dict, ttl: float = SLOT_LEASE_SECONDS) -> dict:
+        """
+        Takes the requested resources for holder if every one of them is free.
+
+        Args:
+            holder (int): Index of the worker in the pool.
+            request (dict): {"cores": .., "memory_gb": .., "scratch_gb": ..}
+            ttl (float): Seconds until the lease expires, unless renewed.
+
+        Returns:
+            dict: The amounts taken, or None if a resource is short.
+        """
+        request = self._clamp(request)
+        with self._condition:
+            free = self._free()
+            if any(free[name] < request[name] for name in RESOURCE_NAMES):
+                return None
+            for index, name in enumerate(RESOURCE_NAMES):
+                self._held[holder * len(RESOURCE_NAMES) + index] = request[name]
+            self._expires[holder] = time.time() + ttl
+        return request
+
+    def renew(self, holder: int, ttl: float = SLOT_LEASE_SECONDS):
+        with self._condition:
+            if self._expires[holder]:
+                self._expires[holder] = time.time() + ttl
+
+    def release(self, holder: int):
+        with self._condition:
+            self._expires[holder] = 0
+            for index in range(len(RESOURCE_NAMES)):
+                self._held[holder * len(RESOURCE_NAMES) + index] = 0
+            self._releases.value += 1
+            self._condition.notify_all()
+
+    def releases(self) -> int:
+        """
+        Returns the number of releases so far, which changes whenever resources may have become free.
+        """
+        with self._condition:
+            return self._releases.value
+
+    def wait(self, releases: int, timeout: float):
+        """
+        Waits until resources are released after the releases-th release, for at most timeout seconds.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._releases.value != releases, timeout=timeout)
+
+    def free(self) -> dict:
+        with self._condition:
+            return self._free()
+
+
+class SlotWorker(Worker):
+    """
+    rq worker that only runs a job once the job's declared resources are free.
+
+    A job whose resources are short goes back to the head of its queue, where routing still
+    counts it and any worker of the pool takes it once they are free. Meanwhile the worker
+    goes on with the jobs of its other queues, and looks at that queue again once resources
+    were released, or after SLOT_WAIT_HEARTBEAT seconds.
+    """
+
+    slots = None
+    # Index of the worker in the pool, under which it holds its lease.
+    slot = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blocked = set()
+        self.blocked_releases = 0
+
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        deadline = time.time() + SLOT_WAIT_HEARTBEAT
+        while self.blocked and self.slots.releases() == self.blocked_releases and time.time() < deadline:
+            if self._stop_requested:
+                return None
+            self.heartbeat()
+            queues = [queue for queue in self._ordered_queues if queue.name not in self.blocked]
+            result = self.queue_class.dequeue_any(
+                queues,
+                None,
+                connection=self.connection,
+                job_class=self.job_class,
+                serializer=self.serializer,
+                death_penalty_class=self.death_penalty_class
+            ) if queues else None
+            if result is not None:
+                return result
+            self.slots.wait(self.blocked_releases, min(SLOT_POLL_SECONDS, max(deadline - time.time(), 0)))
+        self.blocked = set()
+        return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+
+    def execute_job(self, job, queue):
+        request = (job.meta or {}).get("resources", DEFAULT_RESOURCES)
+        releases = self.slots.releases()
+        if not self.slots.try_acquire(self.slot, request):
+            self.log.info("Job %s needs %s, free: %s, putting it back", job.id, request, self.slots.free())
+            if "slot_wait_since" not in job.meta:
+                job.meta["slot_wait_since"] = time.time()
+                job.save_meta()
+            queue.push_job_id(job.id, at_front=True)
+            self.blocked.add(queue.name)
+            self.blocked_releases = releases
+            return
+
+        if "slot_wait_since" in job.meta:
+            record_span(job.meta.get("trace_id"), "slot wait", job.meta["slot_wait_since"], time.time(), job.id, resources=request)
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            self.slots.release(self.slot)
+
+    def maintain_heartbeats(self, job):
+        super().maintain_heartbeats(job)
+        self.slots.renew(self.slot)
+
+
+def _run_pool_worker(index: int, slots: ResourceSlots, host: str, port: int, queue_names: list, username=None, password=None):
+    # Each process needs its own Redis connection.
+    if username and password:
+        conn = Redis(host=host, port=port, username=username, password=password, socket_keepalive=True)
+    else:
+        conn = Redis(host=host, port=port, socket_keepalive=True)
+
+    SlotWorker.slots = slots
+    SlotWorker.slot = index
+    worker = SlotWorker(
+        [Queue(name, connection=conn) for name in queue_names],
+        connection=conn,
+        name=f"{os.uname().nodename}.{os.getpid()}.pool-{index}"
+    )
+    worker.work(logging_level="INFO")
+
+
+def run_worker_pool(host: str, port: int, queue_names: list, processes: int, resources: dict, username=None, password=None):
+    """
+    Runs and supervises a pool of SlotWorker processes until drained.
+
+    Args:
+        host (str): Redis host.
+        port (int): Redis port.
+        queue_names (list): Queues every worker listens to.
+        processes (int): Number of worker processes.
+        resources (dict): Resource budget of the pool, see host_resources.
+        username (str, optional): Redis username.
+        password (str, optional): Redis password.
+    """
+    ctx = multiprocessing.get_context("fork")
+    slots = ResourceSlots(ctx, resources, processes)
+    workers = {}
+    # restart: workers waiting for their rolling restart; restarting: the worker finishing its job before it.
+    state = {"draining": False, "restart": [], "restarting": None}
+
+    def start(index):
+        process = ctx.Process(
+            target=_run_pool_worker,
+            args=(index, slots, host, port, queue_names, username, password),
+            name=f"pool-worker-{index}"
+        )
+        process.start()
+        workers[index] = process
+        print(f"Started pool worker {index} (pid {process.pid}) on queues {queue_names}")
+
+    def drain(signum, frame):
+        if state["draining"]:
+            return
+        print("Draining worker pool: waiting for running jobs to finish.")
+        state["draining"] = True
+        state["restart"] = []
+        for process in workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    def rolling_restart(signum, frame):
+        if state["draining"]:
+            return
+        print("Rolling restart of the worker pool.")
+        state["restart"] = [index for index in workers if index != state["restarting"]]
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
+    signal.signal(signal.SIGHUP, rolling_restart)
+
+    print(f"Worker pool with {processes} processes and resources {resources}")
+    for index in range(processes):
+        start(index)
+
+    while workers:
+        # One worker at a time, so the others keep taking jobs. The loop below starts it again
+        # once it exited, and meanwhile goes on supervising the rest of the pool.
+        if state["restart"] and state["restarting"] is None and not state["draining"]:
+            index = state["restart"].pop(0)
+            process = workers.get(index)
+            if process is not None and process.is_alive():
+                # Warm shutdown: the worker exits once its current job is done.
+                os.kill(process.pid, signal.SIGTERM)
+                state["restarting"] = index
+
+        for index, process in list(workers.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            # A worker killed while running a job never released its resources.
+            slots.release(index)
+            if index == state["restarting"]:
+                state["restarting"] = None
+            if state["draining"]:
+                del workers[index]
+            else:
+                print(f"Pool worker {index} exited with code {process.exitcode}, restarting.")
+                start(index)
+        time.sleep(1)
+
+    print("Worker pool drained.")